@@ -0,0 +1,62 @@
+"""
+Benchmarks how root parallel search scales with the number of workers.
+
+For every worker count a number of decisions is planned in a toy world,
+whose goal is three steps below the start, i.e. the best action is [0, -1].
+The iterations per second and the fraction of correct decisions are
+reported.
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from mcts.mcts import MCTS
+from mcts.graph import StateNode
+from mcts.states.toy_world_state import ToyWorld, ToyWorldState
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+
+def run(workers, n, trials):
+    start = np.array([50, 50])
+    world = ToyWorld([100, 100], False, start - np.array([0, 3]),
+                     np.array([-1, -1]))
+    uct = MCTS(tree_policies.UCB1(10), default_policies.immediate_reward,
+               backups.Bellman(0.6), workers=workers)
+
+    correct = 0
+    duration = 0
+    try:
+        uct(StateNode(None, ToyWorldState(start, world)), n=workers)  # warm up
+        for _ in range(trials):
+            root = StateNode(None, ToyWorldState(start, world))
+            t = time.time()
+            best_action = uct(root, n=n)
+            duration += time.time() - t
+            correct += (best_action.action == np.array([0, -1])).all()
+    finally:
+        uct.close()
+
+    return n * trials / duration, correct / trials
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', '-w', type=int, nargs='+',
+                        default=[1, 2, 4, 8],
+                        help='The worker counts to benchmark.')
+    parser.add_argument('--mcsamples', '-m', type=int, default=1000,
+                        help='How many monte carlo runs per decision.')
+    parser.add_argument('--trials', '-t', type=int, default=10,
+                        help='How many decisions per worker count.')
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>10}".format("workers", "iterations/s", "correct"))
+    for workers in args.workers:
+        speed, quality = run(workers, args.mcsamples, args.trials)
+        print("{:>8} {:>12.0f} {:>10.2f}".format(workers, speed, quality))
@@ -0,0 +1,216 @@
+"""
+Benchmark suite for the search throughput and memory.
+
+Every combination of tree policy, backup and default policy is run on the
+toy world and on a synthetic state with a configurable branching factor,
+for several numbers of iterations. For each case the iterations per second
+and the peak memory allocated per tree node are measured.
+
+The results can be saved as a JSON baseline and later runs compared to it,
+which reports every case that got slower or bigger than the tolerance
+allows and exits with status 1. Run it from the repository root, the
+baseline of the default cases is kept in benchmarks/baseline.json:
+
+  python -m benchmarks.search --save benchmarks/baseline.json
+  python -m benchmarks.search --compare benchmarks/baseline.json
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+
+from mcts.mcts import MCTS
+from mcts.graph import StateNode
+from mcts.states.toy_world_state import ToyWorld, ToyWorldState
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+
+class BranchingState(object):
+    """
+    A synthetic state with a fixed number of actions, which becomes
+    terminal after depth steps. Like the UCBTestState of the tests, but
+    every action leads to a different state with a different reward.
+    """
+    def __init__(self, branching, path=(), depth=10):
+        self.branching = branching
+        self.path = path
+        self.depth = depth
+        self.actions = list(range(branching))
+
+    def perform(self, action):
+        return BranchingState(self.branching, self.path + (action,),
+                              self.depth)
+
+    def is_terminal(self):
+        return len(self.path) >= self.depth
+
+    def reward(self, parent, action):
+        return -(action % 3)
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+
+def toy_world_state(branching):
+    world = ToyWorld([100, 100], False, np.array([100, 100]),
+                     np.array([-1, -1]))
+    return ToyWorldState(np.array([50, 50]), world)
+
+
+STATES = {'toy_world': toy_world_state,
+          'branching': BranchingState}
+
+TREE_POLICIES = {'ucb1': lambda: tree_policies.UCB1(1.41),
+                 'flat': lambda: tree_policies.flat}
+
+BACKUPS = {'bellman': lambda: backups.Bellman(0.6),
+           'monte_carlo': lambda: backups.monte_carlo}
+
+DEFAULT_POLICIES = {
+    'immediate_reward': lambda: default_policies.immediate_reward,
+    'k_step': lambda: default_policies.RandomKStepRollOut(5),
+    'terminal': lambda: default_policies.RandomTerminalRollOut(),
+}
+
+# the toy world is never terminal, so a terminal roll-out would not stop
+NON_TERMINATING = {'toy_world'}
+
+
+def cases(states, iterations, branchings):
+    """
+    All combinations of the benchmarked components.
+    :return: A generator of dicts describing the cases.
+    """
+    for (state, tree_policy, backup, default_policy, n,
+         branching) in itertools.product(states, sorted(TREE_POLICIES),
+                                         sorted(BACKUPS),
+                                         sorted(DEFAULT_POLICIES),
+                                         iterations, branchings):
+        if state == 'toy_world' and branching != branchings[0]:
+            # the toy world always has four actions
+            continue
+        if state in NON_TERMINATING and default_policy == 'terminal':
+            continue
+        yield dict(state=state, tree_policy=tree_policy, backup=backup,
+                   default_policy=default_policy, n=n,
+                   branching=branching if state == 'branching' else 4)
+
+
+def case_name(case):
+    return "{state}/b{branching}/{tree_policy}/{backup}/" \
+           "{default_policy}/n{n}".format(**case)
+
+
+def _search(case, seed):
+    root = StateNode(None, STATES[case['state']](case['branching']))
+    uct = MCTS(TREE_POLICIES[case['tree_policy']](),
+               DEFAULT_POLICIES[case['default_policy']](),
+               BACKUPS[case['backup']](), rng=seed)
+    start = timer()
+    uct(root, n=case['n'])
+    return timer() - start, uct.last_search.nodes
+
+
+def run(case, repeat=3):
+    """
+    Benchmarks one case. The fastest of repeat searches is timed, the
+    memory is measured in an extra search, as tracing slows it down.
+    :param case: A dict as generated by cases()
+    :param repeat: The number of timed searches
+    :return: A dict with the iterations per second and the peak bytes per
+    node.
+    """
+    elapsed = min(_search(case, seed)[0] for seed in range(repeat))
+
+    tracemalloc.start()
+    try:
+        _, nodes = _search(case, 0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return dict(iterations_per_second=case['n'] / elapsed,
+                bytes_per_node=peak / nodes, nodes=nodes)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Finds the regressions compared to a baseline.
+    :param results: A dict of case names to the results of run()
+    :param baseline: The same for the baseline
+    :param tolerance: The allowed relative deterioration
+    :return: A list of messages, one for every regression.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if (result['iterations_per_second'] <
+                old['iterations_per_second'] * (1 - tolerance)):
+            regressions.append("{}: {:.0f} instead of {:.0f} iterations/s"
+                               .format(name, result['iterations_per_second'],
+                                       old['iterations_per_second']))
+        if result['bytes_per_node'] > old['bytes_per_node'] * (1 + tolerance):
+            regressions.append("{}: {:.0f} instead of {:.0f} bytes/node"
+                               .format(name, result['bytes_per_node'],
+                                       old['bytes_per_node']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--states', nargs='+', default=sorted(STATES),
+                        choices=sorted(STATES),
+                        help='The states to benchmark.')
+    parser.add_argument('--iterations', '-n', type=int, nargs='+',
+                        default=[100, 1000],
+                        help='The tree sizes in iterations per search.')
+    parser.add_argument('--branching', '-b', type=int, nargs='+',
+                        default=[2, 8],
+                        help='The branching factors of the synthetic state.')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='How many searches to time per case.')
+    parser.add_argument('--save', help='Save the results as JSON here.')
+    parser.add_argument('--compare', help='A JSON baseline to compare to.')
+    parser.add_argument('--tolerance', '-t', type=float, default=.2,
+                        help='The allowed relative regression.')
+    args = parser.parse_args()
+
+    print("{:<50} {:>12} {:>11}".format("case", "iterations/s", "bytes/node"))
+    results = {}
+    for case in cases(args.states, args.iterations, args.branching):
+        name = case_name(case)
+        results[name] = dict(case, **run(case, args.repeat))
+        print("{:<50} {:>12.0f} {:>11.0f}".format(
+            name, results[name]['iterations_per_second'],
+            results[name]['bytes_per_node']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(python=platform.python_version(),
+                           machine=platform.machine(), results=results),
+                      f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of ToyWorldState.perform against the implementation it
+replaced, which built a scipy.stats.rv_discrete and deep copied the belief
+on every call. Both are also checked to draw the same outcome distribution.
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import timeit
+from copy import deepcopy
+
+import numpy as np
+from scipy.stats import rv_discrete
+
+from mcts.states.toy_world_state import ToyWorld, ToyWorldState
+
+
+def reference_perform(self, action):
+    probabilities = self.belief[action] / np.sum(self.belief[action])
+    distrib = rv_discrete(values=(range(len(probabilities)),
+                                  probabilities))
+    sample = distrib.rvs()
+
+    belief = deepcopy(self.belief)
+    belief[action][sample] += 1
+
+    upper = np.min(np.vstack((self.pos + self.actions[sample].action,
+                              self.world.size)), 0)
+    pos = np.max(np.vstack((upper, np.array([0, 0]))), 0)
+    return ToyWorldState(pos, self.world, belief)
+
+
+def outcomes(perform, state, n):
+    action = state.actions[0]
+    counts = np.zeros(4)
+    for _ in range(n):
+        counts += perform(state, action).belief[action]
+    return counts / n - state.belief[action]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', '-n', type=int, default=2000,
+                        help='How many calls to time.')
+    args = parser.parse_args()
+
+    world = ToyWorld([100, 100], False, np.array([0, 0]), np.array([-1, -1]))
+    belief = dict(zip(ToyWorldState((0, 0), world).actions,
+                      [np.array([10, 1, 1, 1]), np.array([1, 10, 1, 1]),
+                       np.array([1, 1, 10, 1]), np.array([1, 1, 1, 10])]))
+    state = ToyWorldState(np.array([50, 50]), world, belief)
+    action = state.actions[0]
+
+    times = {}
+    for name, perform in [('reference', reference_perform),
+                          ('perform', ToyWorldState.perform)]:
+        seconds = min(timeit.repeat(lambda: perform(state, action),
+                                    number=args.number, repeat=3))
+        times[name] = seconds / args.number
+        print("{:>10}: {:8.2f} us per call, outcome frequencies {}".format(
+            name, 1e6 * times[name],
+            np.round(outcomes(perform, state, args.number), 3)))
+    print("speedup: {:.1f}x".format(times['reference'] / times['perform']))
@@ -1,105 +1,224 @@
 from __future__ import division
 from __future__ import print_function
 
-import random
 import argparse
+import itertools
+import json
+import multiprocessing
+import os
 
 import numpy as np
 
-from mcts.mcts import mcts_search
+from mcts.mcts import MCTS
 from mcts.states import toy_world_state as state
 from mcts.graph import StateNode
+from mcts.utils import RandomStream
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
 
 
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
-import datetime
-
 __author__ = 'johannes'
 
 
-def run_experiment(intrinsic_motivation, gamma, c, mc_n, runs, steps):
-    trajectories = []
+def run_experiment(intrinsic_motivation, gamma, c, mc_n, runs, steps,
+                   results=None, workers=1, seed=0, verbose=False):
+    """
+    Runs the toy world experiment for every combination of the parameters.
+    Each of intrinsic_motivation, gamma, c and mc_n is a value or a list of
+    values to sweep over.
+
+    The runs are spread over a process pool. Every finished trajectory is
+    appended as one JSON line to the results file right away. Runs which
+    are found in the file already are skipped, so an interrupted sweep
+    resumes where it stopped when started again with the same file.
+
+    Run i draws its goal and manual from seed + i, so all parameters are
+    compared on the same worlds.
+
+    By default the results file is named after the parameters (see
+    results_name), so the same sweep resumes without naming the file.
+    :return: The path of the results file.
+    """
+    if results is None:
+        results = results_name(intrinsic_motivation, gamma, c, mc_n, steps,
+                               seed)
+    grid = itertools.product(_values(intrinsic_motivation), _values(gamma),
+                             _values(c), _values(mc_n))
+    jobs = [dict(intrinsic=bool(i), gamma=g, c=uct_c, mc_n=int(n), run=run,
+                 seed=seed + run, steps=steps, verbose=verbose)
+            for i, g, uct_c, n in grid for run in range(runs)]
+
+    done = _finished(results)
+    todo = [job for job in jobs if _key(job) not in done]
+    print("{} of {} runs done, {} to go, writing to {}".format(
+        len(jobs) - len(todo), len(jobs), len(todo), results))
+
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        trials = pool.imap_unordered(run_trial, todo)
+    else:
+        trials = (run_trial(job) for job in todo)
+    try:
+        with open(results, 'a') as f:
+            for record in trials:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                print("Run {run} (gamma={gamma}, c={c}, mc_n={mc_n}, "
+                      "intrinsic={intrinsic}): {length} steps, goal {outcome}"
+                      .format(length=len(record['trajectory']),
+                              outcome='reached' if record['reached']
+                              else 'missed', **record))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return results
+
+
+def run_trial(job):
+    """
+    Runs one episode of the toy world.
+    :param job: A dict with the parameters intrinsic, gamma, c, mc_n, run,
+    seed, steps and verbose
+    :return: A dict of the parameters and the resulting trajectory.
+    """
+    rng = RandomStream(job['seed'])
     start = np.array([50, 50])
     true_belief = True
 
-    for _ in range(runs):
-        goal = draw_goal(start, 6)
-        manual = draw_goal(start, 3)
+    goal = draw_goal(start, 6, rng)
+    manual = draw_goal(start, 3, rng)
+    if job['verbose']:
         print("Goal: {}".format(goal))
         print("Manual: {}".format(manual))
 
-        world = state.ToyWorld([100, 100], intrinsic_motivation, goal, manual)
-        belief = None
-        if true_belief:
-            belief = dict(zip([state.ToyWorldAction(np.array([0, 1])),
-                               state.ToyWorldAction(np.array([0, -1])),
-                               state.ToyWorldAction(np.array([1, 0])),
-                               state.ToyWorldAction(np.array([-1, 0]))],
-                              [[10, 10, 10, 10], [10, 10, 10, 10],
-                               [10, 10, 10, 10], [10, 10, 10, 10]]))
-        root_state = state.ToyWorldState(start, world, belief=belief)
-        print(root_state.pos)
-        next_state = StateNode(None, root_state, 0)
-        trajectory =[]
-        for _ in range(steps):
-            try:
-                ba = mcts_search(next_state, gamma, c=c, n=mc_n)
-                print("")
-                print("=" * 80)
-                print("State: {}".format(next_state.state))
-                print("Belief: {}".format(next_state.state.belief))
-                print("Reward: {}".format(next_state.reward))
-                print("N: {}".format(next_state.n))
-                print("Q: {}".format(next_state.q))
-                print("Action: {}".format(ba.action))
-                trajectory.append(next_state.state.pos)
-                if (next_state.state.pos == np.array(goal)).all():
-                    break
-                next_s = next_state.children[ba].sample_state(real_world=True)
-                next_state = next_s
-                next_state.parent = None
-            except KeyboardInterrupt:
-                break
-        trajectories.append(trajectory)
-        with open(gen_name("trajectories", "pkl"), "w") as f:
-            pickle.dump(trajectories, f)
-        print("=" * 80)
-
-
-def draw_goal(start, dist):
-    delta_x = random.randint(0, dist)
+    world = state.ToyWorld([100, 100], job['intrinsic'], goal, manual)
+    belief = None
+    if true_belief:
+        belief = dict(zip([state.ToyWorldAction(np.array([0, 1])),
+                           state.ToyWorldAction(np.array([0, -1])),
+                           state.ToyWorldAction(np.array([1, 0])),
+                           state.ToyWorldAction(np.array([-1, 0]))],
+                          [[10, 10, 10, 10], [10, 10, 10, 10],
+                           [10, 10, 10, 10], [10, 10, 10, 10]]))
+    root_state = state.ToyWorldState(start, world, belief=belief, rng=rng)
+    next_state = StateNode(None, root_state)
+    uct = MCTS(tree_policies.UCB1(job['c']), default_policies.immediate_reward,
+               backups.Bellman(job['gamma']), rng=rng)
+    trajectory = []
+    reached = False
+    for _ in range(job['steps']):
+        ba = uct(next_state, n=job['mc_n'])
+        if job['verbose']:
+            print("")
+            print("=" * 80)
+            print("State: {}".format(next_state.state))
+            print("Belief: {}".format(next_state.state.belief))
+            print("Reward: {}".format(next_state.reward))
+            print("N: {}".format(next_state.n))
+            print("Q: {}".format(next_state.q))
+            print("Action: {}".format(ba))
+        trajectory.append([int(x) for x in next_state.state.pos])
+        if (next_state.state.pos == np.array(goal)).all():
+            reached = True
+            break
+        observed = next_state.state.real_world_perform(ba)
+        next_state, kept = next_state.reroot(ba, observed)
+        if job['verbose']:
+            print("Kept: {} nodes, {} visits".format(kept.nodes, kept.visits))
+
+    record = dict((k, v) for k, v in job.items() if k != 'verbose')
+    record.update(goal=[int(x) for x in goal],
+                  manual=[int(x) for x in manual],
+                  trajectory=trajectory, reached=reached)
+    return record
+
+
+def draw_goal(start, dist, rng=None):
+    rng = rng or RandomStream()
+    delta_x = rng.randrange(dist + 1)
     delta_y = dist - delta_x
     return start - np.array([delta_x, delta_y])
 
 
-def gen_name(name, suffix):
-    datestr = datetime.datetime.strftime(datetime.datetime.now(),
-        '%Y-%m-%d-%H:%M:%S')
-    return name + datestr + suffix
+def results_name(intrinsic_motivation, gamma, c, mc_n, steps, seed):
+    """
+    The default results file of a sweep, named after its parameters. The
+    number of runs is left out, so a sweep can be resumed with more runs.
+    :return: The file name.
+    """
+    parts = [('i', [int(bool(x)) for x in _values(intrinsic_motivation)]),
+             ('g', _values(gamma)), ('c', _values(c)), ('n', _values(mc_n)),
+             ('s', [steps]), ('seed', [seed])]
+    return "trajectories-{}.jsonl".format("-".join(
+        name + ",".join(str(x) for x in values) for name, values in parts))
+
+
+def _values(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+_PARAMETERS = ('intrinsic', 'gamma', 'c', 'mc_n', 'run', 'seed', 'steps')
+
+
+def _key(record):
+    return tuple(record[name] for name in _PARAMETERS)
+
+
+def _finished(results):
+    # the keys of the runs in the results file. A line cut off by an
+    # interruption is removed, so its run is repeated.
+    done = set()
+    if not os.path.exists(results):
+        return done
+    with open(results, 'rb+') as f:
+        data = f.read()
+        f.truncate(data.rfind(b"\n") + 1)
+    for line in data.decode().splitlines():
+        try:
+            done.add(_key(json.loads(line)))
+        except (ValueError, KeyError):
+            continue
+    return done
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run experiment for UCT with '
                                                  'intrinsic motivation.')
-    parser.add_argument('--intrinsic', '-i', action='store_true',
-                        help='Should intrinsic motivation be used?')
-    parser.add_argument('--mcsamples', '-m', type=int, default=500,
+    parser.add_argument('--intrinsic', '-i', nargs='?', const='yes',
+                        default='no', choices=['yes', 'no', 'both'],
+                        help='Should intrinsic motivation be used? "both" '
+                             'runs with and without it.')
+    parser.add_argument('--mcsamples', '-m', type=int, nargs='+',
+                        default=[500],
                         help='How many monte carlo runs should be made.')
     parser.add_argument('--runs', '-r', type=int, default=10,
                         help='How many runs should be made.')
     parser.add_argument('--steps', '-s', type=int, default=100,
                         help="Maximum number of steps performed.")
-    parser.add_argument('--gamma', '-g', type=float, default=0.6,
-                        help='The learning rate.')
-    parser.add_argument('--uct_c', '-c', type=float, default=10,
+    parser.add_argument('--gamma', '-g', type=float, nargs='+',
+                        default=[0.6], help='The learning rate.')
+    parser.add_argument('--uct_c', '-c', type=float, nargs='+', default=[10],
                         help='The UCT parameter Cp.')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='The number of processes to spread the runs '
+                             'over.')
+    parser.add_argument('--results', '-o', default=None,
+                        help='The JSON lines file to append the trajectories '
+                             'to. Runs found in it are not repeated.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the first run.')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Print every step of the runs.')
 
     args = parser.parse_args()
-    run_experiment(intrinsic_motivation=args.intrinsic, gamma=args.gamma,
-                   mc_n=args.mcsamples, runs=args.runs, steps=args.steps,
-                   c=args.uct_c)
-
-
+    intrinsic = {'yes': [True], 'no': [False], 'both': [False, True]}
+    run_experiment(intrinsic_motivation=intrinsic[args.intrinsic],
+                   gamma=args.gamma, mc_n=args.mcsamples, runs=args.runs,
+                   steps=args.steps, c=args.uct_c, results=args.results,
+                   workers=args.workers, seed=args.seed,
+                   verbose=args.verbose)
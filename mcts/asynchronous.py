@@ -0,0 +1,167 @@
+import asyncio
+import inspect
+
+from . import utils
+from .backups import revert_virtual_loss
+from .mcts import Budget, _recommend, _select
+
+
+class AsyncMCTS(object):
+    """
+    MCTS for states, which perform actions or compute rewards in a
+    simulator behind an await boundary, e.g. another process talked to over
+    IPC. state.perform and state.reward may be coroutine functions, as may
+    the default policy (see RollOut). Several simulations are kept in
+    flight at once on the event loop. A virtual loss is added to every node
+    on a selected path and reverted in the backup, so they spread over the
+    tree like the threads of a tree parallel search.
+
+      >>> mcts = AsyncMCTS(UCB1(1.41), immediate_reward, Bellman(.6))
+      >>> best_action = await mcts(root, n=1000)
+
+    The tree is only altered between the awaits, so no locks are needed.
+    The virtual loss of a simulation, which raises, is reverted before the
+    error is passed on.
+    Requires Python 3.5 or newer.
+    """
+    def __init__(self, tree_policy, default_policy, backup, concurrency=8,
+                 virtual_loss=1., rng=None):
+        """
+        :param tree_policy: The tree policy
+        :param default_policy: The default policy, a function or a
+        coroutine function of the leaf
+        :param backup: The backup, which has to accept a virtual_loss
+        keyword as Bellman and monte_carlo do
+        :param concurrency: The number of simulations in flight at once
+        :param virtual_loss: The magnitude of the virtual loss
+        :param rng: The RandomStream (or seed) of the random decisions
+        """
+        self.tree_policy = tree_policy
+        self.default_policy = default_policy
+        self.backup = backup
+        self.concurrency = concurrency
+        self.virtual_loss = virtual_loss
+        self.rng = utils.get_stream(rng)
+        self.last_search = None
+
+    async def __call__(self, root, n=1500, time_budget=None,
+                       node_budget=None, early_stop=False,
+                       return_stats=False):
+        """
+        Run the search. No new simulations are started once any of the
+        budgets is used up, the ones in flight are finished.
+
+        See MCTS.__call__ for the parameters.
+        :return: The best action (and the SearchStats).
+        """
+        if root.parent is not None:
+            raise ValueError("Root's parent must be None.")
+
+        budget = Budget(n, time_budget, node_budget, early_stop)
+        started = 0
+        running = set()
+        error = None
+        while True:
+            while (error is None and len(running) < self.concurrency and
+                   started < budget.n and not budget.exhausted(root)):
+                running.add(asyncio.ensure_future(
+                    self._simulate(root, budget)))
+                started += 1
+            if not running:
+                break
+            done, running = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # the others hold virtual losses, so they are finished first
+                if task.exception() is not None and error is None:
+                    error = task.exception()
+        if error is not None:
+            raise error
+
+        self.last_search = budget.stats()
+        action = _recommend(root, self.rng).action
+        if return_stats:
+            return action, self.last_search
+        return action
+
+    async def _simulate(self, root, budget):
+        node = await _get_next_node(root, self.tree_policy,
+                                    self.virtual_loss, self.rng)
+        budget.count(node, virtual=True)
+        try:
+            node.reward = await _resolve(self.default_policy(node))
+        except BaseException:
+            _revert_path(node, self.virtual_loss)
+            raise
+        self.backup(node, virtual_loss=self.virtual_loss)
+
+
+async def _get_next_node(state_node, tree_policy, virtual_loss, rng=None):
+    # drives mcts._select, awaiting the states
+    selection = _select(state_node, tree_policy, virtual_loss, rng=rng)
+    state = None
+    while True:
+        try:
+            action_node = selection.send(state)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            state = await _resolve(action_node.parent.state.perform(
+                action_node.action))
+        except BaseException:
+            _revert_path(action_node, virtual_loss)
+            raise
+
+
+def _revert_path(node, virtual_loss):
+    # removes the virtual loss from the path up to node of a failed
+    # simulation, as if it was never selected
+    while node is not None:
+        revert_virtual_loss(node, virtual_loss)
+        node = node.parent
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def immediate_reward(state_node):
+    """
+    default_policies.immediate_reward for states with a coroutine reward.
+    """
+    return await _resolve(state_node.state.reward(
+        state_node.parent.parent.state, state_node.parent.action))
+
+
+class RollOut(object):
+    """
+    A random roll-out of at most k steps, or till a terminal state, for
+    states with a coroutine perform or reward. See
+    default_policies.RandomKStepRollOut.
+    """
+    def __init__(self, k=None, rng=None):
+        """
+        :param k: The number of steps or None to roll out till a terminal
+        state
+        :param rng: The RandomStream (or seed) to draw the actions from
+        """
+        self.k = k
+        self.rng = utils.get_stream(rng)
+
+    async def __call__(self, state_node):
+        reward = 0
+        state = state_node.state
+        parent = state_node.parent.parent.state
+        action = state_node.parent.action
+        step = 0
+        while not state.is_terminal() and (self.k is None or step < self.k):
+            reward += await _resolve(state.reward(parent, action))
+
+            action = self.rng.choice(state_node.state.actions)
+            parent = state
+            state = await _resolve(parent.perform(action))
+            step += 1
+
+        return reward
@@ -12,30 +12,168 @@ class Bellman(object):
     def __init__(self, gamma):
         self.gamma = gamma
 
-    def __call__(self, node):
+    def __call__(self, node, virtual_loss=None):
         """
         :param node: The node to start the backups from
+        :param virtual_loss: The virtual loss, which was added to the nodes
+        on the path, or None if there is none to revert.
         """
+        child = None
         while node is not None:
-            node.n += 1
+            # reverting a virtual loss and the visit cancel out, the q
+            # values are recomputed anyway
+            if virtual_loss is None:
+                node.n += 1
             if isinstance(node, StateNode):
-                node.q = max([x.q for x in node.children.values()])
+                values = [x.q for x in node.children.values()]
+                if node.pending_actions:
+                    values.append(0)
+                node.q = max(values)
             elif isinstance(node, ActionNode):
-                n = sum([x.n for x in node.children.values()])
-                node.q = sum([(self.gamma * x.q + x.reward) * x.n
-                              for x in node.children.values()]) / n
+                if node.counts is None:
+                    weight = sum([x.n for x in node.children.values()])
+                    value = sum([(self.gamma * x.q + x.reward) * x.n
+                                 for x in node.children.values()])
+                else:
+                    # shared children are weighted by how often they were
+                    # reached from this action
+                    counts = node.counts
+                    counts[child.state] = counts.get(child.state, 0) + 1
+                    weight = sum(counts.values())
+                    value = sum([(self.gamma * x.q + x.reward) *
+                                 counts.get(s, 0)
+                                 for s, x in node.children.items()])
+                if node.evicted is not None:
+                    value += node.evicted[0]
+                    weight += node.evicted[1]
+                node.q = value / weight
+            child = node
             node = node.parent
 
 
-def monte_carlo(node):
+class IncrementalBellman(Bellman):
+    """
+    The Bellman update in constant time per node. Action nodes keep running
+    sums of the weighted values and the weights of their children and
+    state nodes track their best child, so only the one child, which
+    changed, has to be looked at. Only if the best child of a state node
+    got worse, all children are looked at again.
+
+    The values are the same as the ones of Bellman, as long as all updates
+    of the tree go through this backup.
+    """
+    def __call__(self, node, virtual_loss=None):
+        """
+        :param node: The node to start the backups from
+        :param virtual_loss: The virtual loss, which was added to the nodes
+        on the path, or None if there is none to revert.
+        """
+        child = None
+        while node is not None:
+            if virtual_loss is None:
+                node.n += 1
+            if isinstance(node, StateNode):
+                self._update_state_node(node, child)
+            elif isinstance(node, ActionNode):
+                if node.counts is not None:
+                    node.counts[child.state] = \
+                        node.counts.get(child.state, 0) + 1
+                self._update_action_node(node, child)
+            child = node
+            node = node.parent
+
+    def _update_state_node(self, node, child):
+        if not node.children:
+            # a leaf, whose actions progressive widening did not add yet
+            node.q = 0
+            return
+        # the cache holds the best child and its value
+        cache = node.backup_cache
+        if cache is None or (child is cache[0] and child.q < cache[1]):
+            best = max(node.children.values(), key=lambda x: x.q)
+            cache = (best, best.q)
+        elif child is not None and (child is cache[0] or
+                                    child.q > cache[1]):
+            cache = (child, child.q)
+        node.backup_cache = cache
+        node.q = cache[1]
+        if node.pending_actions and node.q < 0:
+            node.q = 0
+
+    def _update_action_node(self, node, child):
+        # the cache holds the sum of the weighted values, the sum of the
+        # weights and the term of every child. Children shared with other
+        # parents change behind our back, so they are always summed up.
+        cache = node.backup_cache
+        if cache is None or node.counts is not None:
+            terms = dict((s, self._term(node, s, x))
+                         for s, x in node.children.items())
+            cache = [sum(t[0] for t in terms.values()),
+                     sum(t[1] for t in terms.values()), terms]
+            if node.evicted is not None:
+                cache[0] += node.evicted[0]
+                cache[1] += node.evicted[1]
+            node.backup_cache = cache
+        else:
+            old = cache[2].get(child.state, (0, 0))
+            new = self._term(node, child.state, child)
+            cache[0] += new[0] - old[0]
+            cache[1] += new[1] - old[1]
+            cache[2][child.state] = new
+        node.q = cache[0] / cache[1]
+
+    def _term(self, node, state, state_node):
+        if node.counts is None:
+            weight = state_node.n
+        else:
+            weight = node.counts.get(state, 0)
+        return (self.gamma * state_node.q + state_node.reward) * weight, weight
+
+
+def monte_carlo(node, virtual_loss=None):
     """
     A monte carlo update as in classical UCT.
 
     See feldman amd Domshlak (2014) for reference.
     :param node: The node to start the backup from
+    :param virtual_loss: The virtual loss, which was added to the nodes
+    on the path, or None if there is none to revert.
     """
     r = node.reward
+    child = None
     while node is not None:
+        if virtual_loss is not None:
+            revert_virtual_loss(node, virtual_loss)
         node.n += 1
         node.q = ((node.n - 1)/node.n) * node.q + 1/node.n * r
+        if isinstance(node, ActionNode) and node.counts is not None:
+            node.counts[child.state] = node.counts.get(child.state, 0) + 1
+        child = node
         node = node.parent
+
+
+def add_virtual_loss(node, loss):
+    """
+    Counts a visit, which lost the given value, for the node. It keeps other
+    parallel simulations from choosing the same path until the visit is
+    reverted in the backup.
+
+    See Chaslot et al. (2008) for reference.
+    :param node: The node to add the virtual loss to
+    :param loss: The magnitude of the loss
+    """
+    node.q = (node.q * node.n - loss) / (node.n + 1)
+    node.n += 1
+
+
+def revert_virtual_loss(node, loss):
+    """
+    Reverts add_virtual_loss.
+    :param node: The node to remove the virtual loss from
+    :param loss: The magnitude of the loss
+    """
+    node.n -= 1
+    if node.n == 0:
+        node.q = 0
+    else:
+        node.q = (node.q * (node.n + 1) + loss) / node.n
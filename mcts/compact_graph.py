@@ -0,0 +1,402 @@
+from __future__ import division
+
+import sys
+
+import numpy as np
+
+from .graph import StateNode, ActionNode, RECORD_DTYPE
+from .utils import get_stream
+
+
+# name, dtype and fill value of every per node column
+_COLUMNS = (('parent', np.int64, -1),
+            ('n', np.int64, 0),
+            ('q', np.float64, 0.),
+            ('reward', np.float64, 0.),
+            ('first_child', np.int64, -1),
+            ('num_children', np.int32, 0),
+            ('next_sibling', np.int64, -1),
+            ('is_action', np.bool_, False),
+            # ActionNode.evicted, a weight of 0 means None
+            ('evicted_value', np.float64, 0.),
+            ('evicted_weight', np.int64, 0),
+            # ActionNode.prior, NaN means None
+            ('prior', np.float64, np.nan))
+
+
+class CompactTree(object):
+    """
+    A search tree stored as a struct of arrays instead of one Python object
+    per node. Every node is an index into growable NumPy arrays holding its
+    parent, visit count, value and reward.
+
+    The action children of a state node are allocated as one contiguous
+    block (CSR style ranges via first_child and num_children). The sampled
+    state children of an action node are chained via next_sibling, as
+    they are discovered one at a time.
+
+    The nodes are exposed through CompactStateNode and CompactActionNode
+    views, which behave like StateNode and ActionNode. Hence MCTS, the tree
+    policies and the backups work on a compact tree unchanged:
+
+      >>> tree = CompactTree(state)
+      >>> best_action = mcts(tree.root)
+    """
+    def __init__(self, root_state, capacity=1024):
+        """
+        :param root_state: The state of the root node
+        :param capacity: The number of nodes to allocate memory for
+        initially. The arrays grow automatically.
+        """
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        for name, dtype, fill in _COLUMNS:
+            setattr(self, name, np.full(self._capacity, fill, dtype=dtype))
+        # the state of a state node or the action of an action node
+        self.payload = []
+        # (action node, state) -> state node
+        self._outcomes = {}
+        self.root = CompactStateNode(self, self._add_state(-1, root_state))
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+        The memory allocated for the tree in bytes. The states and actions
+        themselves are not included.
+        """
+        return (sum(getattr(self, name).nbytes for name, _, _ in _COLUMNS) +
+                sys.getsizeof(self.payload) + sys.getsizeof(self._outcomes))
+
+    @property
+    def bytes_per_node(self):
+        """
+        The memory allocated per node in bytes.
+        """
+        return self.nbytes / max(self._size, 1)
+
+    def node(self, index):
+        """
+        Returns a view of the node at index.
+        :param index: The index of the node
+        :return: A CompactStateNode or a CompactActionNode
+        """
+        if self.is_action[index]:
+            return CompactActionNode(self, index)
+        return CompactStateNode(self, index)
+
+    def children(self, index):
+        """
+        The indices of the children of a node.
+        :param index: The index of the node
+        :return: A list of indices
+        """
+        if self.is_action[index]:
+            indices = []
+            child = self.first_child.item(index)
+            while child != -1:
+                indices.append(child)
+                child = self.next_sibling.item(child)
+            return indices
+        first = self.first_child.item(index)
+        return list(range(first, first + self.num_children.item(index)))
+
+    def to_records(self):
+        """
+        Exports the statistics of all nodes as a NumPy record array like
+        graph.to_records, but straight from the arrays of the tree. The id
+        of a node is its index, so the rows are in the order the nodes were
+        added, not breadth first.
+        :return: A numpy.recarray of graph.RECORD_DTYPE
+        """
+        size = self._size
+        records = np.zeros(size, dtype=RECORD_DTYPE)
+        records['id'] = np.arange(size)
+        for name in ('parent', 'is_action', 'n', 'q', 'reward'):
+            records[name] = getattr(self, name)[:size]
+
+        # one vectorized step up the tree per level
+        ancestor = records['parent'].copy()
+        while True:
+            above = ancestor >= 0
+            if not above.any():
+                break
+            records['depth'] += above
+            ancestor[above] = self.parent[ancestor[above]]
+        return records.view(np.recarray)
+
+    def sample_state(self, index, real_world=False):
+        """
+        Samples a state from the action node at index and adds it to the
+        tree if it never occurred before. See ActionNode.sample_state.
+
+        :param index: The index of the action node
+        :param real_world: Sample from the real world instead of the belief
+        :return: The index of the sampled state node
+        """
+        action = self.payload[index]
+        parent_state = self.payload[self.parent.item(index)]
+        if real_world:
+            state = parent_state.real_world_perform(action)
+        else:
+            state = parent_state.perform(action)
+
+        child = self.add_state(index, state)
+
+        if real_world:
+            self.payload[child].belief = state.belief
+
+        return child
+
+    def add_state(self, index, state):
+        """
+        Adds a state, which resulted from the action node at index, to the
+        tree if it never occurred before. See ActionNode.add_state.
+
+        :param index: The index of the action node
+        :param state: The resulting state
+        :return: The index of the state node
+        """
+        key = (index, state)
+        child = self._outcomes.get(key)
+        if child is None:
+            child = self._add_state(index, state)
+            self.next_sibling[child] = self.first_child[index]
+            self.first_child[index] = child
+            self.num_children[index] += 1
+            self._outcomes[key] = child
+        return child
+
+    def _add_state(self, parent, state):
+        actions = state.actions
+        index = self._allocate(1 + len(actions))
+        self.parent[index] = parent
+        self.first_child[index] = index + 1
+        self.num_children[index] = len(actions)
+        self.payload.append(state)
+
+        end = index + 1 + len(actions)
+        self.parent[index + 1:end] = index
+        self.is_action[index + 1:end] = True
+        self.payload.extend(actions)
+        return index
+
+    def _allocate(self, count):
+        index = self._size
+        if index + count > self._capacity:
+            capacity = self._capacity
+            while index + count > capacity:
+                capacity *= 2
+            for name, dtype, fill in _COLUMNS:
+                column = np.full(capacity, fill, dtype=dtype)
+                column[:self._size] = getattr(self, name)[:self._size]
+                setattr(self, name, column)
+            self._capacity = capacity
+        self._size += count
+        return index
+
+
+class _CompactNodeMixin(object):
+    """
+    The statistics shared by both view types. They are read from and written
+    to the arrays of the tree.
+    """
+    __slots__ = ()
+
+    @property
+    def parent(self):
+        parent = self.tree.parent.item(self.index)
+        if parent == -1:
+            return None
+        return self.tree.node(parent)
+
+    @parent.setter
+    def parent(self, value):
+        raise ValueError("The parent of a compact node can not be set.")
+
+    @property
+    def q(self):
+        return self.tree.q.item(self.index)
+
+    @q.setter
+    def q(self, value):
+        self.tree.q[self.index] = value
+
+    @property
+    def n(self):
+        return self.tree.n.item(self.index)
+
+    @n.setter
+    def n(self, value):
+        self.tree.n[self.index] = value
+
+    def __eq__(self, other):
+        return (isinstance(other, _CompactNodeMixin) and
+                self.tree is other.tree and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+
+class CompactActionNode(_CompactNodeMixin, ActionNode):
+    """
+    A view of an action node in a CompactTree.
+    """
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def action(self):
+        return self.tree.payload[self.index]
+
+    @property
+    def evicted(self):
+        weight = self.tree.evicted_weight.item(self.index)
+        if weight == 0:
+            return None
+        return self.tree.evicted_value.item(self.index), weight
+
+    @evicted.setter
+    def evicted(self, value):
+        value, weight = value or (0., 0)
+        self.tree.evicted_value[self.index] = value
+        self.tree.evicted_weight[self.index] = weight
+
+    @property
+    def prior(self):
+        prior = self.tree.prior.item(self.index)
+        if np.isnan(prior):
+            return None
+        return prior
+
+    @prior.setter
+    def prior(self, value):
+        self.tree.prior[self.index] = np.nan if value is None else value
+
+    @property
+    def children(self):
+        tree = self.tree
+        return dict((tree.payload[i], CompactStateNode(tree, i))
+                    for i in tree.children(self.index))
+
+    def sample_state(self, real_world=False, table=None):
+        _no_table(table)
+        return CompactStateNode(self.tree,
+                                self.tree.sample_state(self.index,
+                                                       real_world))
+
+    def add_state(self, state, table=None):
+        _no_table(table)
+        return CompactStateNode(self.tree,
+                                self.tree.add_state(self.index, state))
+
+    def collapse(self):
+        raise ValueError("The nodes of a compact tree can not be dropped.")
+
+
+class CompactStateNode(_CompactNodeMixin, StateNode):
+    """
+    A view of a state node in a CompactTree.
+    """
+    __slots__ = ('tree', 'index')
+    # the actions are allocated with the state
+    lazy_actions = False
+    pending_actions = False
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def state(self):
+        return self.tree.payload[self.index]
+
+    @property
+    def reward(self):
+        return self.tree.reward.item(self.index)
+
+    @reward.setter
+    def reward(self, value):
+        self.tree.reward[self.index] = value
+
+    @property
+    def children(self):
+        tree = self.tree
+        return dict((tree.payload[i], CompactActionNode(tree, i))
+                    for i in tree.children(self.index))
+
+    @property
+    def untried_actions(self):
+        tree = self.tree
+        first = tree.first_child.item(self.index)
+        end = first + tree.num_children.item(self.index)
+        untried = np.flatnonzero(tree.n[first:end] == 0) + first
+        return [tree.payload[i] for i in untried]
+
+    @untried_actions.setter
+    def untried_actions(self, value):
+        raise ValueError("Untried actions can not be set.")
+
+    def untried_action(self, rng=None):
+        tree = self.tree
+        first = tree.first_child.item(self.index)
+        end = first + tree.num_children.item(self.index)
+        untried = np.flatnonzero(tree.n[first:end] == 0)
+        if len(untried) == 0:
+            return None
+        return CompactActionNode(tree, first + int(get_stream(rng).choice(
+            untried)))
+
+    def expand(self, priors=None):
+        # the action nodes exist already, in the order of state.actions
+        if priors is not None:
+            tree = self.tree
+            first = tree.first_child.item(self.index)
+            end = first + tree.num_children.item(self.index)
+            tree.prior[first:end] = priors
+
+    def reroot(self, action, observed_state, table=None):
+        raise ValueError("A compact tree can not be rerooted, as its nodes "
+                         "can not be dropped.")
+
+    def child_statistics(self):
+        tree = self.tree
+        first = tree.first_child.item(self.index)
+        end = first + tree.num_children.item(self.index)
+        return (_ActionNodeRange(tree, first, end), tree.q[first:end],
+                tree.n[first:end])
+
+
+def _no_table(table):
+    if table is not None:
+        raise ValueError("A compact tree can not share nodes via a "
+                         "transposition table.")
+
+
+class _ActionNodeRange(object):
+    """
+    The contiguous action children of a state node as a sequence of views,
+    which are only created on access.
+    """
+    __slots__ = ('tree', 'first', 'end')
+
+    def __init__(self, tree, first, end):
+        self.tree = tree
+        self.first = first
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.first
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.end - self.first:
+            raise IndexError(i)
+        return CompactActionNode(self.tree, self.first + i)
@@ -1,4 +1,10 @@
-import random
+from __future__ import division
+
+import heapq
+import threading
+from collections import OrderedDict
+
+from .utils import get_stream
 
 
 def immediate_reward(state_node):
@@ -11,39 +17,236 @@ def immediate_reward(state_node):
                                    state_node.parent.action)
 
 
+def _immediate_reward_batch(state_nodes):
+    return [immediate_reward(state_node) for state_node in state_nodes]
+
+
+immediate_reward.batch = _immediate_reward_batch
+
+
 class RandomKStepRollOut(object):
     """
     Estimate the reward with the sum of returns of a k step rollout
     """
-    def __init__(self, k):
+    def __init__(self, k, rng=None):
+        """
+        :param k: The number of steps
+        :param rng: The RandomStream (or seed) to draw the actions from
+        """
         self.k = k
+        self.rng = get_stream(rng)
 
     def __call__(self, state_node):
-        self.current_k = 0
+        # the steps are counted per call, threads may roll out at once
+        current_k = [0]
 
         def stop_k_step(state):
-            self.current_k += 1
-            return self.current_k > self.k or state.is_terminal()
+            current_k[0] += 1
+            return current_k[0] > self.k or state.is_terminal()
 
-        return _roll_out(state_node, stop_k_step)
+        return _roll_out(state_node, stop_k_step, self.rng)
 
+    def batch(self, state_nodes):
+        """
+        Estimates the rewards of several leaves with rollouts performed in
+        lockstep.
+        :param state_nodes: The leaves to evaluate
+        :return: A list of the rewards.
+        """
+        return _roll_out_batch(state_nodes, self.rng, self.k)
 
-def random_terminal_roll_out(state_node):
+
+def random_terminal_roll_out(state_node, rng=None):
     """
     Estimate the reward with the sum of a rollout till a terminal state.
     Typical for terminal-only-reward situations such as games with no
     evaluation of the board as reward.
 
     :param state_node:
+    :param rng: The RandomStream (or seed) to draw the actions from
     :return:
     """
     def stop_terminal(state):
         return state.is_terminal()
 
-    return _roll_out(state_node, stop_terminal)
+    return _roll_out(state_node, stop_terminal, get_stream(rng))
+
+
+def _random_terminal_roll_out_batch(state_nodes, rng=None):
+    return _roll_out_batch(state_nodes, get_stream(rng))
+
+
+random_terminal_roll_out.batch = _random_terminal_roll_out_batch
+
+
+class RandomTerminalRollOut(object):
+    """
+    random_terminal_roll_out with its own RandomStream.
+    """
+    def __init__(self, rng=None):
+        """
+        :param rng: The RandomStream (or seed) to draw the actions from
+        """
+        self.rng = get_stream(rng)
+
+    def __call__(self, state_node):
+        return random_terminal_roll_out(state_node, self.rng)
+
+    def batch(self, state_nodes):
+        return _roll_out_batch(state_nodes, self.rng)
+
+
+def _state_key(state_node):
+    return state_node.state
+
+
+class CachedPolicy(object):
+    """
+    Wraps a default policy with a bounded cache of its estimates per state.
+    A state is evaluated by the policy until samples estimates of it are
+    collected, their running mean is returned meanwhile. From then on the
+    mean is served from the cache, so the budget of a rollout heavy search
+    goes to new states. The cache can be shared by several searches.
+
+    By default states are the keys, i.e. they need __hash__ and __eq__ and
+    the estimate must not depend on the action leading to the state. Pass
+    another key function otherwise.
+
+    Once the cache is full entries are evicted, either the least recently
+    used one or, with 'least_visited', the tenth of the entries with the
+    fewest evaluations and hits.
+    """
+    EVICTIONS = ('least_recently_used', 'least_visited')
+
+    def __init__(self, policy, max_size=10000, samples=1,
+                 eviction='least_recently_used', key=_state_key):
+        """
+        :param policy: The default policy to wrap
+        :param max_size: The maximal number of states in the cache
+        :param samples: The number of estimates per state, after which the
+        cached mean is served
+        :param eviction: One of EVICTIONS
+        :param key: A function of a state node returning its cache key
+        """
+        if eviction not in self.EVICTIONS:
+            raise ValueError("Unknown eviction {}, not one of {}."
+                             .format(eviction, ", ".join(self.EVICTIONS)))
+        self.policy = policy
+        self.max_size = max_size
+        self.samples = samples
+        self.eviction = eviction
+        self.key = key
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> [mean, estimates, uses]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # a lock can not be pickled, e.g. for root parallel workers
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def rng(self):
+        """
+        The RandomStream of the wrapped policy, if it has one.
+        """
+        return getattr(self.policy, 'rng', None)
+
+    @rng.setter
+    def rng(self, value):
+        if hasattr(self.policy, 'rng'):
+            self.policy.rng = value
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of the evaluations, which were served from the cache.
+        """
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def __call__(self, state_node):
+        key = self.key(state_node)
+        value = self._cached(key)
+        if value is not None:
+            return value
+        return self._add(key, self.policy(state_node))
 
+    def batch(self, state_nodes):
+        """
+        Serves the cached estimates and evaluates the other leaves in one
+        batch of the wrapped policy, if it supports batches.
+        :param state_nodes: The leaves to evaluate
+        :return: A list of the rewards.
+        """
+        keys = [self.key(state_node) for state_node in state_nodes]
+        values = [self._cached(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            nodes = [state_nodes[i] for i in missing]
+            batch = getattr(self.policy, 'batch', None)
+            if batch is not None:
+                rewards = batch(nodes)
+            else:
+                rewards = [self.policy(state_node) for state_node in nodes]
+            for i, reward in zip(missing, rewards):
+                values[i] = self._add(keys[i], reward)
+        return values
 
-def _roll_out(state_node, stopping_criterion):
+    def _cached(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < self.samples:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[2] += 1
+            if self.eviction == 'least_recently_used':
+                self._entries.move_to_end(key)
+            return entry[0]
+
+    def _add(self, key, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [0., 0, 0]
+                self._evict()
+            elif self.eviction == 'least_recently_used':
+                self._entries.move_to_end(key)
+            entry[1] += 1
+            entry[2] += 1
+            entry[0] += (value - entry[0]) / entry[1]
+            return entry[0]
+
+    def _evict(self):
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return
+        if self.eviction == 'least_recently_used':
+            for _ in range(excess):
+                self._entries.popitem(last=False)
+        else:
+            # the newest entry has no uses yet, so it is kept
+            keys = list(self._entries)[:-1]
+            keys = heapq.nsmallest(max(excess, self.max_size // 10), keys,
+                                   key=lambda x: self._entries[x][2])
+            for key in keys:
+                del self._entries[key]
+            excess = len(keys)
+        self.evictions += excess
+
+
+def _roll_out(state_node, stopping_criterion, rng):
     reward = 0
     state = state_node.state
     parent = state_node.parent.parent.state
@@ -51,8 +254,42 @@ def _roll_out(state_node, stopping_criterion):
     while not stopping_criterion(state):
         reward += state.reward(parent, action)
 
-        action = random.choice(state_node.state.actions)
+        action = rng.choice(state_node.state.actions)
         parent = state
         state = parent.perform(action)
 
     return reward
+
+
+def _roll_out_batch(state_nodes, rng, k=None):
+    rewards = [0] * len(state_nodes)
+    states = [state_node.state for state_node in state_nodes]
+    parents = [state_node.parent.parent.state for state_node in state_nodes]
+
+    # states of one type may step k random actions at once, e.g. as arrays
+    roll_out = getattr(type(states[0]), 'roll_out_batch', None) \
+        if states else None
+    if (k is not None and roll_out is not None and
+            all(type(state) is type(states[0]) for state in states)):
+        return list(roll_out(states, parents, k, rng))
+
+    actions = [state_node.parent.action for state_node in state_nodes]
+
+    active = range(len(state_nodes))
+    step = 0
+    while active and (k is None or step < k):
+        running = []
+        for i in active:
+            state = states[i]
+            if state.is_terminal():
+                continue
+            rewards[i] += state.reward(parents[i], actions[i])
+
+            actions[i] = rng.choice(state_nodes[i].state.actions)
+            parents[i] = state
+            states[i] = state.perform(actions[i])
+            running.append(i)
+        active = running
+        step += 1
+
+    return rewards
@@ -0,0 +1,220 @@
+from __future__ import division
+
+import threading
+from timeit import default_timer as timer
+
+import numpy as np
+
+from .mcts import _NoLock
+
+
+# An evaluator is called with a list of leaf StateNodes and returns a list
+# of (priors, value) pairs for them. The priors are the probabilities of
+# the actions in the order of state.actions, or None for uniform priors.
+# The value estimates the reward of the leaf like a default policy does.
+
+
+class EvaluatorPolicy(object):
+    """
+    A default policy, which evaluates the leaves with an evaluator. The
+    value is returned as reward of a leaf, the priors are stored on its
+    action nodes for PUCT (see StateNode.expand).
+
+    The parent state of a leaf without priors, i.e. the root of a search,
+    is evaluated along with the leaf, so the root gets priors as well.
+
+    A tree parallel search passes its lock (see takes_lock), which is held
+    while the tree is read and the priors are stored, but not while the
+    evaluator runs.
+    """
+    # Whether a tree parallel search should pass its lock
+    takes_lock = True
+
+    def __init__(self, evaluator):
+        """
+        :param evaluator: The evaluator, e.g. a LinearEvaluator or an
+        EvaluationQueue
+        """
+        self.evaluator = evaluator
+
+    def __call__(self, state_node, lock=None):
+        return self.batch([state_node], lock)[0]
+
+    def batch(self, state_nodes, lock=None):
+        """
+        Evaluates several leaves in one call of the evaluator.
+        :param state_nodes: The leaves to evaluate
+        :param lock: The lock guarding the tree or None
+        :return: A list of the rewards.
+        """
+        lock = lock or _NoLock()
+        with lock:
+            nodes = list(state_nodes)
+            for state_node in state_nodes:
+                if state_node.parent is None:
+                    continue
+                parent = state_node.parent.parent
+                if (parent.parent is None and parent not in nodes and
+                        any(a.prior is None
+                            for a in parent.children.values())):
+                    nodes.append(parent)
+
+        evaluations = self.evaluator(nodes)
+        with lock:
+            for state_node, (priors, _) in zip(nodes, evaluations):
+                if priors is not None and not state_node.state.is_terminal():
+                    state_node.expand(priors)
+        return [value for _, value in evaluations[:len(state_nodes)]]
+
+
+class LinearEvaluator(object):
+    """
+    A reference evaluator, a linear model in NumPy. The features of all
+    states of a call are stacked, so a batch costs two matrix products. The
+    priors are the softmax over the action logits, the value is linear in
+    the features.
+    """
+    def __init__(self, features, policy_weights, value_weights):
+        """
+        :param features: A function of a state returning its feature
+        vector of length d
+        :param policy_weights: A d x m array of the action logits. A state
+        with k actions uses the first k columns.
+        :param value_weights: An array of length d
+        """
+        self.features = features
+        self.policy_weights = np.asarray(policy_weights, dtype=float)
+        self.value_weights = np.asarray(value_weights, dtype=float)
+
+    def __call__(self, state_nodes):
+        states = [state_node.state for state_node in state_nodes]
+        features = np.array([self.features(state) for state in states],
+                            dtype=float).reshape(len(states), -1)
+        logits = features.dot(self.policy_weights)
+        values = features.dot(self.value_weights)
+
+        # the logits of the actions a state does not have are masked out
+        counts = np.array([len(state.actions) for state in states])
+        logits[np.arange(logits.shape[1]) >= counts[:, None]] = -np.inf
+        priors = np.exp(logits - logits.max(axis=1)[:, None])
+        priors /= priors.sum(axis=1)[:, None]
+        return [(p[:k], v) for p, k, v in zip(priors, counts, values)]
+
+
+class RollOutEvaluator(object):
+    """
+    An evaluator with uniform priors and the value of a default policy,
+    e.g. to run PUCT with roll-outs. A root, whose value is never used, is
+    not rolled out but valued 0.
+    """
+    def __init__(self, default_policy):
+        """
+        :param default_policy: The default policy to estimate the values
+        with. Its batch hook is used if it has one.
+        """
+        self.default_policy = default_policy
+
+    def __call__(self, state_nodes):
+        leaves = [x for x in state_nodes if x.parent is not None]
+        batch = getattr(self.default_policy, 'batch', None)
+        if batch is not None:
+            values = iter(batch(leaves))
+        else:
+            values = iter([self.default_policy(x) for x in leaves])
+        return [(None, 0. if x.parent is None else next(values))
+                for x in state_nodes]
+
+
+class EvaluationQueue(object):
+    """
+    Collects the evaluation requests of several threads, e.g. of a tree
+    parallel search, and passes them to the evaluator in one batch. A
+    request waits until batch_size leaves are queued or for at most
+    timeout seconds. Then the waiting thread evaluates the whole queue.
+
+    The queue is an evaluator itself:
+
+      >>> evaluator = EvaluationQueue(LinearEvaluator(...), batch_size=8)
+      >>> mcts = MCTS(PUCT(), EvaluatorPolicy(evaluator), backup, threads=8)
+    """
+    def __init__(self, evaluator, batch_size, timeout=.01):
+        """
+        :param evaluator: The evaluator to pass the batches to
+        :param batch_size: The number of leaves to collect
+        :param timeout: The maximal time a request waits for others in
+        seconds
+        """
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.batches = 0
+        self.evaluations = 0
+        self._queue = []
+        self._size = 0
+        self._condition = threading.Condition()
+
+    @property
+    def mean_batch_size(self):
+        """
+        The average number of leaves per call of the evaluator.
+        """
+        return self.evaluations / max(self.batches, 1)
+
+    def __call__(self, state_nodes):
+        request = _Request(state_nodes)
+        deadline = timer() + self.timeout
+        with self._condition:
+            self._queue.append(request)
+            self._size += len(state_nodes)
+            batch = None
+            while not request.taken:
+                now = timer()
+                if self._size >= self.batch_size or now >= deadline:
+                    batch = self._take()
+                    break
+                self._condition.wait(deadline - now)
+
+        if batch is not None:
+            self._evaluate(batch)
+
+        with self._condition:
+            while request.results is None:
+                self._condition.wait()
+        if isinstance(request.results, Exception):
+            raise request.results
+        return request.results
+
+    def _take(self):
+        batch, self._queue, self._size = self._queue, [], 0
+        for request in batch:
+            request.taken = True
+        return batch
+
+    def _evaluate(self, batch):
+        nodes = [x for request in batch for x in request.state_nodes]
+        try:
+            evaluations = self.evaluator(nodes)
+        except Exception as e:
+            evaluations = None
+            error = e
+        with self._condition:
+            self.batches += 1
+            self.evaluations += len(nodes)
+            start = 0
+            for request in batch:
+                end = start + len(request.state_nodes)
+                if evaluations is None:
+                    request.results = error
+                else:
+                    request.results = list(evaluations[start:end])
+                start = end
+            self._condition.notify_all()
+
+
+class _Request(object):
+    __slots__ = ('state_nodes', 'taken', 'results')
+
+    def __init__(self, state_nodes):
+        self.state_nodes = state_nodes
+        self.taken = False
+        self.results = None
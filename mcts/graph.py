@@ -1,4 +1,16 @@
+import math
+from collections import deque, namedtuple, OrderedDict
+
+import numpy as np
+
+from .utils import get_stream
+
+
 class Node(object):
+    # Scratch space for incremental backups. It has to be reset whenever
+    # children are removed.
+    backup_cache = None
+
     def __init__(self, parent):
         self.parent = parent
         self.children = {}
@@ -10,12 +22,23 @@ class ActionNode(Node):
     """
     A node holding an action in the tree.
     """
+    # How often each child state was reached from this action, if the
+    # children are shared via a TranspositionTable.
+    counts = None
+    # The summed weighted value and the weight of the children dropped by
+    # collapse(), which the Bellman backup keeps weighting in.
+    evicted = None
+    # When the action was last visited, only tracked by a bounded search.
+    visited = 0.
+    # The prior probability of the action, set by StateNode.expand.
+    prior = None
+
     def __init__(self, parent, action):
         super(ActionNode, self).__init__(parent)
         self.action = action
         self.n = 0
 
-    def sample_state(self, real_world=False):
+    def sample_state(self, real_world=False, table=None):
         """
         Samples a state from this action and adds it to the tree if the
         state never occurred before.
@@ -23,21 +46,102 @@ class ActionNode(Node):
         :param real_world: If planning in belief states are used, this can
         be set to True if a real world action is taken. The belief is than
         used from the real world action instead from the belief state actions.
+        :param table: An optional TranspositionTable to share the state node
+        with other paths reaching the same state.
         :return: The state node, which was sampled.
         """
         if real_world:
             state = self.parent.state.real_world_perform(self.action)
         else:
+            state_node = self.resample()
+            if state_node is not None:
+                return self.add_state(state_node.state, table)
             state = self.parent.state.perform(self.action)
 
-        if state not in self.children:
-            self.children[state] = StateNode(self, state)
+        state_node = self.add_state(state, table)
 
         if real_world:
-            self.children[state].state.belief = state.belief
+            state_node.state.belief = state.belief
+
+        return state_node
+
+    def add_state(self, state, table=None):
+        """
+        Adds a state, which resulted from this action, to the tree if the
+        state never occurred before.
+        :param state: The resulting state
+        :param table: An optional TranspositionTable to share the state node
+        with other paths reaching the same state.
+        :return: The state node of the state.
+        """
+        if table is None:
+            if state not in self.children:
+                self.children[state] = StateNode(self, state)
+            return self.children[state]
+
+        state_node = self.children.get(state)
+        if state_node is None:
+            state_node = table.state_node(self, state)
+            self.children[state] = state_node
+            if self.counts is None:
+                self.counts = {}
+        # backups follow the parents, so they have to point along the path,
+        # which was taken
+        state_node.parent = self
+        return state_node
+
+    def resample(self):
+        """
+        With outcome widening (see StateNode) an action holds at most
+        width(n) sampled states. Past that, one of them is drawn again in
+        proportion to how often it was reached, instead of performing the
+        action. Threads of a tree parallel search, which sample at the same
+        time, may exceed the cap by one each.
+        :return: The drawn state node or None if a state has to be sampled.
+        """
+        widening = self.parent.outcome_widening
+        if widening is None or len(self.children) < widening.width(self.n):
+            return None
 
+        states = list(self.children)
+        if self.counts is None:
+            weights = [x.n for x in self.children.values()]
+        else:
+            weights = [self.counts.get(state, 0) for state in states]
+        total = sum(weights)
+        if total == 0:
+            return self.children[widening.rng.choice(states)]
+        threshold = widening.rng.random() * total
+        for state, weight in zip(states, weights):
+            threshold -= weight
+            if threshold < 0:
+                break
         return self.children[state]
 
+    def collapse(self):
+        """
+        Drops the subtrees of all states sampled from this action to free
+        their memory. The statistics of the action are kept as an aggregate,
+        so its q and n do not change and new states can be sampled again.
+        :return: The number of nodes dropped.
+        """
+        nodes = 0
+        for child in self.children.values():
+            nodes += depth_first_search(child, _count_nodes)
+
+        if self.counts is None:
+            weight = sum([x.n for x in self.children.values()])
+        else:
+            weight = sum(self.counts.values())
+            self.counts = {}
+        if self.evicted is not None:
+            weight += self.evicted[1]
+        self.evicted = (self.q * weight, weight)
+
+        self.children.clear()
+        self.backup_cache = None
+        return nodes
+
     def __str__(self):
         return "Action: {}".format(self.action)
 
@@ -45,47 +149,429 @@ class ActionNode(Node):
 class StateNode(Node):
     """
     A node holding a state in the tree.
+
+    The action nodes are created on demand: by untried_action() when the
+    node is expanded, or by looking an action up in children. Leaves, which
+    are never expanded, hold none at all. children only holds the created
+    ones, the actions without a node yet count as untried with value 0.
     """
-    def __init__(self, parent, state):
+    # The distance to the root, only tracked by a TranspositionTable.
+    depth = 0
+    # The ProgressiveWidening which adds the action nodes one by one, or
+    # None if they may all be added.
+    widening = None
+    # The ProgressiveWidening which caps the sampled states of each action,
+    # or None if every sampled state is added.
+    outcome_widening = None
+    # Whether an action has to be counted as added node, once it is first
+    # visited.
+    lazy_actions = True
+    # The actions without an action node. None until the first expansion,
+    # then a list, or an iterator with progressive widening.
+    _pool = None
+    # The created action nodes, which may not have been visited yet.
+    _fresh = None
+
+    def __init__(self, parent, state, widening=None, outcome_widening=None):
+        """
+        :param parent: The parent ActionNode or None for a root
+        :param state: The state
+        :param widening: A ProgressiveWidening to add the actions with. By
+        default the one of the parent's parent is used.
+        :param outcome_widening: A ProgressiveWidening to cap the sampled
+        states of the actions with, see ActionNode.resample. By default the
+        one of the parent's parent is used.
+        """
         super(StateNode, self).__init__(parent)
+        self.children = _ActionChildren(self)
         self.state = state
         self.reward = 0
-        for action in state.actions:
-            self.children[action] = ActionNode(self, action)
+        if parent is not None:
+            if widening is None:
+                widening = parent.parent.widening
+            if outcome_widening is None:
+                outcome_widening = parent.parent.outcome_widening
+        if widening is not None:
+            self.widening = widening
+        if outcome_widening is not None:
+            self.outcome_widening = outcome_widening
 
     @property
     def untried_actions(self):
         """
-        All actions which have never be performed
+        All actions which have never be performed. With progressive
+        widening the next action is added once all added ones were tried
+        and the node was visited often enough.
+
+        This builds a list of all untried actions, untried_action() is
+        cheaper to expand the node.
         :return: A list of the untried actions.
         """
-        return [a for a in self.children if self.children[a].n == 0]
+        untried = [a for a, x in self.children.items() if x.n == 0]
+        if self.widening is None:
+            untried.extend(self._action_pool())
+        elif not untried:
+            action_node = self.untried_action()
+            if action_node is not None:
+                untried.append(action_node.action)
+        return untried
 
     @untried_actions.setter
     def untried_actions(self, value):
         raise ValueError("Untried actions can not be set.")
 
+    @property
+    def pending_actions(self):
+        """
+        Whether actions are left, which have no action node yet. Like
+        untried action nodes they count as value 0 in the Bellman backups.
+        """
+        pool = self._pool
+        if pool is None:
+            if self.widening is not None:
+                return True
+            return len(self.children) < len(self.state.actions)
+        return not isinstance(pool, list) or len(pool) > 0
+
+    def untried_action(self, rng=None):
+        """
+        Chooses an action, which was never performed, uniformly at random
+        and creates its node if necessary. In amortized constant time.
+        :param rng: The RandomStream (or seed) to choose with
+        :return: The ActionNode or None if all actions were tried.
+        """
+        fresh = self._fresh
+        if fresh:
+            # created nodes usually are visited right away
+            fresh = self._fresh = [x for x in fresh if x.n == 0]
+            if fresh:
+                return get_stream(rng).choice(fresh)
+
+        if self.widening is None:
+            pool = self._action_pool()
+            if not pool:
+                return None
+            # swap a random action to the end and pop it
+            i = get_stream(rng).randrange(len(pool))
+            pool[i], pool[-1] = pool[-1], pool[i]
+            return self._add_action(pool.pop())
+
+        if len(self.children) >= self.widening.width(self.n):
+            return None
+        if self._pool is None:
+            self._pool = self.widening.actions(self.state)
+        for action in self._pool:
+            # skip actions added otherwise, e.g. by a merge
+            if action not in self.children:
+                return self._add_action(action)
+        self._pool = []
+        return None
+
+    def _action_pool(self):
+        if self._pool is None:
+            self._pool = [a for a in self.state.actions
+                          if a not in self.children]
+        return self._pool
+
+    def _add_action(self, action):
+        action_node = ActionNode(self, action)
+        dict.__setitem__(self.children, action, action_node)
+        if self._fresh is None:
+            self._fresh = []
+        self._fresh.append(action_node)
+        return action_node
+
+    def _look_up(self, action):
+        # the action node of an action, which has none yet
+        if self.widening is None:
+            try:
+                self._action_pool().remove(action)
+            except ValueError:
+                raise KeyError(action)
+        return self._add_action(action)
+
+    def expand(self, priors=None):
+        """
+        Creates the nodes of all actions at once, e.g. for a tree policy
+        like PUCT, which chooses among all actions by their priors instead
+        of trying each one first. Afterwards no action counts as untried.
+        :param priors: The prior probabilities of the actions in the order
+        of state.actions, which are stored in ActionNode.prior. Optional.
+        """
+        children = self.children
+        for i, action in enumerate(self.state.actions):
+            action_node = children.get(action)
+            if action_node is None:
+                action_node = ActionNode(self, action)
+                dict.__setitem__(children, action, action_node)
+            if priors is not None:
+                action_node.prior = priors[i]
+        self._pool = []
+        self._fresh = None
+        self.lazy_actions = False
+
+    def child_statistics(self):
+        """
+        The statistics of all action children as contiguous arrays, e.g. to
+        score them at once.
+        :return: A tuple of the sequence of action nodes, their q values and
+        their visit counts.
+        """
+        action_nodes = list(self.children.values())
+        count = len(action_nodes)
+        q = np.fromiter((a.q for a in action_nodes), dtype=float, count=count)
+        n = np.fromiter((a.n for a in action_nodes), dtype=float, count=count)
+        return action_nodes, q, n
+
+    def reroot(self, action, observed_state, table=None):
+        """
+        Makes the child, which was reached by performing action and
+        observing observed_state, the root of a new tree to warm-start the
+        next search. The statistics of its subtree are kept, all other
+        subtrees are dropped from this node, so they can be freed.
+
+        :param action: The action, which was performed
+        :param observed_state: The state, which was observed afterwards. It
+        replaces the state of the matching child, e.g. to carry its belief.
+        :param table: The TranspositionTable of the search, if any. The
+        dropped nodes are removed from it.
+        :return: A tuple of the new root StateNode and RerootStats about the
+        kept subtree.
+        """
+        action_node = self.children[action]
+        root = action_node.children.get(observed_state)
+        if root is None:
+            root = StateNode(None, observed_state, self.widening,
+                             self.outcome_widening)
+        else:
+            root.parent = None
+            root.state = observed_state
+        self.children.clear()
+        self._pool = None
+        self._fresh = None
+        self.backup_cache = None
+
+        kept = set(iter_depth_first(root))
+        if table is not None:
+            table.retain(kept)
+            # a shared node may have been reached last via a dropped path
+            for node in kept:
+                if isinstance(node, ActionNode):
+                    for child in node.children.values():
+                        if child.parent not in kept:
+                            child.parent = node
+        return root, RerootStats(nodes=len(kept), visits=root.n)
+
     def __str__(self):
         return "State: {}".format(self.state)
 
 
+RerootStats = namedtuple('RerootStats', ['nodes', 'visits'])
+
+
+class _ActionChildren(dict):
+    """
+    The action nodes of a state node. Looking up an action without a node
+    creates it.
+    """
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        super(_ActionChildren, self).__init__()
+        self.node = node
+
+    def __missing__(self, action):
+        return self.node._look_up(action)
+
+
+class ProgressiveWidening(object):
+    """
+    Progressive widening for large action spaces. Instead of all actions at
+    once, a state node visited n times holds action nodes for at most
+    k * n^alpha actions. A new one is added once all held ones were tried.
+    So the search goes deep even if it could never try every action.
+
+    The actions are drawn lazily from state.actions, either in their order,
+    e.g. sorted by a prior, or uniformly at random without replacement.
+
+    Pass it to the root, all state nodes below use it as well:
+
+      >>> root = StateNode(None, state, ProgressiveWidening(k=2, alpha=.5))
+
+    For stochastic actions the number of sampled states per action node can
+    be capped the same way (double progressive widening). Past the cap the
+    known states are resampled in proportion to their visits, so their
+    statistics accumulate even if every sample is distinct:
+
+      >>> root = StateNode(None, state,
+      ...                  outcome_widening=ProgressiveWidening(k=1, alpha=.3))
+
+    See Couetoux et al. (2011) for reference.
+    """
+    def __init__(self, k=1., alpha=.5, ordered=False, rng=None):
+        """
+        :param k: The number of actions of a node visited once
+        :param alpha: How fast the number of actions grows, in (0, 1]
+        :param ordered: Add the actions in the order of state.actions, which
+        then can be any iterable. Otherwise they are drawn at random.
+        :param rng: The RandomStream (or seed) to draw the actions from
+        """
+        self.k = k
+        self.alpha = alpha
+        self.ordered = ordered
+        self.rng = get_stream(rng)
+
+    def width(self, n):
+        """
+        :param n: The visits of a state node
+        :return: How many actions the state node may hold.
+        """
+        return max(1, int(math.ceil(self.k * n ** self.alpha)))
+
+    def actions(self, state):
+        """
+        :param state: A state
+        :return: An iterator over the actions of state in the order they are
+        added to its node.
+        """
+        if self.ordered:
+            return iter(state.actions)
+        return self._shuffled(state.actions)
+
+    def _shuffled(self, actions):
+        # a Fisher-Yates shuffle, which only swaps the drawn positions
+        swapped = {}
+        for i in range(len(actions)):
+            j = i + self.rng.randrange(len(actions) - i)
+            yield actions[swapped.get(j, j)]
+            swapped[j] = swapped.get(i, i)
+
+
+class TranspositionTable(object):
+    """
+    Shares one StateNode among all paths, which reach the same state at the
+    same depth. This turns the tree into a directed acyclic graph. The
+    parent of a shared node always points along the last path, which was
+    taken to it, so the backups update the right path. Hence only one path
+    may be in flight at a time, i.e. in a serial search. Action nodes count
+    how often they reached each child, which the Bellman backup uses as
+    weights instead of the visits of the shared children.
+
+    The table holds at most max_size nodes and evicts the least recently
+    used ones. Evicted nodes stay in the tree, but are not shared anymore.
+    """
+    def __init__(self, max_size=None):
+        """
+        :param max_size: The maximal number of nodes in the table or None
+        for an unbounded table.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.evictions = 0
+        self._nodes = OrderedDict()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def state_node(self, action_node, state):
+        """
+        Returns the node of state reached via action_node. It is created if
+        the table does not hold one yet.
+        :param action_node: The action node the state was reached from
+        :param state: The state
+        :return: The StateNode.
+        """
+        depth = action_node.parent.depth + 1
+        key = (depth, state)
+        state_node = self._nodes.get(key)
+        if state_node is not None:
+            self._nodes.move_to_end(key)
+            self.hits += 1
+            return state_node
+
+        state_node = StateNode(action_node, state)
+        state_node.depth = depth
+        self._nodes[key] = state_node
+        if self.max_size is not None and len(self._nodes) > self.max_size:
+            self._nodes.popitem(last=False)
+            self.evictions += 1
+        return state_node
+
+    def retain(self, nodes):
+        """
+        Removes all state nodes from the table, which are not in nodes, e.g.
+        the ones dropped by StateNode.reroot.
+        :param nodes: A set of the nodes to keep
+        :return: The number of nodes removed.
+        """
+        dropped = [key for key, state_node in self._nodes.items()
+                   if state_node not in nodes]
+        for key in dropped:
+            del self._nodes[key]
+        return len(dropped)
+
+
+def iter_breadth_first(root, max_depth=None, min_visits=0):
+    """
+    Yields the nodes of the subtree starting from root breadth first. The
+    nodes are streamed, so a traversal can stop early without touching the
+    rest of the tree.
+    Nodes shared by several paths (see TranspositionTable) are yielded once.
+    :param root: The node to start from
+    :param max_depth: The deepest level to yield. Every state node and
+    every action node is one level, the root is level 0.
+    :param min_visits: Nodes visited fewer times are skipped together with
+    their subtrees.
+    :return: A generator of nodes
+    """
+    for node, _, _ in _traverse(root, True, max_depth, min_visits):
+        yield node
+
+
+def iter_depth_first(root, max_depth=None, min_visits=0):
+    """
+    Yields the nodes of the subtree starting from root depth first. See
+    iter_breadth_first for the parameters.
+    :return: A generator of nodes
+    """
+    for node, _, _ in _traverse(root, False, max_depth, min_visits):
+        yield node
+
+
+def _traverse(root, breadth_first, max_depth=None, min_visits=0):
+    # yields (node, parent, depth), where parent is the node the traversal
+    # reached node from
+    if root.n < min_visits:
+        return
+    queue = deque([(root, None, 0)])
+    pop = queue.popleft if breadth_first else queue.pop
+    seen = set([root])
+    while queue:
+        item = pop()
+        yield item
+        node, _, depth = item
+        if depth == max_depth:
+            continue
+        for child in node.children.values():
+            if child not in seen and child.n >= min_visits:
+                seen.add(child)
+                queue.append((child, node, depth + 1))
+
+
 def breadth_first_search(root, fnc=None):
     """
     A breadth first search (BFS) over the subtree starting from root. A
     function can be run on all visited nodes. It gets the current visited
     node and a data object, which it can update and should return it. This
     data is returned by the function but never altered from the BFS itself.
+    Nodes shared by several paths (see TranspositionTable) are visited once.
     :param root: The node to start the BFS from
     :param fnc: The function to run on the nodes
     :return: A data object, which can be altered from fnc.
     """
     data = None
-    queue = [root]
-    while queue:
-        node = queue.pop(0)
+    for node in iter_breadth_first(root):
         data = fnc(node, data)
-        for child in node.children.values():
-            queue.append(child)
     return data
 
 
@@ -95,20 +581,21 @@ def depth_first_search(root, fnc=None):
     function can be run on all visited nodes. It gets the current visited
     node and a data object, which it can update and should return it. This
     data is returned by the function but never altered from the DFS itself.
+    Nodes shared by several paths (see TranspositionTable) are visited once.
     :param root: The node to start the DFS from
     :param fnc: The function to run on the nodes
     :return: A data object, which can be altered from fnc.
     """
     data = None
-    stack = [root]
-    while stack:
-        node = stack.pop()
+    for node in iter_depth_first(root):
         data = fnc(node, data)
-        for child in node.children.values():
-            stack.append(child)
     return data
 
 
+def _count_nodes(node, data):
+    return (data or 0) + 1
+
+
 def get_actions_and_states(node):
     """
     Returns a tuple of two lists containing the action and the state nodes
@@ -116,7 +603,13 @@ def get_actions_and_states(node):
     :param node:
     :return: A tuple of two lists
     """
-    return depth_first_search(node, _get_actions_and_states)
+    action_nodes, state_nodes = [], []
+    for child in iter_depth_first(node):
+        if isinstance(child, ActionNode):
+            action_nodes.append(child)
+        elif isinstance(child, StateNode):
+            state_nodes.append(child)
+    return action_nodes, state_nodes
 
 
 def _get_actions_and_states(node, data):
@@ -130,4 +623,39 @@ def _get_actions_and_states(node, data):
     elif isinstance(node, StateNode):
         state_nodes.append(node)
 
-    return action_nodes, state_nodes
\ No newline at end of file
+    return action_nodes, state_nodes
+
+
+# the fields of a tree exported by to_records
+RECORD_DTYPE = np.dtype([('id', np.int64),
+                         ('parent', np.int64),
+                         ('depth', np.int32),
+                         ('is_action', np.bool_),
+                         ('n', np.int64),
+                         ('q', np.float64),
+                         ('reward', np.float64)])
+
+
+def to_records(root, max_depth=None, min_visits=0):
+    """
+    Exports the statistics of the subtree starting from root as a NumPy
+    record array of RECORD_DTYPE, one row per node in breadth first order.
+    The id of a node is its row, the parent of the root is -1. Action nodes
+    have a reward of 0.
+
+    A CompactTree is exported from its arrays directly by
+    CompactTree.to_records.
+    :param root: The node to start from
+    :param max_depth: See iter_breadth_first
+    :param min_visits: See iter_breadth_first
+    :return: A numpy.recarray
+    """
+    ids = {}
+    rows = []
+    for node, parent, depth in _traverse(root, True, max_depth, min_visits):
+        is_action = isinstance(node, ActionNode)
+        ids[node] = len(rows)
+        rows.append((len(rows), ids[parent] if parent is not None else -1,
+                     depth, is_action, node.n, node.q,
+                     0. if is_action else node.reward))
+    return np.array(rows, dtype=RECORD_DTYPE).view(np.recarray)
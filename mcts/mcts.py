@@ -1,7 +1,13 @@
 from __future__ import print_function
 
-import random
+import multiprocessing
+from timeit import default_timer as timer
+
 from . import utils
+from .backups import add_virtual_loss
+from .memory import MemoryBound
+from .parallel import root_parallel_search, tree_parallel_search
+from .profiling import Profile
 
 
 class MCTS(object):
@@ -9,46 +15,456 @@ class MCTS(object):
     The central MCTS class, which performs the tree search. It gets a
     tree policy, a default policy, and a backup strategy.
     See e.g. Browne et al. (2012) for a survey on monte carlo tree search
+
+    With workers > 1 the roll-outs are spread over independent searches in
+    a process pool (root parallelization). The policies, the backup and the
+    states have to be picklable then and the root must not have been
+    visited yet. Call close() to shut the pool down.
+
+    With threads > 1 several threads grow the tree together (tree
+    parallelization). A virtual loss of the given magnitude is added to
+    every node on a selected path and reverted in the backup, so the
+    threads spread over different branches. The backup has to accept a
+    virtual_loss keyword as Bellman and monte_carlo do.
+
+    With batch_size > 1 that many leaves are selected before they are
+    evaluated in one call to default_policy.batch(nodes). Virtual visits
+    keep the leaves of one batch apart.
+
+    With a TranspositionTable as transpositions the paths reaching the same
+    state at the same depth share one state node. A shared node points to
+    the parent it was reached from last, so the paths in flight of several
+    threads, workers or a batch would be backed up along the wrong parents.
+    Only a serial search can use transpositions.
+
+    The random decisions of the search are drawn from rng, a RandomStream
+    or a seed for one. Root parallel workers get independent streams
+    spawned from it. The policies and states take their own rng.
+
+    With profile=True the phases of a serial search are timed and counted,
+    see Profile. The Profile of the last search is kept in last_profile.
+    Callbacks per phase imply profiling.
+
+    With max_nodes or max_bytes the tree is kept below that many nodes or
+    (estimated) bytes by collapsing subtrees, see MemoryBound. The eviction
+    policy is 'least_visited' or 'least_recently_visited'. Only serial and
+    batched searches without transpositions can be bounded.
     """
-    def __init__(self, tree_policy, default_policy, backup):
+    def __init__(self, tree_policy, default_policy, backup, workers=1,
+                 threads=1, virtual_loss=1., batch_size=1,
+                 transpositions=None, rng=None, profile=False,
+                 callbacks=None, max_nodes=None, max_bytes=None,
+                 eviction='least_visited'):
         self.tree_policy = tree_policy
         self.default_policy = default_policy
         self.backup = backup
+        self.workers = workers
+        self.threads = threads
+        self.virtual_loss = virtual_loss
+        self.batch_size = batch_size
+        self.transpositions = transpositions
+        self.rng = utils.get_stream(rng)
+        self.profile = profile or bool(callbacks)
+        self.callbacks = callbacks
+        if self.profile and (workers > 1 or threads > 1 or batch_size > 1):
+            raise ValueError("Only a serial search can be profiled.")
+        if callbacks:
+            Profile(callbacks)  # fail early on unknown phases
+        if transpositions is not None and (workers > 1 or threads > 1 or
+                                           batch_size > 1):
+            raise ValueError("Only a serial search can use transpositions.")
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        if ((max_nodes is not None or max_bytes is not None) and
+                (workers > 1 or threads > 1 or transpositions is not None)):
+            raise ValueError("Only a serial or batched search without "
+                             "transpositions can be memory bounded.")
+        self.last_profile = None
+        self._pool = None
 
-    def __call__(self, root, n=1500):
+    def __call__(self, root, n=1500, time_budget=None, node_budget=None,
+                 early_stop=False, return_stats=False):
         """
-        Run the monte carlo tree search.
+        Run the monte carlo tree search. It stops as soon as any of the
+        budgets is used up.
 
         :param root: The StateNode
-        :param n: The number of roll-outs to be performed
-        :return:
+        :param n: The maximal number of roll-outs to be performed
+        :param time_budget: The maximal wall-clock time in seconds
+        :param node_budget: The maximal number of nodes to add to the tree
+        :param early_stop: Stop once the best action can not be overtaken
+        within the remaining budget anymore (not for root parallel search)
+        :param return_stats: Return the SearchStats along with the action
+        :return: The best action (and the SearchStats). The stats of the
+        last search are also kept in last_search.
         """
         if root.parent is not None:
             raise ValueError("Root's parent must be None.")
 
-        for _ in range(n):
-            node = _get_next_node(root, self.tree_policy)
+        budget = Budget(n, time_budget, node_budget, early_stop)
+        memory = None
+        if self.max_nodes is not None or self.max_bytes is not None:
+            memory = MemoryBound(root, self.max_nodes, self.max_bytes,
+                                 self.eviction)
+
+        if self.workers > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.workers)
+            root_parallel_search(self, root, budget, self._pool,
+                                 self.workers)
+        elif self.threads > 1:
+            tree_parallel_search(self, root, budget, self.threads,
+                                 self.virtual_loss)
+        elif self.batch_size > 1:
+            self._batched_search(root, budget, memory)
+        elif self.profile:
+            self.last_profile = Profile(self.callbacks)
+            self._profiled_search(root, budget, self.last_profile, memory)
+        else:
+            while not budget.exhausted(root):
+                node = _get_next_node(root, self.tree_policy,
+                                      self.transpositions, self.rng)
+                budget.count(node)
+                node.reward = self.default_policy(node)
+                self.backup(node)
+                if memory is not None:
+                    memory.update(root, node, budget.nodes)
+
+        self.last_search = budget.stats()
+        if memory is not None:
+            self.last_search.evictions = memory.evictions
+            self.last_search.evicted_nodes = memory.evicted_nodes
+        action = _recommend(root, self.rng).action
+        if return_stats:
+            return action, self.last_search
+        return action
+
+    def _batched_search(self, root, budget, memory=None):
+        while not budget.exhausted(root):
+            nodes = _batched_round([(root, budget)], self.tree_policy,
+                                   self.default_policy, self.backup,
+                                   self.batch_size, self.rng)
+            if memory is not None:
+                for node in nodes:
+                    memory.update(root, node, budget.nodes)
+
+    def _profiled_search(self, root, budget, profile, memory=None):
+        while not budget.exhausted(root):
+            node = _get_next_node(root, self.tree_policy,
+                                  self.transpositions, self.rng, profile)
+            budget.count(node)
+            start = timer()
             node.reward = self.default_policy(node)
+            start = profile.record('simulation', node, start)
             self.backup(node)
+            profile.record('backup', node, start)
+            if memory is not None:
+                memory.update(root, node, budget.nodes)
+
+    def close(self):
+        """
+        Shuts down the process pool of a root parallel search.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class SearchStats(object):
+    """
+    Statistics about a finished search.
+    """
+    def __init__(self, iterations, nodes, elapsed, stop_reason, evictions=0,
+                 evicted_nodes=0):
+        """
+        :param iterations: The number of roll-outs performed
+        :param nodes: The number of nodes added to the tree
+        :param elapsed: The wall-clock time of the search in seconds
+        :param stop_reason: Why the search stopped: 'iterations', 'time',
+        'nodes' or 'early'
+        :param evictions: The number of subtrees collapsed to stay within
+        the memory bound
+        :param evicted_nodes: The number of nodes dropped by them
+        """
+        self.iterations = iterations
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.stop_reason = stop_reason
+        self.evictions = evictions
+        self.evicted_nodes = evicted_nodes
+
+    def __str__(self):
+        text = "{} iterations, {} nodes in {:.4f}s, stopped by {}".format(
+            self.iterations, self.nodes, self.elapsed, self.stop_reason)
+        if self.evictions:
+            text += ", {} nodes in {} subtrees evicted".format(
+                self.evicted_nodes, self.evictions)
+        return text
+
+
+class Budget(object):
+    """
+    Decides when a search stops, based on the number of roll-outs, a
+    deadline, the number of added nodes and optionally on whether the best
+    action of the root is already decided.
+    """
+    def __init__(self, n, time_budget=None, node_budget=None,
+                 early_stop=False):
+        self.n = n
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.early_stop = early_stop
+        self.start = timer()
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = self.start + time_budget
+        self.iterations = 0
+        self.nodes = 0
+        self.stop_reason = None
 
-        return utils.rand_max(root.children.values(), key=lambda x: x.q).action
+    def exhausted(self, root):
+        """
+        Checks whether the search from root should stop.
+        :param root: The root StateNode of the search
+        :return: True if the search should stop.
+        """
+        if self.iterations >= self.n:
+            self.stop_reason = 'iterations'
+        elif self.deadline is not None and timer() >= self.deadline:
+            self.stop_reason = 'time'
+        elif self.node_budget is not None and self.nodes >= self.node_budget:
+            self.stop_reason = 'nodes'
+        elif self.early_stop and self._decided(root):
+            self.stop_reason = 'early'
+        else:
+            return False
+        return True
 
+    def count(self, node, virtual=False):
+        """
+        Counts a roll-out from the selected leaf, before its backup.
+        :param node: The selected leaf
+        :param virtual: Whether a virtual visit was already added to the
+        leaf during the selection
+        """
+        self.iterations += 1
+        self.count_nodes(node, virtual)
 
-def _expand(state_node):
-    action = random.choice(state_node.untried_actions)
-    return state_node.children[action].sample_state()
+    def count_nodes(self, node, virtual=False):
+        """
+        Counts the nodes added on the path to the selected leaf, i.e. the
+        state nodes which were never visited before, and their actions.
+        :param node: The selected leaf
+        :param virtual: Whether virtual visits were already added to the
+        path during the selection
+        """
+        unvisited = 1 if virtual else 0
+        while node.parent is not None and node.n == unvisited:
+            if node.lazy_actions:
+                # action nodes are counted once created on a path
+                self.nodes += 1 + (node.parent.n == unvisited)
+            else:
+                self.nodes += 1 + len(node.children)
+            node = node.parent.parent
 
+    def remaining(self):
+        """
+        An estimate of the number of roll-outs left in the budget.
+        """
+        remaining = self.n - self.iterations
+        if self.deadline is not None and self.iterations > 0:
+            now = timer()
+            rate = self.iterations / (now - self.start)
+            remaining = min(remaining, rate * (self.deadline - now))
+        return remaining
 
-def _best_child(state_node, tree_policy):
-    best_action_node = utils.rand_max(state_node.children.values(),
-                                      key=tree_policy)
-    return best_action_node.sample_state()
+    def _decided(self, root):
+        # the most visited action can not be caught up in visits anymore
+        # and is the greedy choice
+        if not root.children:
+            return False
+        # actions without a node are unvisited with value 0
+        visits = [a.n for a in root.children.values()]
+        values = [a.q for a in root.children.values()]
+        if root.pending_actions:
+            visits.append(0)
+            values.append(0)
+        if len(visits) < 2:
+            return True
+        best = max(range(len(visits)), key=lambda i: visits[i])
+        second = sorted(visits)[-2]
+        return (visits[best] - second > self.remaining() and
+                values[best] >= max(values))
 
+    def stats(self):
+        return SearchStats(self.iterations, self.nodes, timer() - self.start,
+                           self.stop_reason)
 
-def _get_next_node(state_node, tree_policy):
+
+def _recommend(root, rng=None):
+    best = None
+    if root.children:
+        best = utils.rand_max(root.children.values(), key=lambda x: x.q,
+                              rng=rng)
+    if best is None or (best.q < 0 and root.pending_actions):
+        # the actions without a node count as value 0
+        best = root.untried_action(rng) or best
+    return best
+
+
+def _best_action(state_node, tree_policy, rng=None):
+    batch = getattr(tree_policy, 'batch', None)
+    if batch is None:
+        return utils.rand_max(state_node.children.values(), key=tree_policy,
+                              rng=rng)
+
+    action_nodes, q, n = state_node.child_statistics()
+    scores = batch(action_nodes, q, n, state_node.n)
+    return action_nodes[utils.rand_argmax(scores, rng)]
+
+
+def _select(state_node, tree_policy, virtual_loss=None, table=None,
+            profile=None, rng=None):
+    """
+    Selects a leaf and expands it, the loop shared by all searches. Untried
+    actions are tried first. Tree policies with expand_all, e.g. PUCT,
+    instead expand all actions of a state node at once and choose among
+    them, whether tried or not, then the first state node which was never
+    visited is the leaf.
+
+    This is a generator, which yields every action node whose action has to
+    be performed in the state of its parent and is sent the resulting
+    state. So the caller decides how states are performed, e.g. outside of
+    a lock or awaiting a simulator. The leaf is the return value.
+    :param virtual_loss: The virtual loss to add to every node on the path,
+    which the backup has to revert, or None
+    :param table: An optional TranspositionTable
+    :param profile: An optional Profile to record the selection and the
+    expansion in
+    """
+    if profile is not None:
+        start = timer()
+    if virtual_loss is not None:
+        add_virtual_loss(state_node, virtual_loss)
+
+    expand_all = getattr(tree_policy, 'expand_all', False)
+    depth = 0
     while not state_node.state.is_terminal():
-        if state_node.untried_actions:
-            return _expand(state_node)
+        if expand_all:
+            if state_node.lazy_actions:
+                state_node.expand()
+            action_node = None
+        else:
+            action_node = state_node.untried_action(rng)
+        expand = action_node is not None
+        if expand:
+            if profile is not None:
+                start = profile.record('selection', state_node, start)
         else:
-            state_node = _best_child(state_node, tree_policy)
+            action_node = _best_action(state_node, tree_policy, rng)
+        if virtual_loss is not None:
+            add_virtual_loss(action_node, virtual_loss)
+
+        outcomes = len(action_node.children)
+        outcome = action_node.resample()
+        if outcome is None:
+            state = yield action_node
+        else:
+            state = outcome.state
+        state_node = action_node.add_state(state, table)
+        depth += 1
+        if profile is not None:
+            profile.count_sample(action_node, state_node, outcomes)
+
+        if expand_all and state_node.n == 0:
+            expand = True
+            if profile is not None:
+                start = profile.record('selection', state_node, start)
+            if not state.is_terminal():
+                if profile is not None:
+                    profile.expand(state_node)
+                else:
+                    state_node.expand()
+        if virtual_loss is not None:
+            add_virtual_loss(state_node, virtual_loss)
+
+        if expand:
+            if profile is not None:
+                profile.record('expansion', state_node, start)
+                profile.depths[depth] += 1
+            return state_node
+
+    if profile is not None:
+        profile.record('selection', state_node, start)
+        profile.depths[depth] += 1
     return state_node
+
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+def _perform(selection, lock=None):
+    # drives a _select generator, the states are performed without the lock
+    lock = lock or _NoLock()
+    state = None
+    while True:
+        with lock:
+            try:
+                action_node = selection.send(state)
+            except StopIteration as stop:
+                return stop.value
+        state = action_node.parent.state.perform(action_node.action)
+
+
+def _get_next_node(state_node, tree_policy, table=None, rng=None,
+                   profile=None):
+    """
+    Selects and expands a leaf, see _select.
+    """
+    return _perform(_select(state_node, tree_policy, table=table,
+                            profile=profile, rng=rng))
+
+
+def _get_next_node_virtual_loss(state_node, tree_policy, virtual_loss,
+                                lock=None, rng=None):
+    """
+    Like _get_next_node, but adds a virtual loss to every node on the path,
+    which the backup has to revert. If a lock is given, the tree is only
+    read and altered while holding it, but states are performed without it.
+    """
+    return _perform(_select(state_node, tree_policy, virtual_loss, rng=rng),
+                    lock)
+
+
+def _batched_round(searches, tree_policy, default_policy, backup,
+                   batch_size, rng=None):
+    """
+    Selects up to batch_size leaves in each tree, evaluates the leaves of
+    all trees in one call to default_policy.batch (if it has one) and backs
+    them up. Leaves of the same tree are kept apart by virtual visits
+    without a loss, so the backup has to accept a virtual_loss keyword.
+    :param searches: Pairs of the root and the Budget of every tree
+    :return: The list of the selected leaves
+    """
+    batch = getattr(default_policy, 'batch', None)
+    if batch is None:
+        batch = lambda nodes: [default_policy(x) for x in nodes]
+
+    nodes = []
+    for root, budget in searches:
+        for _ in range(min(batch_size, budget.n - budget.iterations)):
+            node = _get_next_node_virtual_loss(root, tree_policy, 0, rng=rng)
+            budget.count(node, virtual=True)
+            nodes.append(node)
+
+    for node, reward in zip(nodes, batch(nodes)):
+        node.reward = reward
+        backup(node, virtual_loss=0)
+    return nodes
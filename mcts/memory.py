@@ -0,0 +1,146 @@
+from __future__ import division
+
+import sys
+from timeit import default_timer as timer
+
+from .graph import depth_first_search, _count_nodes
+
+
+def least_visited(action_node):
+    """
+    Evicts the subtrees of the actions with the fewest visits first.
+    """
+    return action_node.n
+
+
+def least_recently_visited(action_node):
+    """
+    Evicts the subtrees of the actions, which were visited longest ago,
+    first.
+    """
+    return action_node.visited
+
+
+EVICTION_POLICIES = {'least_visited': least_visited,
+                     'least_recently_visited': least_recently_visited}
+
+
+class MemoryBound(object):
+    """
+    Keeps a tree below a number of nodes or bytes. Once the tree outgrows
+    the bound, the subtrees below the action nodes are collapsed (see
+    ActionNode.collapse) in the order of the eviction policy, until the
+    tree is down to low_water of the bound. The actions keep their
+    statistics, so the search goes on in constant memory.
+
+    The bytes of a tree are estimated from the shallow size of the root,
+    its state and its actions per node. Data the states refer to, e.g.
+    arrays, are not accounted for.
+    """
+    def __init__(self, root, max_nodes=None, max_bytes=None,
+                 policy='least_visited', low_water=.9):
+        """
+        :param root: The root StateNode of the search
+        :param max_nodes: The maximal number of nodes in the tree
+        :param max_bytes: The maximal estimated memory of the tree
+        :param policy: The name of an EVICTION_POLICIES entry or a function
+        of an action node, whose subtrees with the lowest values are
+        evicted first
+        :param low_water: The fraction of the bound an eviction shrinks the
+        tree to
+        """
+        if isinstance(policy, str):
+            policy = EVICTION_POLICIES[policy]
+        self.policy = policy
+        self.max_nodes = max_nodes
+        if max_bytes is not None:
+            by_bytes = int(max_bytes // estimate_node_bytes(root))
+            if max_nodes is None or by_bytes < max_nodes:
+                self.max_nodes = by_bytes
+        self.low_water = low_water
+        self.initial = depth_first_search(root, _count_nodes)
+        self.evictions = 0
+        self.evicted_nodes = 0
+
+    def size(self, added):
+        """
+        :param added: The number of nodes added since the bound was set up
+        :return: The number of nodes in the tree.
+        """
+        return self.initial + added - self.evicted_nodes
+
+    def visit(self, node):
+        """
+        Marks the actions on the path to node as visited now.
+        :param node: The leaf of the path
+        """
+        now = timer()
+        while node.parent is not None:
+            node.parent.visited = now
+            node = node.parent.parent
+
+    def update(self, root, node, added):
+        """
+        To be called after every backup. Evicts subtrees if the tree
+        outgrew the bound.
+        :param root: The root StateNode of the search
+        :param node: The leaf, which was backed up
+        :param added: The number of nodes added since the bound was set up
+        """
+        if self.policy is least_recently_visited:
+            self.visit(node)
+        if self.size(added) > self.max_nodes:
+            self.evict(root, self.size(added) -
+                       int(self.low_water * self.max_nodes))
+
+    def evict(self, root, nodes):
+        """
+        Collapses subtrees in the order of the policy until at least nodes
+        nodes are dropped or nothing is left to collapse.
+        :param root: The root StateNode of the search
+        :param nodes: The number of nodes to drop
+        """
+        candidates = []
+        stack = [root]
+        while stack:
+            state_node = stack.pop()
+            for action_node in state_node.children.values():
+                if action_node.children:
+                    candidates.append(action_node)
+                    stack.extend(action_node.children.values())
+        candidates.sort(key=self.policy)
+
+        dropped = 0
+        gone = set()
+        for action_node in candidates:
+            if dropped >= nodes:
+                break
+            if action_node in gone:
+                continue
+            # the action nodes in the subtree are dropped with it
+            stack = list(action_node.children.values())
+            while stack:
+                for child in stack.pop().children.values():
+                    gone.add(child)
+                    stack.extend(child.children.values())
+            dropped += action_node.collapse()
+            self.evictions += 1
+        self.evicted_nodes += dropped
+
+
+def estimate_node_bytes(state_node):
+    """
+    Estimates the memory per node from the shallow sizes of a state node,
+    its state and its action nodes.
+    :param state_node: A StateNode
+    :return: The average bytes per node.
+    """
+    action_nodes = list(state_node.children.values())
+    size = sum(_shallow_size(x)
+               for x in [state_node, state_node.state] + action_nodes)
+    return size / (1 + len(action_nodes))
+
+
+def _shallow_size(obj):
+    return (sys.getsizeof(obj) + sys.getsizeof(getattr(obj, '__dict__', {})) +
+            sys.getsizeof(getattr(obj, 'children', {})))
@@ -0,0 +1,183 @@
+from __future__ import division
+
+import threading
+
+from . import utils
+from .backups import Bellman
+from .graph import StateNode
+
+
+def root_parallel_search(mcts, root, budget, pool, workers):
+    """
+    Root parallelization: independent searches from copies of the root are
+    run in a process pool, each with its own RandomStream spawned from
+    mcts.rng. The statistics of the root's action nodes are merged
+    afterwards.
+
+    Only the state of the root is sent to the workers, so the root must not
+    have been visited yet. A subtree under it would not be searched.
+
+    See Chaslot et al. (2008) for reference.
+    :param mcts: The MCTS instance, whose policies and backup are used
+    :param root: The unvisited StateNode to search from
+    :param budget: The Budget of the search. The roll-outs and nodes are
+    shared among the workers, the deadline applies to each of them.
+    :param pool: A multiprocessing pool
+    :param workers: The number of independent searches
+    """
+    if root.n > 0:
+        raise ValueError("A root parallel search can not continue from a "
+                         "visited root, its subtree would be ignored.")
+
+    node_budgets = [None] * workers
+    if budget.node_budget is not None:
+        node_budgets = _split(budget.node_budget, workers)
+    jobs = [(mcts.tree_policy, mcts.default_policy, mcts.backup, root.state,
+             root.widening, root.outcome_widening, k, budget.time_budget,
+             nodes, rng)
+            for k, nodes, rng in zip(_split(budget.n, workers), node_budgets,
+                                     mcts.rng.spawn(workers))
+            if k > 0]
+
+    results = pool.map(_search_worker, jobs)
+    merge_root_statistics(root, [statistics for statistics, _ in results],
+                          mcts.backup)
+
+    reasons = [stats.stop_reason for _, stats in results]
+    budget.iterations = sum(stats.iterations for _, stats in results)
+    budget.nodes = sum(stats.nodes for _, stats in results)
+    budget.stop_reason = next((r for r in reasons if r != 'iterations'),
+                              'iterations')
+
+
+def merge_root_statistics(root, results, backup=None):
+    """
+    Merges the statistics of the root's action nodes found by independent
+    searches into root. The visit counts are summed and the q values are
+    averaged weighted by the visit counts.
+
+    The subtrees of the searches are not merged. The merged statistics are
+    kept as the aggregate of the action's dropped children (see
+    ActionNode.collapse), so a Bellman backup keeps weighting them in if the
+    search goes on from root.
+    :param root: The StateNode to merge into
+    :param results: For every search a list of (action, n, q) tuples
+    :param backup: The backup of the searches. The value of root is the
+    best action value for Bellman backups, as by default, and the visit
+    weighted mean of the action values otherwise, as for monte_carlo.
+    """
+    for statistics in results:
+        for action, n, q in statistics:
+            if n == 0:
+                continue
+            action_node = root.children[action]
+            total = action_node.n + n
+            action_node.q = (action_node.q * action_node.n + q * n) / total
+            action_node.n = total
+            root.n += n
+
+    action_nodes = list(root.children.values())
+    for action_node in action_nodes:
+        weight = action_node.n - sum(x.n for x in
+                                     action_node.children.values())
+        if weight > 0:
+            action_node.evicted = (action_node.q * weight, weight)
+            action_node.backup_cache = None
+    root.backup_cache = None
+
+    if backup is None or isinstance(backup, Bellman):
+        values = [a.q for a in action_nodes]
+        if root.pending_actions:
+            values.append(0)
+        root.q = max(values)
+    else:
+        visits = sum(a.n for a in action_nodes)
+        root.q = sum(a.q * a.n for a in action_nodes) / max(visits, 1)
+
+
+def tree_parallel_search(mcts, root, budget, threads, virtual_loss):
+    """
+    Tree parallelization: several threads grow one shared tree. A virtual
+    loss is added along every selected path, which keeps the threads off
+    the same branches, and reverted in the backup.
+
+    The tree and the node statistics are only read and altered while
+    holding a lock. States are performed and leaves are evaluated without
+    it, so this scales as far as state.perform and the default policy
+    release the GIL (or on free-threaded builds). A default policy, which
+    alters the tree, e.g. an EvaluatorPolicy storing priors, is passed the
+    lock if it has takes_lock set.
+
+    See Chaslot et al. (2008) for reference.
+    :param mcts: The MCTS instance, whose policies and backup are used
+    :param root: The StateNode to search from
+    :param budget: The Budget of the search
+    :param threads: The number of threads
+    :param virtual_loss: The magnitude of the virtual loss
+    """
+    from .mcts import _get_next_node_virtual_loss
+
+    lock = threading.Lock()
+    takes_lock = getattr(mcts.default_policy, 'takes_lock', False)
+    errors = []
+
+    def work(rng):
+        try:
+            while True:
+                with lock:
+                    if errors or budget.exhausted(root):
+                        return
+                    # count the roll-out before its leaf is selected
+                    budget.iterations += 1
+
+                node = _get_next_node_virtual_loss(root, mcts.tree_policy,
+                                                   virtual_loss, lock, rng)
+                with lock:
+                    budget.count_nodes(node, virtual=True)
+                if takes_lock:
+                    reward = mcts.default_policy(node, lock=lock)
+                else:
+                    reward = mcts.default_policy(node)
+
+                with lock:
+                    node.reward = reward
+                    mcts.backup(node, virtual_loss=virtual_loss)
+        except Exception as e:
+            errors.append(e)
+
+    # a stream is not thread safe, so every thread selects with its own
+    workers = [threading.Thread(target=work, args=(rng,))
+               for rng in mcts.rng.spawn(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _search_worker(job):
+    from .mcts import MCTS
+
+    (tree_policy, default_policy, backup, state, widening, outcome_widening,
+     n, time_budget, node_budget, rng) = job
+    # the policies and the state are copies, which would otherwise draw the
+    # same numbers in every worker
+    for owner in (tree_policy, default_policy, state, widening,
+                  outcome_widening):
+        if hasattr(owner, 'rng'):
+            owner.rng = rng
+    # so does a forked worker with the default stream of everything, which
+    # was not given an rng, e.g. random_terminal_roll_out
+    utils._default_stream = rng
+
+    root = StateNode(None, state, widening, outcome_widening)
+    _, stats = MCTS(tree_policy, default_policy, backup, rng=rng)(
+        root, n, time_budget=time_budget, node_budget=node_budget,
+        return_stats=True)
+    return [(a.action, a.n, a.q) for a in root.children.values()], stats
+
+
+def _split(n, parts):
+    return [n // parts + (1 if i < n % parts else 0) for i in range(parts)]
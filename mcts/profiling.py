@@ -0,0 +1,106 @@
+from __future__ import division
+
+from collections import Counter
+from timeit import default_timer as timer
+
+
+PHASES = ('selection', 'expansion', 'simulation', 'backup')
+
+
+class Profile(object):
+    """
+    Where the time of a search went. The four phases of every iteration are
+    timed: the selection of a leaf by the tree policy, its expansion, the
+    simulation by the default policy and the backup.
+
+    Also counted are the nodes created, the depths of the selected leaves
+    and how often sampling a state from an action node hit a state node,
+    which already existed.
+
+    Callbacks can be given per phase. They are called with the node the
+    phase ended at and the seconds it took.
+    """
+    def __init__(self, callbacks=None):
+        """
+        :param callbacks: A dict from phase names to callables
+        """
+        for phase in callbacks or {}:
+            if phase not in PHASES:
+                raise ValueError("Unknown phase {}, not one of {}."
+                                 .format(phase, ", ".join(PHASES)))
+        self.callbacks = callbacks or {}
+        self.time = dict.fromkeys(PHASES, 0.)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.nodes = 0
+        self.depths = Counter()
+        self.samples = 0
+        self.sample_hits = 0
+
+    def record(self, phase, node, start):
+        """
+        Adds the time since start to a phase.
+        :param phase: The name of the phase
+        :param node: The node the phase ended at
+        :param start: When the phase started
+        :return: The current time, i.e. the start of the next phase.
+        """
+        now = timer()
+        self.time[phase] += now - start
+        self.calls[phase] += 1
+        callback = self.callbacks.get(phase)
+        if callback is not None:
+            callback(node, now - start)
+            now = timer()
+        return now
+
+    def count_sample(self, action_node, state_node, outcomes):
+        """
+        Counts a state sampled from action_node and whether it hit an
+        existing node.
+        :param action_node: The action node
+        :param state_node: The sampled state node
+        :param outcomes: The number of children of action_node before
+        """
+        self.samples += 1
+        if len(action_node.children) == outcomes:
+            self.sample_hits += 1
+        elif state_node.n == 0 and state_node.lazy_actions:
+            # action nodes are counted once created on a path
+            self.nodes += 1 + (action_node.n == 0)
+        elif state_node.n == 0:
+            self.nodes += 1 + len(state_node.children)
+
+    def expand(self, state_node):
+        """
+        Creates the action nodes of a new leaf all at once (see
+        StateNode.expand) and counts them.
+        :param state_node: The leaf
+        """
+        state_node.expand()
+        # the action leading to the leaf was counted when sampling it
+        self.nodes += len(state_node.children) - (state_node.parent.n == 0)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of the sampled states, which were already in the tree.
+        """
+        return self.sample_hits / max(self.samples, 1)
+
+    @property
+    def total(self):
+        """
+        The summed time of all phases in seconds.
+        """
+        return sum(self.time.values())
+
+    def __str__(self):
+        total = max(self.total, 1e-12)
+        lines = ["{:<10} {:>6} calls {:10.4f}s {:6.1%}".format(
+                 phase, self.calls[phase], self.time[phase],
+                 self.time[phase] / total) for phase in PHASES]
+        depths = dict(sorted(self.depths.items()))
+        lines.append("{} nodes created, {:.1%} of {} samples hit, "
+                     "leaf depths {}".format(self.nodes, self.hit_rate,
+                                             self.samples, depths))
+        return "\n".join(lines)
@@ -0,0 +1,83 @@
+from __future__ import division
+
+from . import utils
+from .mcts import Budget, _batched_round, _recommend
+
+
+class TreeScheduler(object):
+    """
+    Searches many independent trees at once, e.g. the decisions of many
+    agents or episodes. The trees are advanced in lockstep: in every round
+    each tree, which has budget left, selects up to batch_size leaves, the
+    leaves of all trees are evaluated in one call to
+    default_policy.batch(nodes) and then backed up. So simulator work can
+    be batched across trees and the per call overhead is shared.
+
+    Leaves of the same tree in one round are kept apart by virtual visits
+    as in a batched MCTS search. The backup has to accept a virtual_loss
+    keyword as Bellman and monte_carlo do.
+
+      >>> scheduler = TreeScheduler(UCB1(1.41), immediate_reward,
+      ...                           Bellman(.6))
+      >>> best_actions = scheduler(roots, n=1000)
+    """
+    def __init__(self, tree_policy, default_policy, backup, batch_size=1,
+                 rng=None):
+        """
+        :param tree_policy: The tree policy
+        :param default_policy: The default policy. Its batch hook is used if
+        it has one.
+        :param backup: The backup
+        :param batch_size: The number of leaves each tree selects per round
+        :param rng: The RandomStream (or seed) of the random decisions
+        """
+        self.tree_policy = tree_policy
+        self.default_policy = default_policy
+        self.backup = backup
+        self.batch_size = batch_size
+        self.rng = utils.get_stream(rng)
+        self.last_searches = None
+
+    def __call__(self, roots, n=1500, time_budget=None, node_budget=None,
+                 early_stop=False, return_stats=False):
+        """
+        Searches from every root until its budgets are used up. Every budget
+        is either one value for all trees or a sequence with one value per
+        tree. The deadlines start with the search.
+
+        See MCTS.__call__ for the budgets.
+        :param roots: The root StateNodes
+        :return: The list of the best actions of the roots (and the list of
+        their SearchStats). The stats are also kept in last_searches.
+        """
+        roots = list(roots)
+        for root in roots:
+            if root.parent is not None:
+                raise ValueError("Root's parent must be None.")
+
+        budgets = [Budget(*limits) for limits in zip(
+            *[_per_tree(x, len(roots)) for x in
+              (n, time_budget, node_budget, early_stop)])]
+        active = list(range(len(roots)))
+        while True:
+            active = [i for i in active if not budgets[i].exhausted(roots[i])]
+            if not active:
+                break
+            _batched_round([(roots[i], budgets[i]) for i in active],
+                           self.tree_policy, self.default_policy, self.backup,
+                           self.batch_size, self.rng)
+
+        self.last_searches = [budget.stats() for budget in budgets]
+        actions = [_recommend(root, self.rng).action for root in roots]
+        if return_stats:
+            return actions, self.last_searches
+        return actions
+
+
+def _per_tree(value, trees):
+    if isinstance(value, (list, tuple)):
+        if len(value) != trees:
+            raise ValueError("Expected a budget for each of the {} trees."
+                             .format(trees))
+        return list(value)
+    return [value] * trees
@@ -0,0 +1,281 @@
+from __future__ import division
+
+import io
+import json
+import os
+import pickle
+import types
+
+import numpy as np
+
+from .compact_graph import CompactTree, CompactStateNode, _COLUMNS
+
+
+FORMAT_VERSION = 2
+
+# Objects, which are cheap to pickle again or are pickled by reference, so
+# they are never stored as shared objects
+_ATOMIC = (type(None), bool, int, float, complex, str, bytes, type,
+           types.FunctionType, types.BuiltinFunctionType)
+
+
+def save(root, path, serializer=pickle):
+    """
+    Saves the tree under root to the directory path in a columnar binary
+    format. Every column of CompactTree is written as an .npy file, the
+    states and actions as one blob of serialized payloads with an array of
+    their offsets.
+
+    States usually share objects, e.g. the world they live in or their
+    RandomStream. If the serializer has a Pickler and an Unpickler like
+    pickle, the objects referenced by several payloads are stored only once
+    and the loaded payloads share them again, like the saved ones did.
+
+    A tree can be saved from StateNodes or from a CompactTree. Nodes shared
+    via a TranspositionTable can not be saved.
+    :param root: The root StateNode of the tree
+    :param path: The directory to save to, which is created if necessary
+    :param serializer: Anything with dumps(object) -> bytes and
+    loads(bytes) -> object. pickle by default.
+    """
+    columns, payload = _to_columns(root)
+    sharing = _can_share(serializer)
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, dtype, _ in _COLUMNS:
+        np.save(os.path.join(path, name + '.npy'),
+                np.asarray(columns[name], dtype=dtype))
+
+    if sharing:
+        shared = _shared_objects(payload, serializer)
+        with open(os.path.join(path, 'shared.bin'), 'wb') as f:
+            f.write(serializer.dumps(shared))
+        ids = dict((id(x), i) for i, x in enumerate(shared))
+
+    offsets = [0]
+    with open(os.path.join(path, 'payload.bin'), 'wb') as f:
+        for item in payload:
+            if sharing:
+                pickler = serializer.Pickler(f, -1)
+                pickler.persistent_id = lambda x: ids.get(id(x))
+                pickler.dump(item)
+            else:
+                f.write(serializer.dumps(item))
+            offsets.append(f.tell())
+    np.save(os.path.join(path, 'offsets.npy'),
+            np.asarray(offsets, dtype=np.int64))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(dict(version=FORMAT_VERSION, size=len(payload),
+                       shared=sharing,
+                       columns=[name for name, _, _ in _COLUMNS]), f)
+
+
+def load(path, serializer=pickle, mmap=True):
+    """
+    Loads a tree saved with save() as a CompactTree, which can be searched
+    further.
+
+    With mmap the node arrays and the payloads are memory mapped copy on
+    write, so even large trees open instantly. Only the nodes which are
+    touched are read, and changes never go back to the files. The states
+    and actions are deserialized on first access.
+    :param path: The directory the tree was saved to
+    :param serializer: The serializer the tree was saved with
+    :param mmap: Whether to memory map the files instead of reading them
+    :return: The CompactTree. Its root is the root of the saved tree.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError("Unsupported snapshot version {}."
+                         .format(meta['version']))
+
+    mmap_mode = 'c' if mmap else None
+    columns = dict((name, np.load(os.path.join(path, name + '.npy'),
+                                  mmap_mode=mmap_mode))
+                   for name, _, _ in _COLUMNS)
+    offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode)
+    blob = os.path.join(path, 'payload.bin')
+    if mmap:
+        data = np.memmap(blob, dtype=np.uint8, mode='r')
+    else:
+        data = np.fromfile(blob, dtype=np.uint8)
+
+    shared = None
+    if meta['shared']:
+        shared = os.path.join(path, 'shared.bin')
+    return SnapshotTree(columns,
+                        _PayloadTable(data, offsets, serializer, shared),
+                        meta['size'])
+
+
+class SnapshotTree(CompactTree):
+    """
+    A CompactTree loaded from a snapshot. It behaves like any other compact
+    tree, but the outcomes of an action node are only indexed once new
+    states are sampled from it.
+    """
+    def __init__(self, columns, payload, size):
+        self._size = size
+        self._capacity = size
+        for name, _, _ in _COLUMNS:
+            setattr(self, name, columns[name])
+        self.payload = payload
+        self._outcomes = {}
+        self._indexed = set()
+        self.root = CompactStateNode(self, 0)
+
+    def add_state(self, index, state):
+        if index not in self._indexed:
+            self._indexed.add(index)
+            for child in self.children(index):
+                self._outcomes[(index, self.payload[child])] = child
+        return super(SnapshotTree, self).add_state(index, state)
+
+
+class _PayloadTable(object):
+    """
+    The states and actions of a loaded tree. The saved ones are
+    deserialized on first access and kept, new ones are appended. The
+    objects shared by the saved ones are loaded with the first of them.
+    """
+    def __init__(self, data, offsets, serializer, shared=None):
+        """
+        :param data: The serialized payloads
+        :param offsets: Where each of them starts in data and where the
+        last one ends
+        :param serializer: The serializer they were saved with
+        :param shared: The file of the shared objects or None if they were
+        saved without
+        """
+        self._data = data
+        self._offsets = offsets
+        self._serializer = serializer
+        self._shared_path = shared
+        self._shared = None
+        self._stored = len(offsets) - 1
+        self._loaded = {}
+        self._appended = []
+
+    def __len__(self):
+        return self._stored + len(self._appended)
+
+    def __getitem__(self, i):
+        if i >= self._stored:
+            return self._appended[i - self._stored]
+        item = self._loaded.get(i)
+        if item is None:
+            data = self._data[self._offsets[i]:self._offsets[i + 1]]
+            if self._shared_path is None:
+                item = self._serializer.loads(data.tobytes())
+            else:
+                unpickler = self._serializer.Unpickler(
+                    io.BytesIO(data.tobytes()))
+                unpickler.persistent_load = self._shared_object
+                item = unpickler.load()
+            self._loaded[i] = item
+        return item
+
+    def _shared_object(self, i):
+        if self._shared is None:
+            with open(self._shared_path, 'rb') as f:
+                self._shared = self._serializer.loads(f.read())
+        return self._shared[i]
+
+    def append(self, item):
+        self._appended.append(item)
+
+    def extend(self, items):
+        self._appended.extend(items)
+
+
+def _can_share(serializer):
+    return (hasattr(serializer, 'Pickler') and
+            hasattr(serializer, 'Unpickler'))
+
+
+class _NullFile(object):
+    def write(self, data):
+        pass
+
+
+def _shared_objects(payload, serializer):
+    # the objects, which are pickled with more than one item. A dry run
+    # pickles every item and notes the objects it reaches.
+    items = {}
+    seen = {}  # keeps the objects alive, so their ids are not reused
+
+    def note(x):
+        if not isinstance(x, _ATOMIC):
+            key = id(x)
+            if key not in reached:
+                reached.add(key)
+                items[key] = items.get(key, 0) + 1
+                seen[key] = x
+        return None
+
+    for item in payload:
+        reached = set()
+        pickler = serializer.Pickler(_NullFile(), -1)
+        pickler.persistent_id = note
+        pickler.dump(item)
+    return [seen[key] for key, count in items.items() if count > 1]
+
+
+def _to_columns(root):
+    # lays the tree out like CompactTree: every state node is directly
+    # followed by its action nodes, the states of an action are chained
+    columns = dict((name, []) for name, _, _ in _COLUMNS)
+    payload = []
+    last_child = {}
+    seen = set()
+
+    def add(item, **values):
+        index = len(payload)
+        for name, _, fill in _COLUMNS:
+            columns[name].append(values.get(name, fill))
+        payload.append(item)
+        return index
+
+    stack = [(root, -1)]
+    while stack:
+        state_node, parent = stack.pop()
+        if state_node in seen:
+            raise ValueError("Nodes shared by several parents can not be "
+                             "saved.")
+        seen.add(state_node)
+
+        # a compact tree holds all actions, also the ones without a node
+        actions = list(state_node.children)
+        if state_node.widening is None:
+            actions = list(state_node.state.actions)
+        index = add(state_node.state, parent=parent, n=state_node.n,
+                    q=state_node.q, reward=state_node.reward,
+                    num_children=len(actions))
+        if parent != -1:
+            if parent in last_child:
+                columns['next_sibling'][last_child[parent]] = index
+            else:
+                columns['first_child'][parent] = index
+            last_child[parent] = index
+
+        columns['first_child'][index] = index + 1
+        for action in actions:
+            action_node = state_node.children.get(action)
+            if action_node is None:
+                add(action, parent=index, is_action=True)
+                continue
+            outcomes = list(action_node.children.values())
+            # the aggregate of collapsed or merged children
+            evicted = action_node.evicted or (0., 0)
+            prior = action_node.prior
+            action = add(action, parent=index, n=action_node.n,
+                         q=action_node.q, num_children=len(outcomes),
+                         is_action=True, evicted_value=evicted[0],
+                         evicted_weight=evicted[1],
+                         prior=np.nan if prior is None else prior)
+            stack.extend((child, action) for child in reversed(outcomes))
+
+    return columns, payload
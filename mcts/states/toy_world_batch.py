@@ -0,0 +1,119 @@
+from __future__ import division
+
+import numpy as np
+
+from ..utils import get_stream
+from .toy_world_state import ToyWorldState, _ACTIONS
+
+
+# The moves of the actions in the order of ToyWorldState.actions
+_DIRECTIONS = np.array([a.action for a in _ACTIONS])
+
+# The belief after the manual was found
+_MANUAL_BELIEF = 49 * np.eye(len(_ACTIONS)) + 1
+
+
+class ToyWorldBatch(object):
+    """
+    N toy world states, which are stepped together by vectorized NumPy
+    operations instead of one ToyWorldState at a time. The positions are
+    held as an (N, 2) array and the beliefs as an (N, 4, 4) array, whose
+    rows are ordered like ToyWorldState.actions. Actions are given as
+    indices into this order.
+    """
+    def __init__(self, pos, world, belief=None, rng=None):
+        """
+        :param pos: The (N, 2) positions
+        :param world: The ToyWorld all states live in
+        :param belief: The (N, 4, 4) beliefs. None means uniform beliefs.
+        :param rng: The RandomStream (or seed) the outcomes are drawn from
+        """
+        self.pos = np.asarray(pos, dtype=int)
+        self.world = world
+        if belief is None:
+            belief = np.ones((len(self.pos), len(_ACTIONS), len(_ACTIONS)))
+        self.belief = np.asarray(belief, dtype=float)
+        self.rng = get_stream(rng)
+
+    @classmethod
+    def from_states(cls, states):
+        """
+        Builds a batch from ToyWorldStates of the same world.
+        :param states: A sequence of ToyWorldStates
+        :return: The ToyWorldBatch.
+        """
+        return cls([s.pos for s in states], states[0].world,
+                   [[s.belief[a] for a in _ACTIONS] for s in states],
+                   states[0].rng)
+
+    def state(self, i):
+        """
+        :param i: The index of the state
+        :return: The i-th state as ToyWorldState.
+        """
+        return ToyWorldState(self.pos[i].copy(), self.world,
+                             dict(zip(_ACTIONS, self.belief[i].copy())),
+                             self.rng)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def perform(self, actions):
+        """
+        Performs one action in every state.
+        :param actions: The (N,) indices of the actions
+        :return: The ToyWorldBatch of the resulting states.
+        """
+        index = np.arange(len(self))
+        actions = np.asarray(actions)
+
+        # draw the outcomes from the beliefs about the actions
+        cumulative = np.cumsum(self.belief[index, actions], axis=1)
+        threshold = (self.rng.generator.random(len(self)) *
+                     cumulative[:, -1])
+        samples = np.minimum((cumulative <= threshold[:, None]).sum(1),
+                             len(_ACTIONS) - 1)
+
+        belief = self.belief.copy()
+        belief[index, actions, samples] += 1
+
+        # manual found
+        belief[(self.pos == self.world.manual).all(1)] = _MANUAL_BELIEF
+
+        pos = np.clip(self.pos + _DIRECTIONS[samples], 0, self.world.size)
+        return ToyWorldBatch(pos, self.world, belief, self.rng)
+
+    def reward(self, parent):
+        """
+        The rewards of the states, which were reached from parent. As in
+        ToyWorldState.reward, the information gain is the summed relative
+        entropy of the beliefs about all actions.
+        :param parent: The ToyWorldBatch of the previous states
+        :return: The (N,) rewards.
+        """
+        reward = -np.ones(len(self))
+        if self.world.information_gain:
+            p = parent.belief / parent.belief.sum(2, keepdims=True)
+            q = self.belief / self.belief.sum(2, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                kl = np.where(p > 0, p * np.log(p / q), 0)
+            reward += kl.sum((1, 2))
+        reward[(self.pos == self.world.goal).all(1)] = 100
+        return reward
+
+    def random_roll_out(self, k, rng=None):
+        """
+        Performs k uniformly random actions in every state.
+        :param k: The number of steps
+        :param rng: The RandomStream (or seed) to draw the actions from. By
+        default the one of the outcomes.
+        :return: The (N,) summed rewards of the steps.
+        """
+        rng = self.rng if rng is None else get_stream(rng)
+        rewards = np.zeros(len(self))
+        batch = self
+        for _ in range(k):
+            actions = rng.generator.integers(len(_ACTIONS), size=len(self))
+            parent, batch = batch, batch.perform(actions)
+            rewards += batch.reward(parent)
+        return rewards
@@ -1,9 +1,14 @@
 from __future__ import division
 from __future__ import print_function
 
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
 import numpy as np
-from scipy.stats import rv_discrete, entropy
-from copy import deepcopy
+from scipy.stats import entropy
+
+from ..utils import get_stream
 
 
 class ToyWorldAction(object):
@@ -32,52 +37,65 @@ class ToyWorld(object):
         self.manual = manual
 
 
+# The actions are immutable, so all states share them.
+_ACTIONS = [ToyWorldAction(np.array([0, 1])),
+            ToyWorldAction(np.array([0, -1])),
+            ToyWorldAction(np.array([1, 0])),
+            ToyWorldAction(np.array([-1, 0]))]
+
+
 class ToyWorldState(object):
-    def __init__(self, pos, world, belief=None):
+    def __init__(self, pos, world, belief=None, rng=None):
         self.pos = pos
         self.world = world
-        self.actions = [ToyWorldAction(np.array([0, 1])),
-                        ToyWorldAction(np.array([0, -1])),
-                        ToyWorldAction(np.array([1, 0])),
-                        ToyWorldAction(np.array([-1, 0]))]
+        self.actions = _ACTIONS
+        # the RandomStream the outcomes are drawn from, shared with all
+        # successor states
+        self.rng = get_stream(rng)
         if belief:
             self.belief = belief
         else:
             self.belief = dict((a, np.array([1] * 4)) for a in self.actions)
 
     def _correct_position(self, pos):
-        upper = np.min(np.vstack((pos, self.world.size)), 0)
-        return np.max(np.vstack((upper, np.array([0, 0]))), 0)
+        size = self.world.size
+        return np.array([min(max(int(pos[0]), 0), int(size[0])),
+                         min(max(int(pos[1]), 0), int(size[1]))])
 
     def perform(self, action):
-        # get distribution about outcomes
-        probabilities = self.belief[action] / np.sum(self.belief[action])
-        distrib = rv_discrete(values=(range(len(probabilities)),
-                                      probabilities))
-
-        # draw sample
-        sample = distrib.rvs()
-
-        # update belief accordingly
-        belief = deepcopy(self.belief)
+        # draw an outcome from the belief about the action
+        weights = self.belief[action]
+        cumulative = list(accumulate(weights.tolist()
+                                     if isinstance(weights, np.ndarray)
+                                     else weights))
+        sample = min(bisect_right(cumulative,
+                                  self.rng.random() * cumulative[-1]),
+                     len(cumulative) - 1)
+
+        # update belief accordingly, the beliefs about the other actions are
+        # shared with this state
+        belief = dict(self.belief)
+        belief[action] = np.array(weights)
         belief[action][sample] += 1
 
         # manual found
-        if (self.pos == self.world.manual).all():
+        if (self.pos[0] == self.world.manual[0] and
+                self.pos[1] == self.world.manual[1]):
             print("m", end="")
-            belief = {ToyWorldAction(np.array([0, 1])): [50, 1, 1, 1],
-                      ToyWorldAction(np.array([0, -1])): [1, 50, 1, 1],
-                      ToyWorldAction(np.array([1, 0])): [1, 1, 50, 1],
-                      ToyWorldAction(np.array([-1, 0])): [1, 1, 1, 50]}
+            belief = dict(zip(self.actions, [[50, 1, 1, 1], [1, 50, 1, 1],
+                                             [1, 1, 50, 1], [1, 1, 1, 50]]))
 
         # build next state
-        pos = self._correct_position(self.pos + self.actions[sample].action)
+        direction = self.actions[sample].action
+        pos = self._correct_position((self.pos[0] + direction[0],
+                                      self.pos[1] + direction[1]))
 
-        return ToyWorldState(pos, self.world, belief)
+        return ToyWorldState(pos, self.world, belief, self.rng)
 
     def real_world_perform(self, action):
         # update belief accordingly
-        belief = deepcopy(self.belief)
+        belief = dict(self.belief)
+        belief[action] = np.array(belief[action])
         if (action.action == np.array([0, 1])).all():
             real_action = 0
         elif (action.action == np.array([0, -1])).all():
@@ -91,13 +109,11 @@ class ToyWorldState(object):
         # manual found
         if (self.pos == self.world.manual).all():
             print("M", end="")
-            belief = {ToyWorldAction(np.array([0, 1])): [50, 1, 1, 1],
-                      ToyWorldAction(np.array([0, -1])): [1, 50, 1, 1],
-                      ToyWorldAction(np.array([1, 0])): [1, 1, 50, 1],
-                      ToyWorldAction(np.array([-1, 0])): [1, 1, 1, 50]}
+            belief = dict(zip(self.actions, [[50, 1, 1, 1], [1, 50, 1, 1],
+                                             [1, 1, 50, 1], [1, 1, 1, 50]]))
 
         pos = self._correct_position(self.pos + action.action)
-        return ToyWorldState(pos, self.world, belief)
+        return ToyWorldState(pos, self.world, belief, self.rng)
 
     def is_terminal(self):
         return False
@@ -114,6 +130,33 @@ class ToyWorldState(object):
     def __repr__(self):
         return str(self.pos)
 
+    @staticmethod
+    def roll_out_batch(states, parents, k, rng=None):
+        """
+        The k step random rollouts of the batched default policies, stepped
+        together as ToyWorldBatch per world.
+        :param states: The ToyWorldStates to start from
+        :param parents: The states each of them was reached from
+        :param k: The number of rewards to sum up, the one of the state
+        itself included
+        :param rng: The RandomStream (or seed) to draw the actions from
+        :return: The (N,) summed rewards.
+        """
+        from .toy_world_batch import ToyWorldBatch
+
+        rewards = np.zeros(len(states))
+        if k <= 0:
+            return rewards
+        worlds = OrderedDict()
+        for i, state in enumerate(states):
+            worlds.setdefault(id(state.world), []).append(i)
+        for index in worlds.values():
+            batch = ToyWorldBatch.from_states([states[i] for i in index])
+            parent = ToyWorldBatch.from_states([parents[i] for i in index])
+            rewards[index] = (batch.reward(parent) +
+                              batch.random_roll_out(k - 1, rng))
+        return rewards
+
     def reward(self, parent, action):
         if (self.pos == self.world.goal).all():
             print("g", end="")
@@ -18,6 +18,59 @@ class UCB1(object):
                 self.c * np.sqrt(2 * np.log(action_node.parent.n) /
                                  action_node.n))
 
+    def batch(self, action_nodes, q, n, parent_n):
+        """
+        Scores all children of a state node in one go.
+        :param action_nodes: The action nodes
+        :param q: An array of their q values
+        :param n: An array of their visit counts
+        :param parent_n: The visit count of the state node
+        :return: An array of the scores
+        """
+        if self.c == 0:
+            return q
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return q + self.c * np.sqrt(2 * np.log(parent_n) / n)
+
+
+class PUCT(object):
+    """
+    The predictor upper confidence bounds of AlphaZero. The exploration
+    bonus of an action is weighted by its prior probability, so a search
+    guided by good priors does not have to try every action first.
+
+    The priors are read from ActionNode.prior, actions without one get a
+    uniform prior. They are usually set by an EvaluatorPolicy, see
+    mcts.evaluators. With PUCT all actions of a state node are expanded at
+    once (expand_all) and a state node, which was never visited, is the
+    leaf of the path.
+
+    See Silver et al. (2017) for reference.
+    """
+    expand_all = True
+
+    def __init__(self, c=1.):
+        self.c = c
+
+    def __call__(self, action_node):
+        parent = action_node.parent
+        prior = action_node.prior
+        if prior is None:
+            prior = 1 / len(parent.children)
+        return (action_node.q + self.c * prior *
+                np.sqrt(max(parent.n, 1)) / (1 + action_node.n))
+
+    def batch(self, action_nodes, q, n, parent_n):
+        """
+        Scores all children of a state node in one go, see UCB1.batch.
+        """
+        priors = np.fromiter((np.nan if a.prior is None else a.prior
+                              for a in action_nodes), dtype=float,
+                             count=len(action_nodes))
+        priors[np.isnan(priors)] = 1 / len(action_nodes)
+        return q + self.c * priors * np.sqrt(max(parent_n, 1)) / (1 + n)
+
 
 def flat(_):
     """
@@ -25,4 +78,11 @@ def flat(_):
     :param _:
     :return:
     """
-    return 0
\ No newline at end of file
+    return 0
+
+
+def _flat_batch(action_nodes, q, n, parent_n):
+    return np.zeros(len(action_nodes))
+
+
+flat.batch = _flat_batch
@@ -1,8 +1,88 @@
-import random
 import numpy as np
 
 
-def rand_max(iterable, key=None):
+class RandomStream(object):
+    """
+    A source of random numbers backed by a numpy.random.Generator. Uniform
+    numbers are drawn from the generator in blocks and handed out one by
+    one, which is much cheaper than one generator call per decision.
+
+    Threads may share a stream, e.g. the one of a default policy in a tree
+    parallel search. Every number is handed out to one of them only, but
+    which one depends on the scheduling. Independent streams for parallel
+    workers are created with spawn().
+    """
+    def __init__(self, seed=None, block_size=1024):
+        """
+        :param seed: An int, a numpy.random.SeedSequence, a
+        numpy.random.Generator to draw from or None for fresh entropy from
+        the OS
+        :param block_size: How many numbers to draw at once
+        """
+        if isinstance(seed, np.random.Generator):
+            self.generator = seed
+            self.seed_sequence = seed.bit_generator.seed_seq
+        else:
+            if not isinstance(seed, np.random.SeedSequence):
+                seed = np.random.SeedSequence(seed)
+            self.generator = np.random.default_rng(seed)
+            self.seed_sequence = seed
+        self.block_size = block_size
+        self._numbers = iter(())
+
+    def random(self):
+        """
+        :return: A uniform random number in [0, 1).
+        """
+        # taking a number from a list iterator is atomic, so threads never
+        # get the same one
+        while True:
+            try:
+                return next(self._numbers)
+            except StopIteration:
+                self._numbers = iter(
+                    self.generator.random(self.block_size).tolist())
+
+    def randrange(self, n):
+        """
+        :return: A uniform random integer in [0, n).
+        """
+        return min(int(self.random() * n), n - 1)
+
+    def choice(self, seq):
+        """
+        :return: A uniformly chosen element of the non-empty sequence seq.
+        """
+        return seq[self.randrange(len(seq))]
+
+    def spawn(self, n):
+        """
+        Creates independent streams, e.g. for parallel workers.
+        :param n: The number of streams
+        :return: A list of RandomStreams.
+        """
+        return [RandomStream(s, self.block_size)
+                for s in self.seed_sequence.spawn(n)]
+
+
+_default_stream = RandomStream()
+
+
+def get_stream(rng=None):
+    """
+    Turns the rng argument of the policies and states into a RandomStream.
+    :param rng: A RandomStream, a seed for a new one or None for the stream
+    shared by everything which was not given an rng
+    :return: A RandomStream.
+    """
+    if rng is None:
+        return _default_stream
+    if isinstance(rng, RandomStream):
+        return rng
+    return RandomStream(rng)
+
+
+def rand_max(iterable, key=None, rng=None):
     """
     A max function that tie breaks randomly instead of first-wins as in
     built-in max().
@@ -11,6 +91,7 @@ def rand_max(iterable, key=None):
       >>> rand_max([-2, 1], key=lambda x:x**2
       -2
       If key is None the identity is used.
+    :param rng: The RandomStream (or seed) to break ties with
     :return: The entry of the iterable which has the maximum value. Tie
     breaks are random.
     """
@@ -27,4 +108,20 @@ def rand_max(iterable, key=None):
             max_l = [item]
             max_v = value
 
-    return random.choice(max_l)
\ No newline at end of file
+    return get_stream(rng).choice(max_l)
+
+
+def rand_argmax(values, rng=None):
+    """
+    The index of the maximum of an array with random tie breaks. NaN values
+    are never chosen, unless all values are NaN.
+    :param values: A one dimensional array
+    :param rng: The RandomStream (or seed) to break ties with
+    :return: The index of the maximum value.
+    """
+    values = np.asarray(values, dtype=float)
+    values = np.where(np.isnan(values), -np.inf, values)
+    max_l = np.flatnonzero(values == values.max())
+    if len(max_l) == 1:
+        return int(max_l[0])
+    return int(max_l[get_stream(rng).randrange(len(max_l))])
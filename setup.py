@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 from setuptools import setup
 import mcts
@@ -11,6 +11,8 @@ setup(
     author_email='johannes.kulick@ipvs.uni-stuttgart.de',
     url='http://github.com/hildensia/mcts',
     packages=['mcts'],
-    requires=['numpy', 'scipy', 'pytest']
+    python_requires='>=3.5',
+    install_requires=['numpy>=1.17', 'scipy'],
+    tests_require=['pytest']
 )
 
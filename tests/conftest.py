@@ -0,0 +1,16 @@
+import pytest
+import numpy as np
+
+from mcts.graph import StateNode
+from mcts.states.toy_world_state import ToyWorld, ToyWorldState
+
+
+@pytest.fixture
+def toy_world_state():
+    world = ToyWorld((100, 100), False, (10, 10), np.array([100, 100]))
+    return ToyWorldState(np.array([0, 0]), world)
+
+
+@pytest.fixture
+def toy_world_root(toy_world_state):
+    return StateNode(None, toy_world_state)
@@ -0,0 +1,184 @@
+from mcts.graph import get_actions_and_states
+from mcts.utils import get_stream
+
+
+def assert_consistent(root):
+    """
+    Asserts that the visits of the tree under root add up. An action node
+    was visited as often as its children were reached from it, plus the
+    visits of dropped children. A state node (unless terminal) was visited
+    as often as its action nodes or once more, when it was a leaf. With a
+    transposition table a shared state node can be a leaf again, when a new
+    path reaches it, so then it may have been visited more often.
+    :param root: The root StateNode
+    """
+    action_nodes, state_nodes = get_actions_and_states(root)
+    shared = any(a.counts is not None for a in action_nodes)
+    for action in action_nodes:
+        if action.counts is None:
+            visits = sum(s.n for s in action.children.values())
+        else:
+            # shared children are also reached from other actions
+            visits = sum(action.counts.values())
+        if action.evicted is not None:
+            visits += action.evicted[1]
+        assert action.n == visits
+    for s in state_nodes:
+        if not s.state.is_terminal():
+            visits = sum(a.n for a in s.children.values())
+            assert s.n >= visits
+            assert shared or visits >= s.n - 1
+
+
+class UCBTestState(object):
+    def __init__(self, id=0):
+        self.actions = [0]
+        self.hash = id
+
+    def perform(self, action):
+        return UCBTestState(self.hash+1)
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return -1
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash
+
+
+class ComplexTestState(object):
+    def __init__(self, name):
+        self.actions = [ComplexTestAction('a'), ComplexTestAction('b')]
+        self.name = name
+
+    def perform(self, action):
+        return ComplexTestState(action.name)
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return -1
+
+    def __hash__(self):
+        return self.name.__hash__()
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+
+class ComplexTestAction(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __hash__(self):
+        return self.name.__hash__()
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+
+class GridState(object):
+    """
+    A state on an infinite grid, which many action sequences reach.
+    """
+    def __init__(self, x=0, y=0):
+        self.pos = (x, y)
+        self.actions = [(1, 0), (0, 1)]
+
+    def perform(self, action):
+        return GridState(self.pos[0] + action[0], self.pos[1] + action[1])
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return -1
+
+    def __hash__(self):
+        return hash(self.pos)
+
+    def __eq__(self, other):
+        return self.pos == other.pos
+
+
+class WideState(object):
+    """
+    A state with many actions, of which the action 0 is the best by far.
+    """
+    def __init__(self, depth=0, width=10000):
+        self.depth = depth
+        self.width = width
+        self.actions = range(width)
+
+    def perform(self, action):
+        return WideState(self.depth + 1, self.width)
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return 10 if action == 0 else -1
+
+    def __hash__(self):
+        return self.depth
+
+    def __eq__(self, other):
+        return self.depth == other.depth
+
+
+class NoisyState(object):
+    """
+    A state, whose actions move it by a noisy step, so every sampled state
+    is distinct.
+    """
+    def __init__(self, pos=0., depth=0, rng=None):
+        self.pos = pos
+        self.depth = depth
+        self.rng = get_stream(rng)
+        self.actions = [-1, 1]
+
+    def perform(self, action):
+        return NoisyState(self.pos + action + self.rng.random(),
+                          self.depth + 1, self.rng)
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return self.pos - parent.pos
+
+    def __hash__(self):
+        return hash((self.depth, self.pos))
+
+    def __eq__(self, other):
+        return self.depth == other.depth and self.pos == other.pos
+
+
+class CountDownState(object):
+    """
+    A state, which becomes terminal after a number of steps.
+    """
+    def __init__(self, steps):
+        self.steps = steps
+        self.actions = [0, 1]
+
+    def perform(self, action):
+        return CountDownState(self.steps - 1)
+
+    def is_terminal(self):
+        return self.steps <= 0
+
+    def reward(self, parent, action):
+        return 1
+
+    def __hash__(self):
+        return self.steps
+
+    def __eq__(self, other):
+        return self.steps == other.steps
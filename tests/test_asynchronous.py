@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from mcts.asynchronous import AsyncMCTS, RollOut, immediate_reward
+from mcts.graph import StateNode
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import assert_consistent
+
+
+class Simulator(object):
+    """
+    A stand-in for a simulator in another process, which answers after a
+    latency and counts the requests in flight.
+    """
+    def __init__(self, latency=.001):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def request(self, result):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        return result
+
+
+class SimulatedState(object):
+    """
+    A walk on a line, which ends at either end, with a simulator computing
+    the steps and rewards.
+    """
+    def __init__(self, simulator, pos=0, fail_at=None):
+        self.simulator = simulator
+        self.pos = pos
+        self.fail_at = fail_at
+        self.actions = [-1, 1]
+
+    async def perform(self, action):
+        if self.pos == self.fail_at:
+            raise RuntimeError("The simulator crashed.")
+        return await self.simulator.request(
+            SimulatedState(self.simulator, self.pos + action, self.fail_at))
+
+    def is_terminal(self):
+        return abs(self.pos) >= 5
+
+    async def reward(self, parent, action):
+        return await self.simulator.request(1. if self.pos >= 5 else 0.)
+
+    def __hash__(self):
+        return self.pos
+
+    def __eq__(self, other):
+        return self.pos == other.pos
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(.9),
+                                    backups.monte_carlo])
+@pytest.mark.parametrize("default_policy", [immediate_reward, RollOut(k=3)])
+def test_async_search(backup, default_policy):
+    simulator = Simulator()
+    root = StateNode(None, SimulatedState(simulator))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), default_policy, backup,
+                    concurrency=8, rng=1)
+    best_action, stats = asyncio.run(uct(root, n=100, return_stats=True))
+
+    assert best_action in [-1, 1]
+    assert root.n == 100
+    assert stats.iterations == 100
+    assert 1 < simulator.max_in_flight <= 8 * 2
+    assert_consistent(root)
+
+
+def test_async_search_finds_the_goal():
+    root = StateNode(None, SimulatedState(Simulator(latency=0)))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), immediate_reward,
+                    backups.Bellman(.9), concurrency=4, rng=2)
+    assert asyncio.run(uct(root, n=300)) == 1
+
+
+def test_async_search_of_blocking_states(toy_world_root):
+    root = toy_world_root
+    uct = AsyncMCTS(tree_policies.PUCT(1.41),
+                    default_policies.immediate_reward, backups.Bellman(.6),
+                    concurrency=4)
+    asyncio.run(uct(root, n=50))
+    assert root.n == 50
+    assert_consistent(root)
+
+
+def test_async_search_overlaps_latency():
+    simulator = Simulator(latency=.01)
+    root = StateNode(None, SimulatedState(simulator))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), immediate_reward,
+                    backups.monte_carlo, concurrency=10)
+    asyncio.run(uct(root, n=50))
+
+    # sequentially each simulation would wait for at least two requests
+    assert uct.last_search.elapsed < 50 * 2 * simulator.latency / 2
+
+
+def test_async_search_time_budget():
+    root = StateNode(None, SimulatedState(Simulator(latency=.01)))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), immediate_reward,
+                    backups.monte_carlo, concurrency=2)
+    asyncio.run(uct(root, n=10000, time_budget=.1))
+    assert uct.last_search.stop_reason == 'time'
+    assert root.n < 10000
+    assert_consistent(root)
+
+
+def test_async_search_raises_simulator_errors():
+    root = StateNode(None, SimulatedState(Simulator(), fail_at=0))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), immediate_reward,
+                    backups.monte_carlo)
+    with pytest.raises(RuntimeError):
+        asyncio.run(uct(root, n=10))
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(.9),
+                                    backups.monte_carlo])
+@pytest.mark.parametrize("failing", ['perform', 'evaluation'])
+def test_async_search_reverts_failed_simulations(backup, failing):
+    async def default_policy(state_node):
+        if failing == 'evaluation' and state_node.state.pos == 2:
+            raise ValueError("The evaluation failed.")
+        return await immediate_reward(state_node)
+
+    backed_up = []
+
+    def counting_backup(node, virtual_loss=None):
+        backed_up.append(node)
+        backup(node, virtual_loss=virtual_loss)
+
+    fail_at = 2 if failing == 'perform' else None
+    root = StateNode(None, SimulatedState(Simulator(), fail_at=fail_at))
+    uct = AsyncMCTS(tree_policies.UCB1(1.41), default_policy,
+                    counting_backup, concurrency=4, rng=0)
+    with pytest.raises((RuntimeError, ValueError)):
+        asyncio.run(uct(root, n=200))
+
+    # only the finished simulations are left in the tree
+    assert 0 < root.n == len(backed_up) < 200
+    assert_consistent(root)
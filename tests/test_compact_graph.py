@@ -0,0 +1,105 @@
+import pytest
+
+from mcts.compact_graph import CompactTree, CompactStateNode
+from mcts.graph import (depth_first_search, _get_actions_and_states, StateNode,
+                        to_records)
+from mcts.mcts import MCTS
+from mcts.states.toy_world_state import *
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import assert_consistent
+
+
+def test_root(toy_world_state):
+    tree = CompactTree(toy_world_state)
+    root = tree.root
+
+    assert isinstance(root, StateNode)
+    assert root.parent is None
+    assert root.n == 0
+    assert len(tree) == 1 + len(toy_world_state.actions)
+    assert set(root.children) == set(toy_world_state.actions)
+    assert set(root.untried_actions) == set(toy_world_state.actions)
+
+    for action, action_node in root.children.items():
+        assert action_node.action == action
+        assert action_node.parent == root
+
+
+def test_sample_state(toy_world_state):
+    tree = CompactTree(toy_world_state, capacity=1)
+    action_node = tree.root.children[toy_world_state.actions[0]]
+
+    states = set()
+    for _ in range(50):
+        child = action_node.sample_state()
+        assert isinstance(child, CompactStateNode)
+        assert child.parent == action_node
+        states.add(child)
+
+    assert len(action_node.children) == len(states)
+    assert len(tree) == 5 * (1 + len(states))
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(0.6),
+                                    backups.monte_carlo])
+def test_search(toy_world_state, backup):
+    tree = CompactTree(toy_world_state)
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backup)
+    best_action = uct(tree.root, n=100)
+
+    assert best_action in toy_world_state.actions
+    assert tree.root.n == 100
+
+    action_nodes, state_nodes = depth_first_search(tree.root,
+                                                   _get_actions_and_states)
+    assert len(action_nodes) + len(state_nodes) == len(tree)
+    assert_consistent(tree.root)
+
+
+def test_evicted(toy_world_state):
+    tree = CompactTree(toy_world_state)
+    action_node = tree.root.children[toy_world_state.actions[0]]
+    assert action_node.evicted is None
+    action_node.evicted = (-1.5, 3)
+    assert tree.root.children[toy_world_state.actions[0]].evicted == (-1.5, 3)
+    action_node.evicted = None
+    assert action_node.evicted is None
+
+
+def test_reroot(toy_world_state):
+    tree = CompactTree(toy_world_state)
+    action = toy_world_state.actions[0]
+    child = tree.root.children[action].sample_state()
+    with pytest.raises(ValueError) as error:
+        tree.root.reroot(action, child.state)
+    assert "rerooted" in str(error.value)
+
+
+def test_bytes_per_node(toy_world_state):
+    tree = CompactTree(toy_world_state)
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.monte_carlo)
+    uct(tree.root, n=100)
+
+    assert tree.nbytes > 0
+    assert tree.bytes_per_node == tree.nbytes / len(tree)
+
+
+def test_to_records(toy_world_state):
+    tree = CompactTree(toy_world_state)
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(0.6))
+    uct(tree.root, n=100)
+
+    records = tree.to_records()
+    assert len(records) == len(tree)
+    assert list(records.n) == list(tree.n[:len(tree)])
+    expected = to_records(tree.root)
+    for name in ['depth', 'is_action', 'n']:
+        assert sorted(records[name]) == sorted(expected[name])
+    assert sorted(records.q) == pytest.approx(sorted(expected.q))
@@ -0,0 +1,190 @@
+import pickle
+import time
+
+import pytest
+
+from mcts.graph import StateNode, get_actions_and_states
+from mcts.mcts import MCTS
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from mcts.states.toy_world_state import ToyWorldState
+
+from helpers import CountDownState, assert_consistent
+
+
+@pytest.fixture
+def leaves():
+    nodes = []
+    for steps in [0, 1, 3, 5, 8]:
+        root = StateNode(None, CountDownState(steps + 1))
+        nodes.append(root.children[0].sample_state())
+    return nodes
+
+
+def test_immediate_reward_batch(leaves):
+    assert (default_policies.immediate_reward.batch(leaves) ==
+            [default_policies.immediate_reward(x) for x in leaves])
+
+
+@pytest.mark.parametrize("k", [0, 1, 4, 10])
+def test_k_step_roll_out_batch(leaves, k):
+    policy = default_policies.RandomKStepRollOut(k)
+    assert policy.batch(leaves) == [policy(x) for x in leaves]
+
+
+@pytest.mark.parametrize("k", [0, 1, 4])
+def test_k_step_roll_out_batch_toy_world(toy_world_state, monkeypatch, k):
+    calls = []
+    roll_out_batch = ToyWorldState.roll_out_batch
+
+    def spy(*args):
+        calls.append(args)
+        return roll_out_batch(*args)
+
+    monkeypatch.setattr(ToyWorldState, 'roll_out_batch', staticmethod(spy))
+    leaves = [StateNode(None, toy_world_state).children[a].sample_state()
+              for a in toy_world_state.actions]
+    policy = default_policies.RandomKStepRollOut(k, rng=0)
+    # the goal is out of reach, so every step costs 1
+    assert policy.batch(leaves) == [-k] * len(leaves)
+    assert len(calls) == 1
+
+
+class SlowState(object):
+    """
+    A state, which is never terminal and whose perform releases the GIL
+    like a simulator would.
+    """
+    def __init__(self, depth=0):
+        self.depth = depth
+        self.actions = [0, 1]
+
+    def perform(self, action):
+        time.sleep(.0005)
+        return SlowState(self.depth + 1)
+
+    def is_terminal(self):
+        return False
+
+    def reward(self, parent, action):
+        return -1
+
+    def __hash__(self):
+        return self.depth
+
+    def __eq__(self, other):
+        return self.depth == other.depth
+
+
+def test_k_step_roll_out_tree_parallel():
+    root = StateNode(None, SlowState())
+    uct = MCTS(tree_policies.UCB1(1.41),
+               default_policies.RandomKStepRollOut(5), backups.Bellman(.6),
+               threads=4)
+    uct(root, n=40)
+
+    # every roll-out took all five steps
+    _, state_nodes = get_actions_and_states(root)
+    assert [x.reward for x in state_nodes if x is not root] == [-5] * 40
+
+
+def test_terminal_roll_out_batch(leaves):
+    policy = default_policies.random_terminal_roll_out
+    assert policy.batch(leaves) == [0, 1, 3, 5, 8]
+    assert policy.batch(leaves) == [policy(x) for x in leaves]
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(0.6),
+                                    backups.monte_carlo])
+@pytest.mark.parametrize("batch_size", [2, 7, 64])
+def test_batched_search(toy_world_root, backup, batch_size):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41),
+               default_policies.RandomKStepRollOut(3), backup,
+               batch_size=batch_size)
+    uct(root, n=50)
+
+    assert root.n == 50
+    assert_consistent(root)
+
+
+class CountingPolicy(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, state_node):
+        self.calls += 1
+        return float(self.calls)
+
+
+def test_cached_policy(leaves):
+    policy = CountingPolicy()
+    cached = default_policies.CachedPolicy(policy, samples=2)
+
+    assert [cached(leaves[0]) for _ in range(4)] == [1., 1.5, 1.5, 1.5]
+    assert policy.calls == 2
+    assert (cached.hits, cached.misses) == (2, 2)
+    assert cached.hit_rate == .5
+
+    # the same state reached along another path is served, too
+    other = StateNode(None, CountDownState(1)).children[1].sample_state()
+    assert other.state == leaves[0].state
+    assert cached(other) == 1.5
+
+
+def test_cached_policy_batch(leaves):
+    policy = default_policies.RandomKStepRollOut(10)
+    cached = default_policies.CachedPolicy(policy)
+    assert cached.batch(leaves) == [0, 1, 3, 5, 8]
+    assert cached.batch(leaves[::-1]) == [8, 5, 3, 1, 0]
+    assert cached.hits == 5
+
+
+@pytest.mark.parametrize("eviction", default_policies.CachedPolicy.EVICTIONS)
+def test_cached_policy_eviction(leaves, eviction):
+    cached = default_policies.CachedPolicy(CountingPolicy(), max_size=3,
+                                           eviction=eviction)
+    for _ in range(3):
+        cached(leaves[0])
+    for leaf in leaves[1:]:
+        cached(leaf)
+
+    assert len(cached) <= 3
+    assert cached.evictions == 5 - len(cached)
+    assert (leaves[0].state in cached._entries) == (eviction ==
+                                                    'least_visited')
+
+
+def test_cached_policy_search(toy_world_root):
+    root = toy_world_root
+    cached = default_policies.CachedPolicy(
+        default_policies.RandomKStepRollOut(3), max_size=100)
+    uct = MCTS(tree_policies.UCB1(1.41), cached, backups.Bellman(0.6),
+               batch_size=4)
+    uct(root, n=200)
+
+    assert root.n == 200
+    assert cached.hits > 0
+    assert len(cached) <= 100
+
+
+def test_cached_policy_root_parallel_search(toy_world_root):
+    # every worker gets a copy of the cache
+    root = toy_world_root
+    cached = default_policies.CachedPolicy(
+        default_policies.RandomKStepRollOut(3), max_size=100)
+    uct = MCTS(tree_policies.UCB1(1.41), cached, backups.Bellman(0.6),
+               workers=2)
+    try:
+        uct(root, n=100)
+    finally:
+        uct.close()
+
+    assert root.n == 100
+    copy = pickle.loads(pickle.dumps(cached))
+    assert copy._entries == cached._entries
+    with copy._lock:
+        assert copy.hit_rate == cached.hit_rate
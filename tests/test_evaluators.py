@@ -0,0 +1,233 @@
+import threading
+
+import pytest
+
+from mcts.compact_graph import CompactTree
+from mcts.evaluators import (EvaluatorPolicy, LinearEvaluator,
+                             RollOutEvaluator, EvaluationQueue)
+from mcts.graph import StateNode, get_actions_and_states
+from mcts.mcts import MCTS
+from mcts.states.toy_world_state import *
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import WideState, assert_consistent
+
+
+def _wide_evaluator(width):
+    # strongly prefers the action 0 of a WideState
+    policy_weights = np.zeros((1, width))
+    policy_weights[0, 0] = 10
+    linear = LinearEvaluator(lambda state: [1.], policy_weights, [0.])
+    rewards = RollOutEvaluator(default_policies.immediate_reward)
+
+    def evaluator(state_nodes):
+        return [(priors, value) for (priors, _), (_, value) in
+                zip(linear(state_nodes), rewards(state_nodes))]
+    return evaluator
+
+
+def test_puct():
+    puct = tree_policies.PUCT(2)
+    parent = StateNode(None, WideState(width=4))
+    parent.expand([.7, .1, .1, .1])
+    parent.n = 4
+    good, bad = parent.children[0], parent.children[1]
+
+    assert good.prior == .7
+    assert puct(good) == pytest.approx(2 * .7 * 2)
+    bad.q, bad.n = 1, 3
+    assert puct(bad) == pytest.approx(1 + 2 * .1 * 2 / 4)
+
+    action_nodes, q, n = parent.child_statistics()
+    assert (list(puct.batch(action_nodes, q, n, parent.n)) ==
+            pytest.approx([puct(a) for a in action_nodes]))
+
+
+def test_expand():
+    root = StateNode(None, WideState(width=5))
+    root.untried_action(rng=1)
+    root.expand()
+
+    assert sorted(root.children) == list(range(5))
+    assert root.untried_action() is None
+    assert not root.pending_actions
+    assert not root.lazy_actions
+    assert all(a.prior is None for a in root.children.values())
+
+
+def test_linear_evaluator(toy_world_root):
+    evaluator = LinearEvaluator(lambda state: state.pos,
+                                np.arange(12.).reshape(2, 6) / 10,
+                                [1., -1.])
+    leaves = [toy_world_root.children[a].sample_state()
+              for a in toy_world_root.state.actions]
+    evaluations = evaluator(leaves)
+
+    assert len(evaluations) == len(leaves)
+    for leaf, (priors, value) in zip(leaves, evaluations):
+        assert len(priors) == len(leaf.state.actions)
+        assert priors.sum() == pytest.approx(1)
+        assert value == pytest.approx(leaf.state.pos[0] - leaf.state.pos[1])
+        single = evaluator([leaf])[0]
+        assert list(single[0]) == pytest.approx(list(priors))
+
+
+def test_evaluator_policy_sets_priors_of_leaf_and_root():
+    root = StateNode(None, WideState(width=3))
+    root.expand()
+    leaf = root.children[1].sample_state()
+    policy = EvaluatorPolicy(_wide_evaluator(3))
+
+    assert policy(leaf) == -1
+    for node in [root, leaf]:
+        priors = [node.children[a].prior for a in range(3)]
+        assert priors[0] > .99
+        assert sum(priors) == pytest.approx(1)
+
+
+class _RecordingLock(object):
+    def __init__(self):
+        self.held = False
+
+    def __enter__(self):
+        assert not self.held
+        self.held = True
+
+    def __exit__(self, *args):
+        self.held = False
+
+
+def test_evaluator_policy_stores_priors_under_lock():
+    root = StateNode(None, WideState(width=3))
+    root.expand()
+    leaf = root.children[1].sample_state()
+    lock = _RecordingLock()
+    evaluator = _wide_evaluator(3)
+    events = []
+
+    def unlocked_evaluator(state_nodes):
+        events.append(('evaluate', lock.held))
+        return evaluator(state_nodes)
+
+    def expand(node):
+        def locked_expand(priors=None):
+            events.append(('expand', lock.held))
+            StateNode.expand(node, priors)
+        node.expand = locked_expand
+
+    expand(root)
+    expand(leaf)
+    assert EvaluatorPolicy(unlocked_evaluator)(leaf, lock=lock) == -1
+    assert events == [('evaluate', False), ('expand', True),
+                      ('expand', True)]
+
+
+def test_priors_guide_the_search():
+    visited = []
+    for tree_policy, default_policy in [
+            (tree_policies.UCB1(1.41), default_policies.immediate_reward),
+            (tree_policies.PUCT(1),
+             EvaluatorPolicy(_wide_evaluator(100)))]:
+        root = StateNode(None, WideState(width=100))
+        uct = MCTS(tree_policy, default_policy, backups.Bellman(.5), rng=1)
+        best_action = uct(root, n=50)
+        visited.append(len([a for a in root.children.values() if a.n > 0]))
+
+    assert visited[0] == 50
+    assert visited[1] < 5
+    assert best_action == 0
+    assert root.children[0].n > 40
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(batch_size=8),
+                                    dict(profile=True)])
+def test_puct_search(toy_world_root, kwargs):
+    uct = MCTS(tree_policies.PUCT(1.41),
+               EvaluatorPolicy(RollOutEvaluator(
+                   default_policies.RandomKStepRollOut(3))),
+               backups.Bellman(.6), **kwargs)
+    uct(toy_world_root, n=100)
+
+    assert toy_world_root.n == 100
+    assert_consistent(toy_world_root)
+    action_nodes, state_nodes = get_actions_and_states(toy_world_root)
+    for state_node in state_nodes:
+        if state_node.n > 0:
+            assert len(state_node.children) == len(state_node.state.actions)
+    # the actions of the root are expanded before the search counts nodes
+    assert uct.last_search.nodes == (len(action_nodes) + len(state_nodes) -
+                                     1 - len(toy_world_root.children))
+    if uct.last_profile is not None:
+        assert uct.last_profile.nodes == uct.last_search.nodes
+
+
+def test_puct_compact_tree(toy_world_root):
+    tree = CompactTree(toy_world_root.state)
+    uct = MCTS(tree_policies.PUCT(1.41), default_policies.immediate_reward,
+               backups.monte_carlo)
+    uct(tree.root, n=100)
+    assert tree.root.n == 100
+
+
+def test_priors_in_compact_tree():
+    tree = CompactTree(WideState(width=100))
+    uct = MCTS(tree_policies.PUCT(1), EvaluatorPolicy(_wide_evaluator(100)),
+               backups.Bellman(.5), rng=1)
+    assert uct(tree.root, n=50) == 0
+
+    priors = [a.prior for a in tree.root.child_statistics()[0]]
+    assert priors[0] > .99
+    assert sum(priors) == pytest.approx(1)
+    assert len([a for a in tree.root.children.values() if a.n > 0]) < 5
+    assert_consistent(tree.root)
+
+
+def test_evaluation_queue_batches_threads():
+    sizes = []
+
+    def evaluator(state_nodes):
+        sizes.append(len(state_nodes))
+        return [(None, 1.) for _ in state_nodes]
+
+    queue = EvaluationQueue(evaluator, batch_size=4, timeout=1.)
+    results = []
+
+    def work():
+        results.append(queue([None]))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [[(None, 1.)]] * 8
+    assert sizes == [4, 4]
+    assert queue.mean_batch_size == 4
+
+
+def test_evaluation_queue_timeout_and_errors():
+    queue = EvaluationQueue(lambda nodes: [(None, 0.)] * len(nodes),
+                            batch_size=100, timeout=.001)
+    assert queue([None, None]) == [(None, 0.), (None, 0.)]
+
+    def fail(nodes):
+        raise RuntimeError()
+
+    with pytest.raises(RuntimeError):
+        EvaluationQueue(fail, batch_size=1)([None])
+
+
+def test_tree_parallel_puct_search(toy_world_root):
+    queue = EvaluationQueue(RollOutEvaluator(
+        default_policies.immediate_reward), batch_size=4)
+    uct = MCTS(tree_policies.PUCT(1.41), EvaluatorPolicy(queue),
+               backups.Bellman(.6), threads=4)
+    uct(toy_world_root, n=200)
+
+    assert toy_world_root.n == 200
+    assert queue.evaluations >= 200
+    assert_consistent(toy_world_root)
@@ -0,0 +1,250 @@
+import pytest
+
+from mcts.graph import (StateNode, TranspositionTable, ProgressiveWidening,
+                        get_actions_and_states, iter_breadth_first,
+                        iter_depth_first, to_records, RECORD_DTYPE)
+from mcts.mcts import MCTS
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import GridState, WideState, NoisyState, assert_consistent
+
+
+def _state_nodes(root):
+    return get_actions_and_states(root)[1]
+
+
+def test_transposition_table_shares_nodes():
+    table = TranspositionTable()
+    root = StateNode(None, GridState())
+    right, up = root.children[(1, 0)], root.children[(0, 1)]
+
+    right_up = right.sample_state(table=table).children[(0, 1)]
+    up_right = up.sample_state(table=table).children[(1, 0)]
+
+    shared = right_up.sample_state(table=table)
+    assert up_right.sample_state(table=table) is shared
+    assert shared.parent is up_right
+    assert shared.depth == 2
+    assert len(table) == 3
+    assert table.hits == 1
+
+
+def test_transposition_table_eviction():
+    table = TranspositionTable(max_size=2)
+    root = StateNode(None, GridState())
+    for action in [(1, 0), (0, 1)]:
+        root.children[action].sample_state(table=table)
+    child = root.children[(1, 0)].children[GridState(1, 0)]
+    child.children[(1, 0)].sample_state(table=table)
+
+    assert len(table) == 2
+    assert table.evictions == 1
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(0.5),
+                                    backups.monte_carlo])
+def test_search_with_transpositions(backup):
+    table = TranspositionTable()
+    root = StateNode(None, GridState())
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backup, transpositions=table)
+    uct(root, n=300)
+
+    assert root.n == 300
+    assert table.hits > 0
+    state_nodes = _state_nodes(root)
+    assert len(set(state_nodes)) == len(state_nodes)
+    # every state of a grid with x + y = d is reachable at depth d only
+    for node in state_nodes:
+        assert node.depth == sum(node.state.pos)
+
+    assert_consistent(root)
+    if isinstance(backup, backups.Bellman):
+        assert abs(root.q - (-1. / (1 - 0.5))) < 0.1
+
+
+@pytest.mark.parametrize("parallel", [dict(threads=4), dict(batch_size=8),
+                                      dict(workers=2)])
+def test_transpositions_need_serial_search(parallel):
+    # a shared node points to the parent it was reached from last, so paths
+    # in flight would be backed up along another path
+    with pytest.raises(ValueError):
+        MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+             backups.Bellman(0.5), transpositions=TranspositionTable(),
+             **parallel)
+
+
+def test_transpositions_reduce_nodes():
+    roots = []
+    for table in [None, TranspositionTable()]:
+        root = StateNode(None, GridState())
+        uct = MCTS(tree_policies.UCB1(1.41),
+                   default_policies.immediate_reward, backups.monte_carlo,
+                   transpositions=table)
+        uct(root, n=300)
+        roots.append(root)
+
+    tree, dag = [_state_nodes(root) for root in roots]
+    assert len(dag) < len(tree)
+
+
+def test_progressive_widening_search():
+    root = StateNode(None, WideState(), ProgressiveWidening(k=1, alpha=.5))
+    assert len(root.children) == 0
+
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.5))
+    uct(root, n=400)
+
+    assert root.n == 400
+    assert len(root.children) <= 20
+    assert all(a.n > 0 for a in root.children.values())
+    action_nodes, state_nodes = get_actions_and_states(root)
+    assert max(s.state.depth for s in state_nodes) > 2
+    assert uct.last_search.nodes == len(action_nodes) + len(state_nodes) - 1
+
+
+def test_progressive_widening_width():
+    widening = ProgressiveWidening(k=2, alpha=.5)
+    assert [widening.width(n) for n in [0, 1, 4, 5]] == [1, 2, 4, 5]
+
+
+def test_progressive_widening_ordered():
+    root = StateNode(None, WideState(),
+                     ProgressiveWidening(k=1, alpha=1, ordered=True))
+    for n in range(6):
+        root.n = n
+        for action in root.untried_actions:
+            root.children[action].n = 1
+
+    assert list(root.children) == [0, 1, 2, 3, 4]
+    child = root.children[0].sample_state()
+    assert child.widening is root.widening
+
+
+def test_progressive_widening_draws_every_action_once():
+    root = StateNode(None, WideState(width=50),
+                     ProgressiveWidening(k=100, alpha=1, rng=1))
+    root.n = 1
+    for _ in range(60):
+        for action in root.untried_actions:
+            root.children[action].n = 1
+
+    assert sorted(root.children) == list(range(50))
+
+
+def test_action_nodes_are_created_lazily():
+    root = StateNode(None, WideState(width=5))
+    assert len(root.children) == 0
+    assert root.pending_actions
+
+    tried = []
+    for _ in range(5):
+        action_node = root.untried_action(rng=1)
+        action_node.n = 1
+        tried.append(action_node.action)
+    assert sorted(tried) == list(range(5))
+    assert root.untried_action() is None
+    assert not root.pending_actions
+
+
+def test_action_nodes_by_key():
+    root = StateNode(None, WideState(width=5))
+    action_node = root.children[3]
+    assert root.children[3] is action_node
+    action_node.n = 1
+    assert sorted(root.untried_actions) == [0, 1, 2, 4]
+    with pytest.raises(KeyError):
+        root.children[7]
+
+
+def _searched_grid(n=200):
+    root = StateNode(None, GridState())
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.5), rng=1)
+    uct(root, n=n)
+    return root
+
+
+def test_traversals_visit_every_node_once():
+    root = _searched_grid()
+    action_nodes, state_nodes = get_actions_and_states(root)
+    for traversal in [iter_breadth_first, iter_depth_first]:
+        nodes = list(traversal(root))
+        assert len(nodes) == len(action_nodes) + len(state_nodes)
+        assert len(set(nodes)) == len(nodes)
+        assert nodes[0] is root
+
+    depths = [sum(s.state.pos) for s in iter_breadth_first(root)
+              if isinstance(s, StateNode)]
+    assert depths == sorted(depths)
+
+
+def test_traversal_limits():
+    root = _searched_grid()
+    assert list(iter_depth_first(root, max_depth=0)) == [root]
+    assert all(sum(s.state.pos) <= 2 for s in iter_breadth_first(root, 4)
+               if isinstance(s, StateNode))
+    assert all(x.n >= 10 for x in iter_depth_first(root, min_visits=10))
+    assert list(iter_depth_first(root, min_visits=201)) == []
+
+
+def test_to_records():
+    root = _searched_grid()
+    records = to_records(root)
+    nodes = list(iter_breadth_first(root))
+
+    assert records.dtype == RECORD_DTYPE
+    assert len(records) == len(nodes)
+    assert list(records.n) == [x.n for x in nodes]
+    assert records.parent[0] == -1
+    for record in records[1:]:
+        assert records.depth[record.parent] == record.depth - 1
+        assert records.is_action[record.parent] != record.is_action
+    states = records[~records.is_action]
+    assert list(states.reward) == [x.reward for x in nodes
+                                   if isinstance(x, StateNode)]
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(threads=2),
+                                    dict(batch_size=4)])
+def test_outcome_widening_caps_outcomes(kwargs):
+    widening = ProgressiveWidening(k=1, alpha=.3, rng=1)
+    root = StateNode(None, NoisyState(rng=2), outcome_widening=widening)
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.5), **kwargs)
+    uct(root, n=300)
+
+    assert root.n == 300
+    action_nodes, state_nodes = get_actions_and_states(root)
+    # threads may sample past the cap at once
+    slack = kwargs.get('threads', 1) - 1
+    for action in action_nodes:
+        assert 0 < len(action.children) <= widening.width(action.n) + slack
+    assert_consistent(root)
+    assert all(s.outcome_widening is widening for s in state_nodes)
+    # the outcomes are revisited, so the search goes deep
+    assert max(s.state.depth for s in state_nodes) > 4
+
+
+def test_resample_in_proportion_to_visits():
+    root = StateNode(None, NoisyState(rng=3),
+                     outcome_widening=ProgressiveWidening(k=1, alpha=0,
+                                                          rng=4))
+    action_node = root.children[1]
+    assert action_node.resample() is None
+
+    rare = action_node.sample_state()
+    rare.n = 1
+    action_node.n = 1
+    common = action_node.add_state(NoisyState(5.))
+    common.n = 9
+    action_node.n = 10
+    samples = [action_node.sample_state() for _ in range(1000)]
+
+    assert len(action_node.children) == 2
+    assert 50 < samples.count(rare) < 150
+    assert samples.count(common) == 1000 - samples.count(rare)
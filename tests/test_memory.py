@@ -0,0 +1,108 @@
+import pytest
+
+from mcts.graph import StateNode, TranspositionTable, get_actions_and_states
+from mcts.memory import MemoryBound, estimate_node_bytes
+from mcts.mcts import MCTS
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import ComplexTestState
+
+
+def _size(root):
+    return sum(len(x) for x in get_actions_and_states(root))
+
+
+def test_collapse():
+    root = StateNode(None, ComplexTestState('root'))
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.5))
+    uct(root, n=50)
+
+    action_node = max(root.children.values(), key=lambda x: x.n)
+    q, n = action_node.q, action_node.n
+    subtree = sum(_size(x) for x in action_node.children.values())
+
+    assert action_node.collapse() == subtree
+    assert action_node.children == {}
+    assert action_node.evicted == (pytest.approx(q * n), n)
+    assert (action_node.q, action_node.n) == (q, n)
+
+    # the dropped statistics keep their weight
+    leaf = action_node.sample_state()
+    leaf.reward = -1
+    backups.Bellman(.5)(leaf)
+    assert action_node.n == n + 1
+    assert action_node.q == pytest.approx((q * n - 1) / (n + 1))
+
+
+@pytest.mark.parametrize("eviction", ['least_visited',
+                                      'least_recently_visited'])
+@pytest.mark.parametrize("backup", [backups.Bellman(.6),
+                                    backups.IncrementalBellman(.6),
+                                    backups.monte_carlo])
+def test_bounded_search(toy_world_root, eviction, backup):
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backup, max_nodes=200, eviction=eviction)
+    uct(toy_world_root, n=300)
+
+    stats = uct.last_search
+    assert toy_world_root.n == 300
+    assert _size(toy_world_root) <= 200
+    assert stats.evictions > 0
+    assert _size(toy_world_root) == 1 + stats.nodes - stats.evicted_nodes
+    assert "evicted" in str(stats)
+
+
+def test_incremental_bellman_matches_bellman_with_evictions():
+    roots = []
+    for backup in [backups.Bellman(.6), backups.IncrementalBellman(.6)]:
+        root = StateNode(None, ComplexTestState('root'))
+        uct = MCTS(tree_policies.UCB1(1.41),
+                   default_policies.immediate_reward, backup, max_nodes=30,
+                   rng=3)
+        uct(root, n=200)
+        roots.append(root)
+
+    expected, actual = [get_actions_and_states(root) for root in roots]
+    for expected_nodes, actual_nodes in zip(expected, actual):
+        assert len(expected_nodes) == len(actual_nodes)
+        for e, a in zip(expected_nodes, actual_nodes):
+            assert a.n == e.n
+            assert a.q == pytest.approx(e.q, abs=1e-9)
+
+
+def test_max_bytes(toy_world_root):
+    per_node = estimate_node_bytes(toy_world_root)
+    bound = MemoryBound(toy_world_root, max_bytes=100 * per_node)
+    assert bound.max_nodes == 100
+
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6), max_bytes=100 * per_node, batch_size=4)
+    uct(toy_world_root, n=100)
+    assert _size(toy_world_root) <= 100
+
+
+def test_least_recently_visited_evicts_old_subtrees(toy_world_root):
+    old, new = [toy_world_root.children[a] for a in
+                toy_world_root.state.actions[:2]]
+    for action_node in [old, new]:
+        action_node.sample_state()
+        action_node.n = 1
+    old.visited, new.visited = 1., 2.
+
+    bound = MemoryBound(toy_world_root, max_nodes=10,
+                        policy='least_recently_visited')
+    bound.evict(toy_world_root, 1)
+    assert (len(old.children), len(new.children)) == (0, 1)
+    assert (bound.evictions, bound.evicted_nodes) == (1, 1)
+
+
+def test_unsupported_searches():
+    for kwargs in [dict(threads=2), dict(workers=2),
+                   dict(transpositions=TranspositionTable())]:
+        with pytest.raises(ValueError):
+            MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+                 backups.Bellman(.6), max_nodes=100, **kwargs)
@@ -0,0 +1,195 @@
+import pytest
+
+from mcts.graph import StateNode
+from mcts.mcts import MCTS
+from mcts.parallel import merge_root_statistics
+from mcts.states.toy_world_state import *
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import assert_consistent
+
+
+class LoggingState(object):
+    """
+    A state, which becomes terminal after a number of steps and appends the
+    actions, which led there, to a file.
+    """
+    def __init__(self, path, steps=5, trail=()):
+        self.path = path
+        self.steps = steps
+        self.trail = trail
+        # one action at the root, so the roll-outs make the difference
+        self.actions = list(range(100)) if trail else [0]
+
+    def perform(self, action):
+        state = LoggingState(self.path, self.steps - 1,
+                             self.trail + (action,))
+        if state.is_terminal():
+            with open(self.path, 'a') as f:
+                f.write("{}\n".format(state.trail))
+        return state
+
+    def is_terminal(self):
+        return self.steps <= 0
+
+    def reward(self, parent, action):
+        return 0
+
+    def __hash__(self):
+        return hash(self.trail)
+
+    def __eq__(self, other):
+        return self.trail == other.trail
+
+
+def test_root_parallel_roll_outs_differ(tmpdir):
+    # the workers are forked with a copy of the default stream
+    path = str(tmpdir.join('trails'))
+    root = StateNode(None, LoggingState(path))
+    uct = MCTS(tree_policies.UCB1(1.41),
+               default_policies.random_terminal_roll_out,
+               backups.monte_carlo, workers=3)
+    try:
+        uct(root, n=3)
+    finally:
+        uct.close()
+
+    with open(path) as f:
+        trails = f.read().splitlines()
+    assert len(trails) == 3
+    assert len(set(trails)) == 3
+
+
+def test_merge_root_statistics(toy_world_root):
+    root = toy_world_root
+    state = root.state
+    a0, a1 = state.actions[:2]
+    merge_root_statistics(root, [[(a0, 1, -1.), (a1, 3, 1.)],
+                                 [(a0, 3, 1.), (a1, 0, 0.)]])
+
+    assert root.n == 7
+    assert root.children[a0].n == 4
+    assert root.children[a0].q == .5
+    assert root.children[a1].n == 3
+    assert root.children[a1].q == 1.
+    assert root.q == 1.
+    assert root.children[a0].evicted == (2., 4)
+    assert_consistent(root)
+
+
+def test_merge_root_statistics_monte_carlo(toy_world_root):
+    root = toy_world_root
+    a0, a1 = root.state.actions[:2]
+    merge_root_statistics(root, [[(a0, 1, -1.), (a1, 3, 1.)],
+                                 [(a0, 3, 1.)]], backups.monte_carlo)
+
+    # the mean of all roll-outs
+    assert root.q == pytest.approx((4 * .5 + 3 * 1.) / 7)
+
+
+@pytest.mark.parametrize("n", [1, 3, 40])
+def test_root_parallel_search(toy_world_root, n):
+    root = toy_world_root
+    state = root.state
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(0.6), workers=2)
+    try:
+        best_action = uct(root, n=n)
+    finally:
+        uct.close()
+
+    assert best_action in state.actions
+    assert root.n == n
+    assert sum(a.n for a in root.children.values()) == n
+    assert_consistent(root)
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(0.6),
+                                    backups.IncrementalBellman(0.6)])
+def test_search_after_root_parallel_search(toy_world_root, backup):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backup, workers=2)
+    try:
+        uct(root, n=40)
+        # the subtree of the root is not shipped to the workers
+        with pytest.raises(ValueError):
+            uct(root, n=40)
+    finally:
+        uct.close()
+
+    merged = dict((a.action, a.n) for a in root.children.values())
+    MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+         backup)(root, n=40)
+    assert root.n == 80
+    assert_consistent(root)
+    # the merged statistics keep their weight
+    for action_node in root.children.values():
+        value, weight = action_node.evicted
+        assert weight == merged[action_node.action]
+        children = action_node.children.values()
+        value += sum((.6 * x.q + x.reward) * x.n for x in children)
+        weight += sum(x.n for x in children)
+        assert action_node.q == pytest.approx(value / weight)
+
+
+def test_root_parallel_search_is_reproducible():
+    def search():
+        world = ToyWorld((100, 100), False, (10, 10), np.array([100, 100]))
+        root = StateNode(None, ToyWorldState((0, 0), world, rng=1))
+        uct = MCTS(tree_policies.UCB1(1.41),
+                   default_policies.RandomKStepRollOut(3, rng=1),
+                   backups.Bellman(0.6), workers=2, rng=1)
+        try:
+            uct(root, n=40)
+        finally:
+            uct.close()
+        return [(a.action, a.n, a.q) for a in root.children.values()]
+
+    assert search() == search()
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(0.6),
+                                    backups.monte_carlo])
+@pytest.mark.parametrize("n", [1, 10, 101])
+def test_tree_parallel_search(toy_world_root, backup, n):
+    root = toy_world_root
+    state = root.state
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backup, threads=4, virtual_loss=2.)
+    best_action = uct(root, n=n)
+
+    assert best_action in state.actions
+    assert root.n == n
+    assert_consistent(root)
+
+
+def test_virtual_loss():
+    node = StateNode(None, ToyWorldState((0, 0), None))
+    node.n, node.q = 3, 2.
+
+    backups.add_virtual_loss(node, 4.)
+    assert node.n == 4
+    assert node.q == (3 * 2. - 4.) / 4
+
+    backups.revert_virtual_loss(node, 4.)
+    assert node.n == 3
+    assert node.q == 2.
+
+
+def test_monte_carlo_reverts_virtual_loss():
+    root = StateNode(None, ToyWorldState((0, 0), None))
+    action = root.children[root.state.actions[0]]
+    leaf = action.add_state(ToyWorldState((0, 1), None))
+    leaf.reward = 3.
+
+    for node in (root, action, leaf):
+        backups.add_virtual_loss(node, 1.)
+    backups.monte_carlo(leaf, virtual_loss=1.)
+
+    for node in (root, action, leaf):
+        assert node.n == 1
+        assert node.q == 3.
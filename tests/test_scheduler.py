@@ -0,0 +1,77 @@
+import pytest
+
+from mcts.graph import StateNode
+from mcts.scheduler import TreeScheduler
+from mcts.states.toy_world_state import *
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import assert_consistent
+
+
+def _roots(count):
+    world = ToyWorld((100, 100), False, (10, 10), np.array([100, 100]))
+    return [StateNode(None, ToyWorldState((i, i), world, rng=i))
+            for i in range(count)]
+
+
+class BatchCounter(object):
+    """
+    Counts the leaves of every call to the wrapped default policy.
+    """
+    def __init__(self, default_policy):
+        self.default_policy = default_policy
+        self.sizes = []
+
+    def __call__(self, state_node):
+        return self.default_policy(state_node)
+
+    def batch(self, state_nodes):
+        self.sizes.append(len(state_nodes))
+        return self.default_policy.batch(state_nodes)
+
+
+@pytest.mark.parametrize("backup", [backups.Bellman(.6),
+                                    backups.IncrementalBellman(.6),
+                                    backups.monte_carlo])
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_scheduler(backup, batch_size):
+    roots = _roots(10)
+    policy = BatchCounter(default_policies.immediate_reward)
+    scheduler = TreeScheduler(tree_policies.UCB1(1.41), policy, backup,
+                              batch_size=batch_size, rng=1)
+    actions = scheduler(roots, n=40)
+
+    assert len(actions) == 10
+    for root, action in zip(roots, actions):
+        assert action in root.state.actions
+        assert root.n == 40
+        assert_consistent(root)
+    # the leaves of all trees are evaluated together
+    assert policy.sizes == [10 * batch_size] * (40 // batch_size)
+    assert all(s.iterations == 40 for s in scheduler.last_searches)
+
+
+def test_scheduler_per_tree_budgets():
+    roots = _roots(3)
+    policy = BatchCounter(default_policies.immediate_reward)
+    scheduler = TreeScheduler(tree_policies.UCB1(1.41), policy,
+                              backups.Bellman(.6), batch_size=3)
+    _, stats = scheduler(roots, n=[5, 10, 10 ** 6],
+                         time_budget=[None, None, .05], return_stats=True)
+
+    assert [root.n for root in roots[:2]] == [5, 10]
+    assert [s.stop_reason for s in stats] == ['iterations', 'iterations',
+                                              'time']
+    assert policy.sizes[:2] == [9, 8]
+    assert set(policy.sizes[4:]) == set([3])
+
+
+def test_scheduler_budgets_must_match_the_trees():
+    scheduler = TreeScheduler(tree_policies.UCB1(1.41),
+                              default_policies.immediate_reward,
+                              backups.Bellman(.6))
+    with pytest.raises(ValueError):
+        scheduler(_roots(3), n=[1, 2])
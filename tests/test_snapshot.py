@@ -0,0 +1,172 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mcts.compact_graph import CompactTree
+from mcts.evaluators import EvaluatorPolicy, LinearEvaluator
+from mcts.graph import StateNode, TranspositionTable, get_actions_and_states
+from mcts.mcts import MCTS
+from mcts.snapshot import save, load
+
+import mcts.tree_policies as tree_policies
+import mcts.default_policies as default_policies
+import mcts.backups as backups
+
+from helpers import GridState, WideState, assert_consistent
+
+
+def _search(root, n=200, **kwargs):
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(0.6), **kwargs)
+    return uct(root, n=n)
+
+
+def _statistics(root):
+    # a compact tree also holds the actions, which have no node otherwise
+    action_nodes, state_nodes = get_actions_and_states(root)
+    return (sorted((repr(a.action), a.n, a.q) for a in action_nodes
+                   if a.n > 0),
+            sorted((repr(s.state), s.n, s.q, s.reward) for s in state_nodes))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load(toy_world_state, tmpdir, mmap):
+    root = StateNode(None, toy_world_state)
+    _search(root)
+
+    save(root, str(tmpdir))
+    tree = load(str(tmpdir), mmap=mmap)
+
+    assert _statistics(tree.root) == _statistics(root)
+    _, state_nodes = get_actions_and_states(root)
+    assert len(tree) == 5 * len(state_nodes)
+
+
+def test_save_compact_tree(toy_world_state, tmpdir):
+    tree = CompactTree(toy_world_state)
+    _search(tree.root)
+
+    save(tree.root, str(tmpdir))
+    loaded = load(str(tmpdir))
+
+    assert len(loaded) == len(tree)
+    assert _statistics(loaded.root) == _statistics(tree.root)
+
+
+def test_warm_start(toy_world_state, tmpdir):
+    root = StateNode(None, toy_world_state)
+    _search(root)
+    save(root, str(tmpdir))
+
+    tree = load(str(tmpdir))
+    size = len(tree)
+    best_action = _search(tree.root, n=100)
+
+    assert best_action in toy_world_state.actions
+    assert tree.root.n == 300
+    assert len(tree) > size
+    assert_consistent(tree.root)
+    action_nodes, _ = get_actions_and_states(tree.root)
+    for action in action_nodes:
+        # sampling known outcomes must not duplicate them
+        states = [s.state for s in action.children.values()]
+        assert len(states) == len(set(states))
+
+    # the files are not changed by the search
+    assert load(str(tmpdir)).root.n == 200
+
+
+def test_save_evicted(toy_world_state, tmpdir):
+    root = StateNode(None, toy_world_state)
+    _search(root, max_nodes=30)
+    action_nodes, _ = get_actions_and_states(root)
+    assert any(a.evicted is not None for a in action_nodes)
+
+    save(root, str(tmpdir))
+    tree = load(str(tmpdir))
+
+    def evicted(nodes):
+        return sorted((a.n, a.evicted or (0., 0)) for a in nodes if a.n > 0)
+
+    loaded, _ = get_actions_and_states(tree.root)
+    assert evicted(loaded) == evicted(action_nodes)
+    assert_consistent(tree.root)
+
+
+def test_save_priors(tmpdir):
+    root = StateNode(None, WideState(width=3))
+    root.expand([.7, .3, None])
+
+    save(root, str(tmpdir))
+    tree = load(str(tmpdir))
+    assert [tree.root.children[a].prior for a in range(3)] == [.7, .3, None]
+
+    # a loaded tree is searched further with priors
+    priors = np.zeros((1, 3))
+    priors[0, 2] = 10
+    evaluator = LinearEvaluator(lambda state: [1.], priors, [0.])
+    uct = MCTS(tree_policies.PUCT(1), EvaluatorPolicy(evaluator),
+               backups.Bellman(.5), rng=1)
+    uct(tree.root, n=20)
+    assert tree.root.n == 20
+    assert tree.root.children[2].prior > .99
+    assert_consistent(tree.root)
+
+
+def test_serializer(toy_world_state, tmpdir):
+    class Serializer(object):
+        loaded = 0
+
+        def dumps(self, item):
+            return pickle.dumps(item, protocol=2)
+
+        def loads(self, data):
+            self.loaded += 1
+            return pickle.loads(data)
+
+    root = StateNode(None, toy_world_state)
+    _search(root, n=50)
+
+    serializer = Serializer()
+    save(root, str(tmpdir), serializer)
+    tree = load(str(tmpdir), serializer)
+    assert serializer.loaded == 0
+
+    assert tree.root.state == toy_world_state
+    assert serializer.loaded == 1
+
+
+def test_shared_objects(toy_world_state, tmpdir):
+    root = StateNode(None, toy_world_state)
+    _search(root)
+    save(root, str(tmpdir))
+    tree = load(str(tmpdir))
+
+    _, state_nodes = get_actions_and_states(tree.root)
+    states = [s.state for s in state_nodes]
+    # the states share one world and one stream as the saved ones did
+    assert len(set(id(s.world) for s in states)) == 1
+    assert len(set(id(s.rng) for s in states)) == 1
+    draws = [s.rng.random() for s in states[:10]]
+    assert len(set(draws)) == len(draws)
+
+    # which is only stored once
+    size = tmpdir.join('payload.bin').size()
+    assert size < len(states) * len(pickle.dumps(toy_world_state.rng))
+
+
+def test_shared_nodes_can_not_be_saved(tmpdir):
+    root = StateNode(None, GridState())
+    _search(root, n=50, transpositions=TranspositionTable())
+
+    with pytest.raises(ValueError):
+        save(root, str(tmpdir))
+
+
+def test_unsupported_version(toy_world_state, tmpdir):
+    save(StateNode(None, toy_world_state), str(tmpdir))
+    meta = tmpdir.join('meta.json')
+    meta.write(meta.read().replace('"version": 2', '"version": 1'))
+    with pytest.raises(ValueError):
+        load(str(tmpdir))
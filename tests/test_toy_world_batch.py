@@ -0,0 +1,91 @@
+from __future__ import division
+
+import pytest
+
+from mcts.states.toy_world_batch import ToyWorldBatch
+from mcts.states.toy_world_state import *
+
+
+@pytest.fixture
+def world():
+    return ToyWorld((10, 10), True, (5, 6), np.array([100, 100]))
+
+
+def test_states_round_trip(world):
+    states = [ToyWorldState(np.array([i, 2 * i]), world) for i in range(3)]
+    states = [s.perform(s.actions[1]) for s in states]
+
+    batch = ToyWorldBatch.from_states(states)
+    assert len(batch) == 3
+    assert batch.pos.shape == (3, 2)
+    assert batch.belief.shape == (3, 4, 4)
+
+    for i, state in enumerate(states):
+        assert batch.state(i) == state
+        for a in state.actions:
+            assert (batch.state(i).belief[a] == state.belief[a]).all()
+
+
+def test_perform_distribution(world):
+    n = 3000
+    belief = np.tile([[10, 1, 1, 1], [1, 10, 1, 1], [1, 1, 10, 1],
+                      [1, 1, 1, 10]], (n, 1, 1))
+    batch = ToyWorldBatch(np.tile([5, 5], (n, 1)), world, belief)
+
+    new_batch = batch.perform(np.zeros(n, dtype=int))
+
+    outcomes = (new_batch.belief - batch.belief)[:, 0].mean(0)
+    expectation = np.array([10, 1, 1, 1]) / 13
+    assert (np.abs(outcomes - expectation) < 3 / np.sqrt(n)).all()
+    assert (new_batch.belief - batch.belief).sum((1, 2)).tolist() == [1] * n
+
+
+def test_perform_matches_state(world):
+    pos = [(0, 0), (0, 0), (10, 10), (3, 4), (1, 1)]
+    actions = [1, 3, 2, 0, 2]
+    # deterministic beliefs, every action does what it says
+    belief = dict(zip(ToyWorldState((0, 0), world).actions,
+                      [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0],
+                       [0, 0, 0, 1]]))
+    states = [ToyWorldState(np.array(p), world, belief) for p in pos]
+
+    new_batch = ToyWorldBatch.from_states(states).perform(actions)
+
+    for i, (state, action) in enumerate(zip(states, actions)):
+        expected = state.perform(state.actions[action])
+        assert (new_batch.pos[i] == expected.pos).all()
+        for a in state.actions:
+            assert (new_batch.belief[i][state.actions.index(a)] ==
+                    expected.belief[a]).all()
+
+
+def test_reward_matches_state(world):
+    states = [ToyWorldState(np.array([i, 6]), world) for i in range(4, 7)]
+    children = [s.perform(s.actions[i]) for i, s in enumerate(states)]
+    parents = ToyWorldBatch.from_states(states)
+    batch = ToyWorldBatch.from_states(children)
+
+    rewards = batch.reward(parents)
+    for reward, child, parent in zip(rewards, children, states):
+        assert reward == pytest.approx(child.reward(parent, None))
+
+
+def test_random_roll_out(world):
+    batch = ToyWorldBatch(np.tile([0, 0], (100, 1)), world)
+    rewards = batch.random_roll_out(5)
+    assert rewards.shape == (100,)
+    assert (rewards >= -5).all()
+
+
+def test_roll_out_batch(world):
+    other = ToyWorld((10, 10), False, (5, 6), np.array([100, 100]))
+    parents = [ToyWorldState(np.array([i, 0]), w)
+               for i, w in enumerate([world, other, world])]
+    states = [s.perform(s.actions[0]) for s in parents]
+
+    rewards = ToyWorldState.roll_out_batch(states, parents, 1)
+    for reward, state, parent in zip(rewards, states, parents):
+        assert reward == pytest.approx(state.reward(parent, None))
+    assert (ToyWorldState.roll_out_batch(states, parents, 0) == 0).all()
+    assert (ToyWorldState.roll_out_batch(states, parents, 4, rng=0) >=
+            -4 - 1e-9).all()
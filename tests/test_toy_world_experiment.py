@@ -0,0 +1,58 @@
+import json
+
+from experiments import toy_world
+
+
+def _record(run, **kwargs):
+    record = dict(intrinsic=False, gamma=.6, c=10, mc_n=5, run=run,
+                  seed=run, steps=2, trajectory=[[50, 50]], reached=False)
+    record.update(kwargs)
+    return record
+
+
+def test_finished_without_results(tmpdir):
+    assert toy_world._finished(str(tmpdir.join('missing.jsonl'))) == set()
+
+
+def test_finished_truncates_partial_line(tmpdir):
+    results = tmpdir.join('results.jsonl')
+    lines = [json.dumps(_record(run)) + "\n" for run in range(2)]
+    partial = json.dumps(_record(2))[:20]
+    results.write("".join(lines) + partial)
+
+    done = toy_world._finished(str(results))
+    assert done == set(toy_world._key(_record(run)) for run in range(2))
+    # the cut off run is removed, so it is appended as a whole line again
+    assert results.read() == "".join(lines)
+
+
+def test_finished_skips_unknown_lines(tmpdir):
+    results = tmpdir.join('results.jsonl')
+    results.write("not json\n" + json.dumps(dict(run=0)) + "\n" +
+                  json.dumps(_record(1)) + "\n")
+    assert toy_world._finished(str(results)) == {toy_world._key(_record(1))}
+
+
+def test_run_experiment_resumes(tmpdir):
+    results = str(tmpdir.join('results.jsonl'))
+    kwargs = dict(intrinsic_motivation=False, gamma=.6, c=10, mc_n=5,
+                  steps=2, results=results)
+    toy_world.run_experiment(runs=2, **kwargs)
+    with open(results) as f:
+        first = f.readlines()
+    assert len(first) == 2
+
+    toy_world.run_experiment(runs=3, **kwargs)
+    with open(results) as f:
+        lines = f.readlines()
+    assert lines[:2] == first
+    assert sorted(json.loads(line)['run'] for line in lines) == [0, 1, 2]
+
+
+def test_results_name():
+    name = toy_world.results_name([False, True], [.6], 10, [500], 100, 0)
+    assert name == toy_world.results_name([False, True], [.6], 10, [500],
+                                          100, 0)
+    assert name != toy_world.results_name([False, True], [.6], 10, [500],
+                                          100, 1)
+    assert name.endswith(".jsonl")
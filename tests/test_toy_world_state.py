@@ -42,3 +42,28 @@ def test_perform():
     assert (outcomes < expectation + deviation).all()
 
 
+def test_perform_copy_on_write():
+    world = ToyWorld((100, 100), False, (0, 0), np.array([100, 100]))
+    state = ToyWorldState(np.array([50, 50]), world)
+    action = state.actions[0]
+
+    new_state = state.perform(action)
+
+    assert np.sum(new_state.belief[action]) == 5
+    assert np.sum(state.belief[action]) == 4
+    for a in state.actions[1:]:
+        assert new_state.belief[a] is state.belief[a]
+
+
+def test_perform_stays_in_world():
+    world = ToyWorld((3, 3), False, (0, 0), np.array([100, 100]))
+    belief = dict(zip(ToyWorldState((0, 0), world).actions,
+                      [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0],
+                       [0, 0, 0, 1]]))
+
+    for pos, action, expected in [((0, 0), 1, (0, 0)), ((0, 0), 3, (0, 0)),
+                                  ((3, 3), 0, (3, 3)), ((3, 3), 2, (3, 3)),
+                                  ((1, 2), 0, (1, 3)), ((1, 2), 3, (0, 2))]:
+        state = ToyWorldState(np.array(pos), world, belief)
+        new_state = state.perform(state.actions[action])
+        assert (new_state.pos == np.array(expected)).all()
@@ -1,15 +1,24 @@
-import pytest
+import gc
 import random
+import threading
+import weakref
+
+import pytest
 
-from mcts.graph import (depth_first_search, _get_actions_and_states, StateNode)
+from mcts.graph import (depth_first_search, _get_actions_and_states, StateNode,
+                        TranspositionTable, get_actions_and_states,
+                        iter_breadth_first)
 from mcts.mcts import *
-from mcts.utils import rand_max
+from mcts.utils import rand_max, rand_argmax, RandomStream
 from mcts.states.toy_world_state import *
 
 import mcts.tree_policies as tree_policies
 import mcts.default_policies as default_policies
 import mcts.backups as backups
 
+from helpers import (UCBTestState, ComplexTestState, ComplexTestAction,
+                      GridState, WideState, assert_consistent)
+
 
 parametrize_gamma = pytest.mark.parametrize("gamma",
                                             [.1, .2, .3, .4, .5, .6, .7, .8,
@@ -23,27 +32,6 @@ def eps():
     return 10e-3
 
 
-class UCBTestState(object):
-    def __init__(self, id=0):
-        self.actions = [0]
-        self.hash = id
-
-    def perform(self, action):
-        return UCBTestState(self.hash+1)
-
-    def is_terminal(self):
-        return False
-
-    def reward(self, parent, action):
-        return -1
-
-    def __hash__(self):
-        return self.hash
-
-    def __eq__(self, other):
-        return self.hash == other.hash
-
-
 def test_ucb1():
     ucb1 = tree_policies.UCB1(1)
     parent = StateNode(None, UCBTestState())
@@ -77,38 +65,6 @@ def test_ucb1_c0():
     assert ucb1(an) == 19
 
 
-class ComplexTestState(object):
-    def __init__(self, name):
-        self.actions = [ComplexTestAction('a'), ComplexTestAction('b')]
-        self.name = name
-
-    def perform(self, action):
-        return ComplexTestState(action.name)
-
-    def is_terminal(self):
-        return False
-
-    def reward(self, parent, action):
-        return -1
-
-    def __hash__(self):
-        return self.name.__hash__()
-
-    def __eq__(self, other):
-        return self.name == other.name
-
-
-class ComplexTestAction(object):
-    def __init__(self, name):
-        self.name = name
-
-    def __hash__(self):
-        return self.name.__hash__()
-
-    def __eq__(self, other):
-        return self.name == other.name
-
-
 def test_best_child():
     parent = StateNode(None, ComplexTestState('root'))
     an0 = parent.children[ComplexTestAction('a')]
@@ -175,17 +131,9 @@ def test_sample_state():
     assert ComplexTestState('a') in child.children
 
 
-@pytest.fixture
-def toy_world_root():
-    world = ToyWorld((100, 100), False, (10, 10), np.array([100, 100]))
-    state = ToyWorldState((0, 0), world)
-    root = StateNode(None, state)
-    return root, state
-
-
 @parametrize_gamma
 def test_single_run_uct_search(toy_world_root, gamma):
-    root, state = toy_world_root
+    root = toy_world_root
     random.seed()
 
     uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
@@ -223,7 +171,7 @@ def test_single_run_uct_search(toy_world_root, gamma):
 @parametrize_gamma
 @parametrize_n
 def test_n_run_uct_search(toy_world_root, gamma, n):
-    root, state = toy_world_root
+    root = toy_world_root
     random.seed()
 
     uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
@@ -232,17 +180,11 @@ def test_n_run_uct_search(toy_world_root, gamma, n):
 
     assert root.n == n
 
+    assert_consistent(root)
+
     action_nodes, state_nodes = depth_first_search(root,
                                                    _get_actions_and_states)
-
-    for action in action_nodes:
-        assert action.n == np.sum([state.n
-                                   for state in action.children.values()])
-
     for state in state_nodes:
-        assert state.n >= np.sum([action.n
-                                  for action
-                                  in state.children.values()]) >= state.n - 1
         if state.parent is not None:
             assert (np.array(list(state.state.belief.values())).sum() - 1 ==
                     np.array(list(state.parent.parent.state.belief.values())).
@@ -267,3 +209,260 @@ def test_q_value_complex_state(gamma, eps):
                backups.Bellman(gamma))
     uct(root=root, n=1500)
     assert root.q - (-1./(1 - gamma)) < eps
+
+
+def test_rand_argmax():
+    assert rand_argmax([1, 4, 5, 3]) == 2
+    assert rand_argmax([np.nan, -1, -2]) == 1
+
+    picks = set(rand_argmax([1, 3, 3, 0, 3]) for _ in range(200))
+    assert picks == {1, 2, 4}
+
+
+def test_random_stream():
+    a, b = RandomStream(3, block_size=7), RandomStream(3)
+    assert [a.random() for _ in range(20)] == [b.random() for _ in range(20)]
+    assert all(0 <= a.randrange(5) < 5 for _ in range(100))
+    assert set(a.choice('xyz') for _ in range(100)) == set('xyz')
+
+    s0, s1 = RandomStream(3).spawn(2)
+    t0, t1 = RandomStream(3).spawn(2)
+    assert s1.random() == t1.random()
+    assert s0.random() != s1.random()
+
+
+def test_random_stream_shared_by_threads():
+    stream = RandomStream(3, block_size=16)
+    drawn = []
+
+    def draw():
+        drawn.extend(stream.random() for _ in range(1000))
+
+    threads = [threading.Thread(target=draw) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(drawn)) == 4000
+
+
+def _seeded_search(seed):
+    world = ToyWorld((100, 100), False, (10, 10), np.array([100, 100]))
+    root = StateNode(None, ToyWorldState((0, 0), world, rng=seed))
+    uct = MCTS(tree_policies.UCB1(1.41),
+               default_policies.RandomKStepRollOut(3, rng=seed),
+               backups.Bellman(0.6), rng=seed)
+    action = uct(root, n=100)
+    action_nodes, state_nodes = get_actions_and_states(root)
+    return (action, [(a.action, a.n, a.q) for a in action_nodes],
+            [(tuple(s.state.pos), s.n, s.q) for s in state_nodes])
+
+
+def test_seeded_search_is_reproducible():
+    assert _seeded_search(5) == _seeded_search(5)
+    assert _seeded_search(5) != _seeded_search(6)
+
+
+@pytest.mark.parametrize("c", [0, 1, 1.41])
+def test_ucb1_batch(c):
+    ucb1 = tree_policies.UCB1(c)
+    parent = StateNode(None, ComplexTestState('root'))
+    an0 = parent.children[ComplexTestAction('a')]
+    an1 = parent.children[ComplexTestAction('b')]
+    an0.q, an0.n = 2, 3
+    an1.q, an1.n = 1, 5
+    parent.n = 8
+
+    action_nodes, q, n = parent.child_statistics()
+    scores = ucb1.batch(action_nodes, q, n, parent.n)
+    assert np.allclose(scores, [ucb1(a) for a in action_nodes])
+
+    scores = tree_policies.flat.batch(action_nodes, q, n, parent.n)
+    assert (scores == 0).all()
+
+
+def test_time_budget(toy_world_root):
+    root = toy_world_root
+    state = root.state
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6))
+    best_action, stats = uct(root, n=10 ** 9, time_budget=0.05,
+                             return_stats=True)
+
+    assert best_action in state.actions
+    assert stats is uct.last_search
+    assert stats.stop_reason == 'time'
+    assert stats.iterations == root.n
+    assert stats.elapsed < 1.
+
+
+def test_node_budget(toy_world_root):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6))
+    uct(root, n=10 ** 9, node_budget=100)
+
+    stats = uct.last_search
+    assert stats.stop_reason == 'nodes'
+    assert 100 <= stats.nodes
+
+    action_nodes, state_nodes = get_actions_and_states(root)
+    assert stats.nodes == len(action_nodes) + len(state_nodes) - 1
+
+
+def test_iteration_budget(toy_world_root):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6))
+    uct(root, n=23)
+    assert uct.last_search.stop_reason == 'iterations'
+    assert uct.last_search.iterations == 23
+
+
+def test_profile(toy_world_root):
+    root = toy_world_root
+    simulated = []
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6), rng=2,
+               callbacks={'simulation': lambda node, t: simulated.append(t)})
+    uct(root, n=50)
+
+    profile = uct.last_profile
+    assert uct.profile
+    # the toy world is never terminal, so every iteration expands
+    assert profile.calls == dict(selection=50, expansion=50, simulation=50,
+                                 backup=50)
+    assert len(simulated) == 50
+    assert profile.time['simulation'] == pytest.approx(sum(simulated))
+    assert profile.nodes == uct.last_search.nodes
+    assert sum(profile.depths.values()) == 50
+    assert 0 < profile.hit_rate < 1
+    assert "selection" in str(profile)
+
+
+@pytest.mark.parametrize("tree_policy", [tree_policies.UCB1(1.41),
+                                         tree_policies.PUCT(1.41)])
+def test_profile_does_not_change_search(tree_policy):
+    # the profiled search selects the same leaves
+    roots = []
+    for profile in [False, True]:
+        root = StateNode(None, GridState())
+        uct = MCTS(tree_policy, default_policies.immediate_reward,
+                   backups.Bellman(.6), rng=3, profile=profile)
+        uct(root, n=100)
+        roots.append(root)
+    assert ([(x.n, x.q) for x in iter_breadth_first(roots[0])] ==
+            [(x.n, x.q) for x in iter_breadth_first(roots[1])])
+    assert uct.last_profile.nodes == uct.last_search.nodes
+
+
+def test_profile_off_by_default(toy_world_root):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6))
+    uct(root, n=10)
+    assert uct.last_profile is None
+
+    with pytest.raises(ValueError):
+        MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+             backups.Bellman(.6), threads=2, profile=True)
+    with pytest.raises(ValueError):
+        MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+             backups.Bellman(.6), callbacks={'rollout': print})
+
+
+def test_early_stop():
+    # the action 0 is far better, so the other one soon can not catch up
+    root = StateNode(None, WideState(width=2))
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.monte_carlo, rng=0)
+    best_action = uct(root, n=200, early_stop=True)
+
+    stats = uct.last_search
+    assert best_action == 0
+    assert stats.stop_reason == 'early'
+    assert stats.iterations < 200
+    best, other = root.children[0], root.children[1]
+    assert best.q > other.q
+    assert best.n - other.n > 200 - stats.iterations
+
+
+def test_reroot(toy_world_root):
+    root = toy_world_root
+    state = root.state
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6))
+    best_action = uct(root, n=200)
+
+    action_node = root.children[best_action]
+    child = max(action_node.children.values(), key=lambda x: x.n)
+    sibling_action = [a for a in root.children if a != best_action][0]
+    sibling = root.children[sibling_action]
+    observed = ToyWorldState(child.state.pos, child.state.world)
+
+    new_root, kept = root.reroot(best_action, observed)
+
+    assert new_root is child
+    assert new_root.parent is None
+    assert new_root.state is observed
+    assert kept.visits == child.n
+    assert kept.nodes == sum(len(x) for x in get_actions_and_states(child))
+    assert len(root.children) == 0
+    assert sibling.parent is root
+
+    uct(new_root, n=10)
+    assert new_root.n == kept.visits + 10
+
+
+def test_reroot_frees_dropped_subtrees(toy_world_root):
+    root = toy_world_root
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.IncrementalBellman(.6), rng=1)
+    best_action = uct(root, n=100)
+    child = max(root.children[best_action].children.values(),
+                key=lambda x: x.n)
+    sibling_action = [a for a in root.children if a != best_action][0]
+    dropped = weakref.ref(root.children[sibling_action])
+
+    new_root, _ = root.reroot(best_action, child.state)
+    gc.collect()
+    assert dropped() is None
+    assert root.backup_cache is None
+    assert root.pending_actions
+
+
+def test_reroot_with_transpositions():
+    table = TranspositionTable()
+    root = StateNode(None, GridState())
+    uct = MCTS(tree_policies.UCB1(1.41), default_policies.immediate_reward,
+               backups.Bellman(.6), transpositions=table, rng=1)
+    uct(root, n=200)
+    size = len(table)
+
+    new_root, kept = root.reroot((1, 0), GridState(1, 0), table)
+    _, state_nodes = get_actions_and_states(new_root)
+    assert set(table._nodes.values()) == set(state_nodes)
+    assert len(table) == len(state_nodes) < size
+    # the parents of shared nodes point into the kept subtree
+    for node in state_nodes:
+        while node.parent is not None:
+            node = node.parent.parent
+        assert node is new_root
+
+    uct(new_root, n=100)
+    assert new_root.n == kept.visits + 100
+    assert_consistent(new_root)
+
+
+def test_reroot_unseen_state(toy_world_root):
+    root = toy_world_root
+    state = root.state
+    observed = ToyWorldState(np.array([5, 5]), state.world)
+
+    new_root, kept = root.reroot(state.actions[0], observed)
+
+    assert new_root.parent is None
+    assert new_root.state is observed
+    assert new_root.n == 0
+    assert kept.nodes == 1
+    assert kept.visits == 0